@@ -1,35 +1,22 @@
 from openai import AsyncOpenAI
 from app.config import settings
+from app.conversation_store import conversation_store
+from app.history import split_history, merge_summary, summary_message, summary_text, history_tokens
+from app.metrics import stage
+from prometheus_client import Counter, Histogram
+import asyncio
 import logging
+import re
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional
 
 logger = logging.getLogger(__name__)
 
 # Initialize OpenAI client
-client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
 
-# Conversation history storage (in-memory for simplicity)
-# In production, use Redis or database
-conversation_history = {}
-
-
-async def get_ai_response(user_phone: str, user_message: str) -> str:
-    """
-    Get AI response using OpenAI Chat API
-    
-    Args:
-        user_phone: User's phone number (used as conversation ID)
-        user_message: User's message text
-        
-    Returns:
-        AI response text
-    """
-    try:
-        # Get or create conversation history for this user
-        if user_phone not in conversation_history:
-            conversation_history[user_phone] = [
-                {
-                    "role": "system",
-                    "content": """Je bent Saman, een vriendelijke medewerker voor Propest AI. Reageer ALTIJD in het Nederlands.
+# System prompt (prepended to every request, not stored in history)
+SYSTEM_PROMPT = """Je bent Saman, een vriendelijke medewerker voor Propest AI. Reageer ALTIJD in het Nederlands.
 
 **SPREEK NATUURLIJK zoals een echt persoon:**
 - Gebruik tussenwerpingen: "nou", "kijk", "weet je", "eigenlijk", "dus"
@@ -70,47 +57,294 @@ Wanneer iemand interesse toont: "Leuk! Nou, laat me even een paar dingetjes vrag
 - Max 1-2 "uhm" per antwoord (niet meer!)
 - Maar WEL natuurlijke pauzes en flow
 - ALTIJD Nederlands"""
-                }
-            ]
+
+
+# Sentence end: punctuation (plus closing quotes/brackets) followed by whitespace
+SENTENCE_BOUNDARY = re.compile(r'[.!?]+["\')\]]*\s+')
+
+# Don't send tiny fragments ("Ja!") to TTS on their own
+MIN_SENTENCE_LENGTH = 20
+
+# Sent when the LLM call fails; never stored in the history
+ERROR_REPLY = "Sorry, I encountered an error. Please try again."
+
+SUMMARY_PROMPT = """Summarize this WhatsApp conversation between a user and Saman (the assistant) for Saman's memory.
+Keep names, facts, the user's problem, needs, budget and answers to qualification questions, and anything promised.
+Write in the language of the conversation, at most a few short sentences. Start from the existing summary if there is one."""
+
+PROMPT_HISTORY_TOKENS = Histogram(
+    "voicebot_prompt_history_tokens",
+    "Conversation history tokens sent with each chat request (summary + recent turns)",
+    buckets=(100, 250, 500, 1000, 1500, 2000, 3000, 4000, 6000)
+)
+HISTORY_SUMMARIES = Counter(
+    "voicebot_history_summaries_total",
+    "Background summaries of turns that fell out of the history budget",
+    ["result"]
+)
+
+# Background summaries in flight, one per user
+_summary_tasks: Dict[str, asyncio.Task] = {}
+_summary_stats = {"completed": 0, "failed": 0, "stale": 0, "turns_folded": 0, "seconds_total": 0.0}
+
+
+async def _build_messages(user_phone: str, user_entry: dict) -> List[dict]:
+    """
+    System prompt + summary + recent history + new message
+    
+    The newest turns that fit in CONVERSATION_TOKEN_BUDGET tokens are sent.
+    Older turns are folded into the running summary in the background.
+    """
+    history = await conversation_store.get_messages(user_phone)
+    summary, recent, dropped = split_history(
+        history, settings.CONVERSATION_TOKEN_BUDGET, settings.CONVERSATION_MAX_MESSAGES
+    )
+    
+    if dropped and settings.CONVERSATION_SUMMARY_ENABLED:
+        _schedule_summary(user_phone, summary, dropped)
+    
+    context = ([summary] if summary is not None else []) + recent
+    PROMPT_HISTORY_TOKENS.observe(history_tokens(context))
+    return [{"role": "system", "content": SYSTEM_PROMPT}] + context + [user_entry]
+
+
+def _schedule_summary(user_phone: str, summary: Optional[dict], dropped: List[dict]):
+    """Fold `dropped` into the user's summary off the reply path"""
+    if user_phone in _summary_tasks:
+        return
+    task = asyncio.create_task(_update_summary(user_phone, summary, dropped))
+    _summary_tasks[user_phone] = task
+    
+    def forget(done: asyncio.Task):
+        if _summary_tasks.get(user_phone) is done:
+            del _summary_tasks[user_phone]
+    
+    task.add_done_callback(forget)
+
+
+async def _update_summary(user_phone: str, summary: Optional[dict], dropped: List[dict]):
+    started = time.perf_counter()
+    transcript = "\n".join(f"{m['role']}: {m['content']}" for m in dropped)
+    previous = summary_text(summary)
+    try:
+        response = await client.chat.completions.create(
+            model=settings.OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": f"Existing summary:\n{previous or '(none)'}\n\nConversation:\n{transcript}"}
+            ],
+            max_tokens=settings.CONVERSATION_SUMMARY_MAX_TOKENS,
+            temperature=0.2
+        )
+        new_summary = summary_message(response.choices[0].message.content.strip())
         
-        # Add user message to history
-        conversation_history[user_phone].append({
+        # Turns may have been added while the summary was generated
+        folded = ([summary] if summary is not None else []) + dropped
+        merged = merge_summary(await conversation_store.get_messages(user_phone), folded, new_summary)
+        if merged is None:
+            _summary_stats["stale"] += 1
+            HISTORY_SUMMARIES.labels("stale").inc()
+            logger.info(f" History of {user_phone} changed during summarization, summary dropped")
+            return
+        await conversation_store.replace(user_phone, merged)
+    except Exception as e:
+        _summary_stats["failed"] += 1
+        HISTORY_SUMMARIES.labels("failed").inc()
+        logger.warning(f" History summary failed for {user_phone}: {e}")
+        return
+    
+    _summary_stats["completed"] += 1
+    _summary_stats["turns_folded"] += len(dropped)
+    _summary_stats["seconds_total"] += time.perf_counter() - started
+    HISTORY_SUMMARIES.labels("completed").inc()
+    logger.info(f" Folded {len(dropped)} messages into the history summary for {user_phone}")
+
+
+def history_stats() -> Dict[str, Any]:
+    """Background summarization stats"""
+    completed = _summary_stats["completed"]
+    return {
+        "token_budget": settings.CONVERSATION_TOKEN_BUDGET,
+        "summaries_in_flight": len(_summary_tasks),
+        "summaries": completed,
+        "failed": _summary_stats["failed"],
+        "stale": _summary_stats["stale"],
+        "turns_folded": _summary_stats["turns_folded"],
+        "avg_summary_seconds": round(_summary_stats["seconds_total"] / completed, 3) if completed else 0.0
+    }
+
+
+async def remember_reply(user_phone: str, user_message: str, ai_message: str):
+    """
+    Add a user message and the reply to it to the conversation history
+    
+    Callers that may still drop the reply (superseded, past its deadline)
+    call this once it has been delivered. The error reply is not stored.
+    """
+    if ai_message == ERROR_REPLY:
+        return
+    await conversation_store.append(user_phone, {
+        "role": "user",
+        "content": user_message
+    }, {
+        "role": "assistant",
+        "content": ai_message
+    })
+
+
+async def get_ai_response(user_phone: str, user_message: str, remember: bool = True) -> str:
+    """
+    Get AI response using OpenAI Chat API
+    
+    Args:
+        user_phone: User's phone number (used as conversation ID)
+        user_message: User's message text
+        remember: Add the turn to the history now; pass False to do it with
+                  remember_reply() once the reply is delivered
+        
+    Returns:
+        AI response text
+    """
+    try:
+        user_entry = {
             "role": "user",
             "content": user_message
-        })
-        
-        # Keep only last 10 messages to avoid token limits
-        if len(conversation_history[user_phone]) > 11:  # 1 system + 10 messages
-            conversation_history[user_phone] = [
-                conversation_history[user_phone][0]  # Keep system message
-            ] + conversation_history[user_phone][-10:]  # Keep last 10 messages
+        }
+        messages = await _build_messages(user_phone, user_entry)
         
         # Get AI response
-        response = await client.chat.completions.create(
-            model=settings.OPENAI_MODEL,
-            messages=conversation_history[user_phone],
-            max_tokens=500,
-            temperature=0.7
-        )
+        async with stage("get_ai_response", upstream="openai"):
+            response = await client.chat.completions.create(
+                model=settings.OPENAI_MODEL,
+                messages=messages,
+                max_tokens=500,
+                temperature=0.7
+            )
         
         ai_message = response.choices[0].message.content
         
-        # Add AI response to history
-        conversation_history[user_phone].append({
-            "role": "assistant",
-            "content": ai_message
-        })
+        if remember:
+            await remember_reply(user_phone, user_message, ai_message)
         
         logger.info(f" AI response generated for {user_phone}")
         return ai_message
     
     except Exception as e:
         logger.error(f" Error getting AI response: {e}")
-        return "Sorry, I encountered an error. Please try again."
+        return ERROR_REPLY
+
+
+async def _read_reply_stream(user_phone: str, user_message: str, sentences: "asyncio.Queue[Optional[str]]") -> str:
+    """
+    Read a streaming chat completion, queueing each sentence as it completes
+    
+    Runs as its own task, so the get_ai_response stage times the LLM alone
+    and not the TTS work done on the sentences meanwhile. The OpenAI stream
+    is closed however the task ends (cancelled included), and the queue is
+    always ended with None.
+    
+    Returns:
+        The full reply text (ERROR_REPLY if the request failed before any text)
+    """
+    user_entry = {
+        "role": "user",
+        "content": user_message
+    }
+    parts: List[str] = []
+    buffer = ""
+    stream = None
+    
+    try:
+        try:
+            messages = await _build_messages(user_phone, user_entry)
+            
+            async with stage("get_ai_response", upstream="openai"):
+                stream = await client.chat.completions.create(
+                    model=settings.OPENAI_MODEL,
+                    messages=messages,
+                    max_tokens=500,
+                    temperature=0.7,
+                    stream=True
+                )
+                
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta.content
+                    if not delta:
+                        continue
+                    parts.append(delta)
+                    buffer += delta
+                    
+                    # Emit everything up to the last sentence boundary
+                    last_end = 0
+                    for match in SENTENCE_BOUNDARY.finditer(buffer):
+                        last_end = match.end()
+                    if last_end >= MIN_SENTENCE_LENGTH:
+                        sentences.put_nowait(buffer[:last_end].strip())
+                        buffer = buffer[last_end:]
+        
+        except Exception as e:
+            logger.error(f" Error streaming AI response: {e}")
+            if not parts:
+                sentences.put_nowait(ERROR_REPLY)
+                return ERROR_REPLY
+        
+        if buffer.strip():
+            sentences.put_nowait(buffer.strip())
+        return "".join(parts)
+    
+    finally:
+        if stream is not None:
+            try:
+                await stream.close()
+            except Exception as e:
+                logger.debug(f" Closing the AI response stream failed: {e}")
+        sentences.put_nowait(None)
+
+
+async def stream_ai_response(user_phone: str, user_message: str, remember: bool = True) -> AsyncIterator[str]:
+    """
+    Stream the AI response sentence by sentence
+    
+    Consumes a streaming chat completion and yields each complete sentence as
+    soon as it is available, so TTS can start before the reply is finished.
+    The completion is read in the background (see _read_reply_stream), so
+    it keeps streaming while the caller works on earlier sentences; closing
+    this generator early stops it.
+    With `remember`, the full reply is added to the conversation history
+    once the stream is consumed to the end.
+    
+    Args:
+        user_phone: User's phone number (used as conversation ID)
+        user_message: User's message text
+        remember: Add the turn to the history at the end; pass False to do it
+                  with remember_reply() once the reply is delivered
+        
+    Yields:
+        Reply sentences, in order
+    """
+    sentences: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+    reader = asyncio.create_task(_read_reply_stream(user_phone, user_message, sentences))
+    try:
+        while True:
+            sentence = await sentences.get()
+            if sentence is None:
+                break
+            yield sentence
+        ai_message = await reader
+    finally:
+        reader.cancel()
+    
+    if remember:
+        await remember_reply(user_phone, user_message, ai_message)
+    logger.info(f" AI response streamed for {user_phone}")
 
 
-def clear_conversation(user_phone: str):
+async def clear_conversation(user_phone: str):
     """Clear conversation history for a user"""
-    if user_phone in conversation_history:
-        del conversation_history[user_phone]
-        logger.info(f" Cleared conversation for {user_phone}")
+    task = _summary_tasks.pop(user_phone, None)
+    if task is not None:
+        task.cancel()
+    await conversation_store.clear(user_phone)
+    logger.info(f" Cleared conversation for {user_phone}")
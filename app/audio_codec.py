@@ -0,0 +1,723 @@
+import asyncio
+import io
+import logging
+import os
+import subprocess
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional
+from prometheus_client import Counter as PrometheusCounter
+from app.config import settings
+from app.metrics import tag_trace
+
+logger = logging.getLogger(__name__)
+
+try:
+    import av
+except ImportError:  # PyAV is optional, the ffmpeg CLI backend is used without it
+    av = None
+
+# WhatsApp voice note encoding, shared by both backends
+OUTPUT_SAMPLE_RATE = 16000  # WhatsApp voice standard: 16kHz
+OPUS_BITRATE = 16000  # Bitrate optimized for 16kHz voice
+OPUS_OPTIONS = {
+    "vbr": "on",  # Variable bitrate for better quality
+    "frame_duration": "60",  # 60ms frames (WhatsApp standard)
+    "application": "voip",  # Optimize for voice (not music)
+}
+
+# Encoding profiles: Opus compression_level (encoder complexity 0-10).
+# Lower levels cost far less CPU for a small quality loss at the same bitrate.
+OPUS_PROFILES = {
+    "quality": "10",  # Maximum compression quality
+    "balanced": "5",
+    "fast": "0",
+}
+
+ENCODE_PROFILES = PrometheusCounter(
+    "voicebot_encode_profile_total",
+    "Opus encodes by encoding profile",
+    ["profile"]
+)
+
+
+def ogg_output_args(profile: str = "quality") -> List[str]:
+    """ffmpeg output arguments for WhatsApp voice notes with an encoding profile"""
+    return [
+        '-ar', str(OUTPUT_SAMPLE_RATE),
+        '-c:a', 'libopus',
+        '-b:a', '16k',
+        '-vbr', OPUS_OPTIONS["vbr"],
+        '-compression_level', OPUS_PROFILES[profile],
+        '-frame_duration', OPUS_OPTIONS["frame_duration"],
+        '-application', OPUS_OPTIONS["application"],
+        '-f', 'ogg',
+        '-loglevel', 'error',  # Only show errors
+        'pipe:1'  # Write to stdout
+    ]
+
+
+class EncodeLoad:
+    """
+    Encodes in flight and the profile choice that follows from them
+
+    With OPUS_PROFILE=auto the profile drops to balanced, then fast, as load
+    rises. Load is the larger of encodes in flight per AUDIO_CODEC_WORKERS
+    and the 1-minute load average per CPU core, so a traffic spike costs a
+    little audio quality instead of queueing replies.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(1, capacity)
+        self.active = 0
+        self.profile_counts: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def begin(self):
+        with self._lock:
+            self.active += 1
+
+    def end(self):
+        with self._lock:
+            self.active -= 1
+
+    @property
+    def preferred_profile(self) -> str:
+        """Profile used when the box is not under pressure"""
+        return "quality" if settings.OPUS_PROFILE == "auto" else settings.OPUS_PROFILE
+
+    def load(self) -> float:
+        try:
+            cpu_load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):  # Not available on this platform
+            cpu_load = 0.0
+        return max(self.active / self.capacity, cpu_load)
+
+    def select_profile(self) -> str:
+        """Encoding profile for a new encode"""
+        if settings.OPUS_PROFILE != "auto":
+            return settings.OPUS_PROFILE
+        load = self.load()
+        if load >= settings.OPUS_FAST_LOAD:
+            return "fast"
+        if load >= settings.OPUS_BALANCED_LOAD:
+            return "balanced"
+        return "quality"
+
+    def resolve(self, profile: Optional[str]) -> str:
+        """Pick the profile (unless given) and record it in metrics and the message trace"""
+        profile = profile or self.select_profile()
+        self.profile_counts[profile] += 1
+        ENCODE_PROFILES.labels(profile).inc()
+        tag_trace("encode_profile", profile)
+        return profile
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "active_encodes": self.active,
+            "load": round(self.load(), 3),
+            "profile_setting": settings.OPUS_PROFILE,
+            "profiles": dict(self.profile_counts)
+        }
+
+
+# Global encode load tracker
+encode_load = EncodeLoad(capacity=settings.AUDIO_CODEC_WORKERS)
+
+
+def pcm_sample_rate(input_format: str) -> Optional[int]:
+    """Sample rate of a raw PCM format name (pcm_16000, pcm_24000...), None for MP3 etc."""
+    if input_format.startswith("pcm_"):
+        return int(input_format.split("_")[1])
+    return None
+
+
+ID3V2_HEADER_SIZE = 10
+
+
+def id3v2_tag_size(header: bytes) -> int:
+    """Bytes taken by an ID3v2 tag at the start of `header` (0 if there is none)"""
+    if len(header) < ID3V2_HEADER_SIZE or not header.startswith(b"ID3"):
+        return 0
+    # Tag size is a 28-bit "synchsafe" integer (7 bits per byte), excluding header and footer
+    size = 0
+    for byte in header[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = ID3V2_HEADER_SIZE if header[5] & 0x10 else 0
+    return ID3V2_HEADER_SIZE + size + footer
+
+
+class ID3v2Stripper:
+    """
+    Drops a leading ID3v2 tag from MP3 bytes that arrive in chunks
+
+    libav's bare MP3 parser (unlike its demuxer) fails on the tag that
+    ElevenLabs and ffmpeg put in front of the audio frames.
+    """
+
+    def __init__(self):
+        self._head = b""
+        self._skip: Optional[int] = None  # None until the header has been seen
+
+    def feed(self, data: bytes) -> bytes:
+        """Audio bytes of `data` with any tag bytes removed"""
+        if self._skip is None:
+            self._head += data
+            if len(self._head) < ID3V2_HEADER_SIZE and b"ID3".startswith(self._head[:3]):
+                return b""
+            data, self._head = self._head, b""
+            self._skip = id3v2_tag_size(data)
+        if self._skip:
+            skipped = min(self._skip, len(data))
+            self._skip -= skipped
+            data = data[skipped:]
+        return data
+
+    def flush(self) -> bytes:
+        """Bytes held back while waiting for a full header (very short input)"""
+        data, self._head = self._head, b""
+        return data
+
+
+def ffmpeg_encode_command(input_format: str, tempo: float = 1.0, profile: str = "quality") -> List[str]:
+    """
+    ffmpeg command encoding stdin to a WhatsApp voice note on stdout
+
+    Args:
+        input_format: ElevenLabs-style format name - pcm_<rate> for raw 16-bit mono
+                      PCM, anything else (mp3_44100_128...) is probed by ffmpeg
+        tempo: Playback speed (atempo filter), 1.0 = unchanged
+        profile: Encoding profile (see OPUS_PROFILES)
+
+    Returns:
+        ffmpeg argument list
+    """
+    sample_rate = pcm_sample_rate(input_format)
+    if sample_rate is not None:
+        command = ['ffmpeg', '-f', 's16le', '-ar', str(sample_rate), '-ac', '1', '-i', 'pipe:0']
+    else:
+        command = ['ffmpeg', '-i', 'pipe:0']
+    if tempo != 1.0:
+        command += ['-af', f'atempo={tempo}']
+    return command + ogg_output_args(profile)
+
+
+def ffmpeg_decode_command(sample_rate: int) -> List[str]:
+    """ffmpeg command decoding stdin to 16-bit mono PCM at `sample_rate` on stdout"""
+    return [
+        'ffmpeg',
+        '-i', 'pipe:0',
+        '-f', 's16le',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-loglevel', 'error',
+        'pipe:1'
+    ]
+
+
+class StreamingOggEncoder:
+    """
+    Long-running ffmpeg process that encodes audio while it is being written
+
+    Input chunks are written to ffmpeg's stdin as they become available and the
+    Ogg/Opus output is read concurrently, so encoding overlaps with whatever
+    produces the input (TTS segments, API deltas).
+    """
+
+    def __init__(self, command: List[str], profile: str = "quality"):
+        self.command = command
+        self.profile = profile
+        self._process: Optional[asyncio.subprocess.Process] = None
+        self._stdout_task: Optional[asyncio.Task] = None
+        self._stderr_task: Optional[asyncio.Task] = None
+        self._in_flight = False
+        self.bytes_in = 0
+
+    async def start(self):
+        """Spawn ffmpeg and start reading its output"""
+        self._process = await asyncio.create_subprocess_exec(
+            *self.command,
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        self._stdout_task = asyncio.create_task(self._read(self._process.stdout))
+        self._stderr_task = asyncio.create_task(self._read(self._process.stderr))
+        self._in_flight = True
+        encode_load.begin()
+
+    def _done(self):
+        if self._in_flight:
+            self._in_flight = False
+            encode_load.end()
+
+    @staticmethod
+    async def _read(stream: asyncio.StreamReader) -> bytes:
+        chunks = []
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b"".join(chunks)
+
+    async def write(self, data: bytes):
+        """Feed input audio to ffmpeg (waits if its pipe is full)"""
+        self.bytes_in += len(data)
+        self._process.stdin.write(data)
+        await self._process.stdin.drain()
+
+    async def finish(self) -> bytes:
+        """
+        Close ffmpeg's input and wait for the encoded output
+
+        Returns:
+            OGG audio bytes
+        """
+        try:
+            self._process.stdin.close()
+            await self._process.stdin.wait_closed()
+            ogg_data = await self._stdout_task
+            stderr = await self._stderr_task
+            await self._process.wait()
+        finally:
+            self._done()
+
+        if self._process.returncode != 0:
+            logger.error(f" ffmpeg conversion failed: {stderr.decode()}")
+            raise Exception(f"Audio conversion failed: {stderr.decode()}")
+
+        logger.info(f" ffmpeg streaming conversion successful: {self.bytes_in} → {len(ogg_data)} bytes")
+        return ogg_data
+
+    async def abort(self):
+        """Kill ffmpeg (after a failure upstream)"""
+        self._done()
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        for task in (self._stdout_task, self._stderr_task):
+            if task is not None:
+                task.cancel()
+
+
+class FfmpegCodec:
+    """
+    Codec backend running the ffmpeg CLI
+
+    Every conversion spawns an ffmpeg process. Needs only the ffmpeg binary.
+    """
+
+    name = "ffmpeg"
+
+    def open_encoder(self, input_format: str, tempo: float = 1.0,
+                     profile: Optional[str] = None) -> StreamingOggEncoder:
+        """
+        Streaming encoder for `input_format` (call start(), write()..., finish())
+
+        Args:
+            input_format: Format name (see ffmpeg_encode_command)
+            tempo: Playback speed, 1.0 = unchanged
+            profile: Encoding profile, None = chosen by current load
+        """
+        profile = encode_load.resolve(profile)
+        return StreamingOggEncoder(ffmpeg_encode_command(input_format, tempo, profile), profile)
+
+    async def encode(self, audio: bytes, input_format: str, tempo: float = 1.0,
+                     profile: Optional[str] = None) -> bytes:
+        """
+        Encode a complete input to a WhatsApp voice note
+
+        Args:
+            audio: Input audio bytes
+            input_format: Format name (see ffmpeg_encode_command)
+            tempo: Playback speed, 1.0 = unchanged
+            profile: Encoding profile, None = chosen by current load
+
+        Returns:
+            OGG audio bytes (16kHz, Opus codec)
+        """
+        encoder = self.open_encoder(input_format, tempo, profile)
+        await encoder.start()
+        try:
+            await encoder.write(audio)
+            return await encoder.finish()
+        except BaseException:
+            await encoder.abort()
+            raise
+
+    def encode_sync(self, audio: bytes, input_format: str, tempo: float = 1.0,
+                    profile: Optional[str] = None) -> bytes:
+        """Blocking variant of encode()"""
+        profile = encode_load.resolve(profile)
+        encode_load.begin()
+        try:
+            return self._run_sync(ffmpeg_encode_command(input_format, tempo, profile), audio)
+        finally:
+            encode_load.end()
+
+    async def decode_to_pcm(self, audio: bytes, sample_rate: int) -> bytes:
+        """
+        Decode any input (e.g. WhatsApp OGG/Opus) to 16-bit mono PCM
+
+        Args:
+            audio: Input audio bytes
+            sample_rate: Output sample rate
+
+        Returns:
+            PCM audio bytes (s16le)
+        """
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_decode_command(sample_rate),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+        pcm_data, stderr = await process.communicate(audio)
+
+        if process.returncode != 0:
+            logger.error(f" ffmpeg conversion failed: {stderr.decode()}")
+            raise Exception(f"Audio conversion failed: {stderr.decode()}")
+        return pcm_data
+
+    async def decode_to_pcm_stream(self, audio: bytes, sample_rate: int) -> AsyncIterator[bytes]:
+        """
+        Decode to 16-bit mono PCM, yielding chunks as ffmpeg writes them to stdout
+
+        Args:
+            audio: Input audio bytes
+            sample_rate: Output sample rate
+
+        Yields:
+            PCM audio chunks (s16le, arbitrary sizes)
+        """
+        process = await asyncio.create_subprocess_exec(
+            *ffmpeg_decode_command(sample_rate),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        async def feed():
+            try:
+                process.stdin.write(audio)
+                await process.stdin.drain()
+            finally:
+                process.stdin.close()
+
+        # Input is written while output is read, so neither pipe can fill up and block
+        feeder = asyncio.create_task(feed())
+        stderr_reader = asyncio.create_task(process.stderr.read())
+        try:
+            while True:
+                chunk = await process.stdout.read(65536)
+                if not chunk:
+                    break
+                yield chunk
+            stderr = await stderr_reader
+            await process.wait()
+            if process.returncode != 0:
+                logger.error(f" ffmpeg conversion failed: {stderr.decode()}")
+                raise Exception(f"Audio conversion failed: {stderr.decode()}")
+            await feeder
+        finally:
+            if process.returncode is None:
+                process.kill()
+                await process.wait()
+            feeder.cancel()
+            stderr_reader.cancel()
+
+    def decode_to_pcm_sync(self, audio: bytes, sample_rate: int) -> bytes:
+        """Blocking variant of decode_to_pcm()"""
+        return self._run_sync(ffmpeg_decode_command(sample_rate), audio)
+
+    @staticmethod
+    def _run_sync(command: List[str], audio: bytes) -> bytes:
+        try:
+            result = subprocess.run(command, input=audio, capture_output=True, check=True)
+        except subprocess.CalledProcessError as e:
+            logger.error(f" ffmpeg conversion failed: {e.stderr.decode()}")
+            raise Exception(f"Audio conversion failed: {e.stderr.decode()}")
+        return result.stdout
+
+
+class PyAVOggEncoder:
+    """
+    In-process Ogg/Opus encoder built on libav (PyAV)
+
+    Same interface as StreamingOggEncoder. Input is decoded (MP3) or wrapped
+    (raw PCM) into frames, run through atempo + resampling to 16kHz and
+    encoded with libopus using the same options as the ffmpeg CLI. The
+    blocking libav calls run on the codec thread pool; start(), write() and
+    finish() must be awaited in order. open(), feed() and close() are the
+    blocking equivalents. MP3 input goes through libav's MP3 parser, with any
+    leading ID3v2 tag stripped first (see ID3v2Stripper).
+    """
+
+    def __init__(self, input_format: str, executor: Optional[ThreadPoolExecutor], tempo: float = 1.0,
+                 profile: str = "quality"):
+        self.input_format = input_format
+        self.tempo = tempo
+        self.profile = profile
+        self._executor = executor
+        self._pcm_rate = pcm_sample_rate(input_format)
+        self._pcm_remainder = b""
+        self._output = io.BytesIO()
+        self._container = None
+        self._stream = None
+        self._decoder = None
+        self._graph = None
+        self._id3: Optional[ID3v2Stripper] = None
+        self._samples_in = 0
+        self._in_flight = False
+        # Held by the libav call running on the executor, so abort() can wait for it
+        self._lock = threading.Lock()
+        self.bytes_in = 0
+
+    async def _run(self, function, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._locked, function, *args)
+
+    def _locked(self, function, *args):
+        with self._lock:
+            return function(*args)
+
+    async def start(self):
+        """Set up the muxer, encoder and (for MP3) decoder"""
+        await self._run(self.open)
+
+    async def write(self, data: bytes):
+        """Encode a chunk of input audio"""
+        self.bytes_in += len(data)
+        await self._run(self.feed, data)
+
+    async def finish(self) -> bytes:
+        """
+        Flush decoder, filters and encoder
+
+        Returns:
+            OGG audio bytes
+        """
+        ogg_data = await self._run(self.close)
+        logger.info(f" PyAV streaming conversion successful: {self.bytes_in} → {len(ogg_data)} bytes")
+        return ogg_data
+
+    async def abort(self):
+        """Release the decoder and muxer once any feed() still running on the pool returns"""
+        self._done()
+        await self._run(self._release)
+
+    def _release(self):
+        self._graph = None
+        self._decoder = None
+        self._stream = None
+        if self._container is not None:
+            try:
+                self._container.close()
+            except Exception as e:  # Nothing was muxed yet
+                logger.debug(f" Closing aborted PyAV encoder: {e}")
+            self._container = None
+
+    def _done(self):
+        if self._in_flight:
+            self._in_flight = False
+            encode_load.end()
+
+    def open(self):
+        self._in_flight = True
+        encode_load.begin()
+        options = dict(OPUS_OPTIONS, compression_level=OPUS_PROFILES[self.profile])
+        self._container = av.open(self._output, mode="w", format="ogg")
+        self._stream = self._container.add_stream("libopus", rate=OUTPUT_SAMPLE_RATE, options=options)
+        self._stream.codec_context.layout = "mono"
+        self._stream.codec_context.bit_rate = OPUS_BITRATE
+        if self._pcm_rate is None:
+            codec = self.input_format.split("_")[0]
+            self._decoder = av.CodecContext.create(codec, "r")
+            if codec == "mp3":
+                self._id3 = ID3v2Stripper()
+
+    def feed(self, data: bytes):
+        if self._decoder is not None:
+            if self._id3 is not None:
+                data = self._id3.feed(data)
+                if not data:
+                    return
+            for packet in self._decoder.parse(data):
+                for frame in self._decoder.decode(packet):
+                    self._filter(frame)
+            return
+
+        # Network chunks can split a sample, keep the odd byte for the next call
+        data = self._pcm_remainder + data
+        usable = len(data) - len(data) % 2
+        self._pcm_remainder = data[usable:]
+        if usable:
+            frame = av.AudioFrame(format="s16", layout="mono", samples=usable // 2)
+            frame.sample_rate = self._pcm_rate
+            frame.planes[0].update(data[:usable])
+            self._filter(frame)
+
+    def close(self) -> bytes:
+        try:
+            if self._decoder is not None:
+                if self._id3 is not None:
+                    tail = self._id3.flush()
+                    if tail:
+                        for packet in self._decoder.parse(tail):
+                            for frame in self._decoder.decode(packet):
+                                self._filter(frame)
+                for packet in self._decoder.parse(None):
+                    for frame in self._decoder.decode(packet):
+                        self._filter(frame)
+                for frame in self._decoder.decode(None):
+                    self._filter(frame)
+            if self._graph is None:
+                raise Exception("Audio conversion failed: no audio decoded")
+
+            self._graph.push(None)
+            self._drain_filter()
+            for packet in self._stream.encode(None):
+                self._container.mux(packet)
+            self._container.close()
+            return self._output.getvalue()
+        finally:
+            self._done()
+
+    def _filter(self, frame):
+        if self._graph is None:
+            self._graph = self._build_graph(frame)
+        frame.pts = self._samples_in
+        frame.time_base = Fraction(1, frame.sample_rate)
+        self._samples_in += frame.samples
+        self._graph.push(frame)
+        self._drain_filter()
+
+    def _build_graph(self, frame):
+        graph = av.filter.Graph()
+        nodes = [graph.add_abuffer(
+            format=frame.format.name,
+            sample_rate=frame.sample_rate,
+            layout=frame.layout.name,
+            time_base=Fraction(1, frame.sample_rate)
+        )]
+        if self.tempo != 1.0:
+            nodes.append(graph.add("atempo", str(self.tempo)))
+        nodes.append(graph.add("aresample", str(OUTPUT_SAMPLE_RATE)))
+        nodes.append(graph.add("abuffersink"))
+        graph.link_nodes(*nodes).configure()
+        return graph
+
+    def _drain_filter(self):
+        while True:
+            try:
+                frame = self._graph.pull()
+            except (BlockingIOError, EOFError):  # Filter needs more input / is flushed
+                return
+            # The encoder re-frames to 60ms and converts the sample format itself
+            for packet in self._stream.encode(frame):
+                self._container.mux(packet)
+
+
+class PyAVCodec:
+    """
+    Codec backend running libav in-process through PyAV
+
+    No process is spawned per conversion: the libav codecs stay loaded and
+    encoding runs on a small thread pool (libav releases the GIL while it
+    works). Output matches FfmpegCodec: 16kHz Opus, 60ms frames, voip.
+    """
+
+    name = "pyav"
+
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="codec")
+
+    def open_encoder(self, input_format: str, tempo: float = 1.0,
+                     profile: Optional[str] = None) -> PyAVOggEncoder:
+        """Streaming encoder for `input_format` (see FfmpegCodec.open_encoder)"""
+        return PyAVOggEncoder(input_format, self._executor, tempo, encode_load.resolve(profile))
+
+    async def encode(self, audio: bytes, input_format: str, tempo: float = 1.0,
+                     profile: Optional[str] = None) -> bytes:
+        """Encode a complete input to a WhatsApp voice note (see FfmpegCodec.encode)"""
+        profile = encode_load.resolve(profile)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._encode, audio, input_format, tempo, profile)
+
+    def encode_sync(self, audio: bytes, input_format: str, tempo: float = 1.0,
+                    profile: Optional[str] = None) -> bytes:
+        """Blocking variant of encode()"""
+        return self._encode(audio, input_format, tempo, encode_load.resolve(profile))
+
+    def _encode(self, audio: bytes, input_format: str, tempo: float, profile: str) -> bytes:
+        try:
+            encoder = PyAVOggEncoder(input_format, None, tempo, profile)
+            encoder.open()
+            encoder.feed(audio)
+            return encoder.close()
+        except Exception as e:
+            logger.error(f" PyAV conversion failed: {e}")
+            raise Exception(f"Audio conversion failed: {e}")
+
+    async def decode_to_pcm(self, audio: bytes, sample_rate: int) -> bytes:
+        """Decode any input to 16-bit mono PCM (see FfmpegCodec.decode_to_pcm)"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.decode_to_pcm_sync, audio, sample_rate)
+
+    async def decode_to_pcm_stream(self, audio: bytes, sample_rate: int) -> AsyncIterator[bytes]:
+        """Decode to 16-bit mono PCM in chunks (see FfmpegCodec.decode_to_pcm_stream)"""
+        loop = asyncio.get_running_loop()
+        chunks = self._decode_chunks(audio, sample_rate)
+        while True:
+            chunk = await loop.run_in_executor(self._executor, next, chunks, None)
+            if chunk is None:
+                break
+            yield chunk
+
+    def decode_to_pcm_sync(self, audio: bytes, sample_rate: int) -> bytes:
+        """Blocking variant of decode_to_pcm()"""
+        return b"".join(self._decode_chunks(audio, sample_rate))
+
+    @staticmethod
+    def _decode_chunks(audio: bytes, sample_rate: int, chunk_size: int = 65536) -> Iterator[bytes]:
+        try:
+            resampler = av.AudioResampler(format="s16", layout="mono", rate=sample_rate)
+            pending = bytearray()
+            with av.open(io.BytesIO(audio)) as container:
+                for frame in container.decode(audio=0):
+                    for resampled in resampler.resample(frame):
+                        pending += bytes(resampled.planes[0])[:resampled.samples * 2]
+                    if len(pending) >= chunk_size:
+                        yield bytes(pending)
+                        pending.clear()
+            for resampled in resampler.resample(None):
+                pending += bytes(resampled.planes[0])[:resampled.samples * 2]
+            if pending:
+                yield bytes(pending)
+        except Exception as e:
+            logger.error(f" PyAV conversion failed: {e}")
+            raise Exception(f"Audio conversion failed: {e}")
+
+
+def build_audio_codec():
+    """Create the codec backend selected by AUDIO_CODEC_BACKEND"""
+    backend = settings.AUDIO_CODEC_BACKEND
+    if backend in ("pyav", "auto"):
+        if av is None:
+            if backend == "pyav":
+                logger.warning(" PyAV not installed, using the ffmpeg CLI for audio conversion")
+            return FfmpegCodec()
+        try:
+            av.codec.Codec("libopus", "w")
+        except Exception:
+            logger.warning(" PyAV build has no libopus encoder, using the ffmpeg CLI for audio conversion")
+            return FfmpegCodec()
+        return PyAVCodec(workers=settings.AUDIO_CODEC_WORKERS)
+    return FfmpegCodec()
+
+
+# Global audio codec instance
+audio_codec = build_audio_codec()
@@ -0,0 +1,169 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+from prometheus_client import Histogram
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Flush attempts per turn when queueing its reply fails (e.g. dispatcher full)
+MAX_FLUSH_ATTEMPTS = 3
+
+COALESCED_MESSAGES = Histogram(
+    "voicebot_coalesced_messages",
+    "Incoming messages answered together as one AI turn",
+    buckets=(1, 2, 3, 4, 6, 8, 12)
+)
+
+
+@dataclass
+class PendingInput:
+    """One message's text waiting for the user's turn to be flushed"""
+    message_id: str
+    text: str
+    message_type: str  # text or audio (transcribed voice note)
+    input_seconds: float = 0.0  # Time spent turning the message into text (transcription)
+    received: float = field(default_factory=time.monotonic)
+    generation: int = 0  # reply_guard generation the message was queued with
+
+
+@dataclass
+class PendingTurn:
+    """Consecutive messages from one user, answered with a single reply"""
+    user_phone: str
+    inputs: List[PendingInput] = field(default_factory=list)
+    started: float = field(default_factory=time.monotonic)
+    attempts: int = 0  # Failed flushes so far
+
+    @property
+    def text(self) -> str:
+        return "\n".join(item.text for item in self.inputs)
+
+    @property
+    def message_ids(self) -> List[str]:
+        return [item.message_id for item in self.inputs]
+
+
+# Called with each flushed turn; expected to queue the reply (e.g. on the dispatcher)
+FlushHandler = Callable[[PendingTurn], Awaitable[Any]]
+
+
+class MessageCoalescer:
+    """
+    Per-user debounce of incoming messages
+
+    Texts (and transcribed voice notes) are collected per user and flushed as
+    one turn once the user has been quiet for `window` seconds, or `max_wait`
+    seconds after the first message of the turn, so a burst of short messages
+    gets one AI reply instead of one each. A window of 0 disables coalescing.
+    """
+
+    def __init__(self, window: float, max_wait: float):
+        self.window = window
+        self.max_wait = max_wait
+        self._turns: Dict[str, PendingTurn] = {}
+        self._timers: Dict[str, asyncio.Task] = {}
+        self._on_flush: Optional[FlushHandler] = None
+        self.flushed_turns = 0
+        self.flushed_messages = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def set_flush_handler(self, handler: FlushHandler):
+        self._on_flush = handler
+
+    def add(self, user_phone: str, item: PendingInput):
+        """Add a message to the user's pending turn and restart its quiet timer"""
+        turn = self._turns.get(user_phone)
+        if turn is None:
+            turn = self._turns[user_phone] = PendingTurn(user_phone)
+        turn.inputs.append(item)
+
+        self._cancel_timer(user_phone)
+        remaining = turn.started + self.max_wait - time.monotonic()
+        delay = max(0.0, min(self.window, remaining))
+        self._timers[user_phone] = asyncio.create_task(self._flush_after(user_phone, delay))
+
+    def restore(self, turn: PendingTurn):
+        """
+        Put back the messages of a turn whose reply was superseded before it
+        was sent (or could not be queued), ahead of anything pending, so
+        the next turn answers them
+        """
+        pending = self._turns.get(turn.user_phone)
+        restored = PendingTurn(turn.user_phone, turn.inputs + (pending.inputs if pending else []), turn.started, turn.attempts)
+        self._turns[turn.user_phone] = restored
+        if self.enabled and turn.user_phone not in self._timers:
+            self._timers[turn.user_phone] = asyncio.create_task(self._flush_after(turn.user_phone, self.window))
+
+    def take(self, user_phone: str) -> Optional[PendingTurn]:
+        """Remove and return the user's pending turn without flushing it"""
+        self._cancel_timer(user_phone)
+        turn = self._turns.pop(user_phone, None)
+        if turn is not None:
+            self._count(turn)
+        return turn
+
+    def discard(self, user_phone: str):
+        """Drop the user's pending messages (e.g. on /clear)"""
+        self._cancel_timer(user_phone)
+        self._turns.pop(user_phone, None)
+
+    def _cancel_timer(self, user_phone: str):
+        timer = self._timers.pop(user_phone, None)
+        if timer is not None and timer is not asyncio.current_task():
+            timer.cancel()
+
+    async def _flush_after(self, user_phone: str, delay: float):
+        await asyncio.sleep(delay)
+        self._timers.pop(user_phone, None)
+        turn = self._turns.pop(user_phone, None)
+        if turn is None:
+            return
+        logger.info(f" Flushing {len(turn.inputs)} message(s) from {user_phone} as one turn")
+        try:
+            await self._on_flush(turn)
+        except Exception as e:
+            # The webhook already acknowledged these messages, so Meta won't redeliver them:
+            # put the turn back and try again after another window
+            turn.attempts += 1
+            if turn.attempts < MAX_FLUSH_ATTEMPTS:
+                logger.warning(f" Could not queue the reply for {user_phone}, retrying: {e}")
+                self.restore(turn)
+                return
+            logger.error(f" Could not queue the reply for {user_phone} ({turn.message_ids}): {e}")
+            return
+        self._count(turn)
+
+    def _count(self, turn: PendingTurn):
+        self.flushed_turns += 1
+        self.flushed_messages += len(turn.inputs)
+        COALESCED_MESSAGES.observe(len(turn.inputs))
+
+    async def close(self):
+        """Cancel pending timers (pending messages are dropped)"""
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        self._turns.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "window_seconds": self.window,
+            "users_pending": len(self._turns),
+            "messages_pending": sum(len(turn.inputs) for turn in self._turns.values()),
+            "turns": self.flushed_turns,
+            "messages": self.flushed_messages,
+            "messages_per_turn": round(self.flushed_messages / self.flushed_turns, 3) if self.flushed_turns else 0.0
+        }
+
+
+# Global message coalescer (flush handler set by app.main)
+message_coalescer = MessageCoalescer(
+    window=settings.COALESCE_WINDOW,
+    max_wait=settings.COALESCE_MAX_WAIT
+)
@@ -1,29 +1,60 @@
+from typing import Optional
 from pydantic_settings import BaseSettings
 
 
 class Settings(BaseSettings):
     # WhatsApp Business API Configuration
     WHATSAPP_API_VERSION: str = "v21.0"
+    WHATSAPP_API_BASE_URL: str = "https://graph.facebook.com"
     WHATSAPP_PHONE_NUMBER_ID: str
     WHATSAPP_BUSINESS_ACCOUNT_ID: str
     WHATSAPP_ACCESS_TOKEN: str
     
+    # WhatsApp HTTP connection pool (shared client, opened at startup)
+    WHATSAPP_HTTP2: bool = True
+    WHATSAPP_MAX_CONNECTIONS: int = 20
+    WHATSAPP_MAX_KEEPALIVE_CONNECTIONS: int = 10
+    WHATSAPP_KEEPALIVE_EXPIRY: float = 60.0  # Seconds an idle connection is kept open
+    
+    # Reuse media IDs for identical audio uploads (Meta keeps uploaded media for 30 days)
+    WHATSAPP_MEDIA_CACHE_SIZE: int = 1000  # 0 disables reuse
+    WHATSAPP_MEDIA_CACHE_TTL: int = 29 * 24 * 3600  # Seconds, kept inside Meta's retention window
+    
     # App Configuration
     APP_ID: str
     APP_SECRET: str
     
     # Webhook Configuration
     WEBHOOK_VERIFY_TOKEN: str
+    WEBHOOK_VERIFY_SIGNATURE: bool = True  # Reject POSTs without a valid X-Hub-Signature-256 (APP_SECRET)
     
     # OpenAI Configuration
     OPENAI_API_KEY: str
     OPENAI_MODEL: str = "gpt-4o-mini"
+    OPENAI_BASE_URL: Optional[str] = None  # Override for proxies / local benchmark fakes
     
-    # OpenAI Realtime API Configuration (not currently used)
+    # OpenAI Realtime API Configuration (voice notes, see VOICE_PIPELINE)
     OPENAI_REALTIME_MODEL: str = "gpt-4o-realtime-preview-2024-12-17"
     OPENAI_REALTIME_VOICE: str = "alloy"
     REALTIME_API_URL: str = "wss://api.openai.com/v1/realtime"
     
+    # Realtime API session pool (one configured WebSocket per user, reused across voice notes)
+    REALTIME_MAX_SESSIONS: int = 50  # Global cap on open sessions
+    REALTIME_SESSION_IDLE_TIMEOUT: float = 300.0  # Seconds before an unused session is closed
+    REALTIME_SESSION_MAX_AGE: float = 1500.0  # Reconnect before the server's 30 minute session limit
+    # Turn handling: manual (voice notes are complete clips - commit the audio and request
+    # the response right away) or server_vad (server detects end of speech, for live audio)
+    REALTIME_TURN_MODE: str = "manual"
+    REALTIME_TRANSCRIPT_WAIT: float = 2.0  # Max seconds to wait after response.done for the user turn's transcript
+    
+    # Voice note pipeline: cascade (Whisper → chat model → ElevenLabs), realtime
+    # (Realtime API, audio in and out) or auto (faster healthy pipeline, from recent voice notes)
+    VOICE_PIPELINE: str = "cascade"
+    VOICE_ROUTER_WINDOW: int = 50  # auto: recent results kept per pipeline
+    VOICE_ROUTER_MIN_SAMPLES: int = 5  # auto: results needed before a pipeline is compared
+    VOICE_ROUTER_MAX_ERROR_RATE: float = 0.2  # auto: above this a pipeline is unhealthy
+    VOICE_ROUTER_EXPLORE_RATE: float = 0.05  # auto: share of voice notes sent to the other pipeline
+    
     # OpenAI TTS Configuration (not currently used)
     OPENAI_TTS_MODEL: str = "tts-1"
     OPENAI_TTS_VOICE: str = "alloy"
@@ -32,21 +63,96 @@ class Settings(BaseSettings):
     ELEVENLABS_API_KEY: str
     ELEVENLABS_VOICE_ID: str
     ELEVENLABS_MODEL: str = "eleven_multilingual_v2"  # eleven_turbo_v2 or eleven_multilingual_v2
+    ELEVENLABS_BASE_URL: Optional[str] = None  # Override for local benchmark fakes
+    
+    # TTS Rendering Configuration
+    TTS_MAX_CONCURRENCY: int = 4  # Voice replies rendered at once (ElevenLabs + ffmpeg)
+    # ElevenLabs output: mp3_44100_128 (decoded by ffmpeg) or pcm_16000 / pcm_24000
+    # (raw PCM, encoded straight to Opus - no MP3 decode round trip)
+    TTS_OUTPUT_FORMAT: str = "mp3_44100_128"
+    TTS_STREAM_ENCODE: bool = True  # Pipe ElevenLabs chunks into ffmpeg while they download
+    TTS_STREAM_BUFFER_CHUNKS: int = 8  # Max downloaded chunks waiting for ffmpeg
+    TTS_STREAM_MAX_SEGMENTS: int = 3  # Streamed replies: sentences synthesizing at once per reply
+    STREAMING_REPLIES: bool = False  # Stream the LLM reply and start TTS at the first sentence
+    
+    # Audio codec backend (Opus encoding / decoding)
+    AUDIO_CODEC_BACKEND: str = "auto"  # auto (PyAV if installed, else ffmpeg CLI), pyav or ffmpeg
+    AUDIO_CODEC_WORKERS: int = 4  # PyAV backend: encode threads
+    # Opus encoding profile: quality, balanced, fast, or auto (drops to cheaper
+    # profiles under load: encodes in flight per AUDIO_CODEC_WORKERS, or load average per core)
+    OPUS_PROFILE: str = "auto"
+    OPUS_BALANCED_LOAD: float = 0.75  # auto: load at which balanced is used
+    OPUS_FAST_LOAD: float = 1.0  # auto: load at which fast is used (all encode slots busy)
+    
+    # TTS audio cache (finished OGG voice notes, keyed by text + voice + encoder settings)
+    TTS_CACHE_ENABLED: bool = True
+    TTS_CACHE_MEMORY_MAX_BYTES: int = 32_000_000
+    TTS_CACHE_DIR: str = "tts_cache"  # Empty string = memory tier only
+    TTS_CACHE_DISK_MAX_BYTES: int = 512_000_000
+    TTS_CACHE_MAX_TEXT_CHARS: int = 200  # Longer replies are cached only once rendered a second time
+    # Phrases rendered at startup, separated by "|"
+    TTS_PREWARM_PHRASES: str = "Conversation history cleared!"
+    
+    # Message dispatcher (bounded queue, per-user ordering)
+    DISPATCH_WORKERS: int = 8  # Messages processed in parallel (different users)
+    DISPATCH_QUEUE_SIZE: int = 256  # Max messages waiting before backpressure
+    DISPATCH_SUBMIT_TIMEOUT: float = 2.0  # Seconds to wait for a slot before answering 503
+    
+    # Coalescing: consecutive texts / transcribed voice notes from one user are answered
+    # with one reply once the user is quiet for COALESCE_WINDOW seconds (0 disables; opt-in,
+    # since every coalesced reply waits at least that long)
+    COALESCE_WINDOW: float = 0.0
+    COALESCE_MAX_WAIT: float = 5.0  # Flush at the latest this long after the turn's first message
+    
+    # Stale replies: a newer message from the same user stops the reply in progress at its next
+    # stage boundary, and no expensive stage starts after REPLY_DEADLINE seconds from arrival
+    REPLY_SUPERSEDE: bool = True
+    REPLY_DEADLINE: float = 90.0
+    
+    # Webhook deduplication by message id (Meta retries slow deliveries)
+    DEDUP_BACKEND: str = "memory"  # memory (single worker) or redis (shared, uses REDIS_URL)
+    DEDUP_TTL: int = 86400  # Seconds a message id is remembered
+    DEDUP_MAX_ENTRIES: int = 10000  # In-memory LRU size
+    
+    # Delivery status callbacks (sent / delivered / read) are aggregated in memory and
+    # flushed as batched metrics instead of being handled one by one
+    STATUS_BACKEND: str = "memory"  # memory (this worker's /metrics) or redis (also pushed to REDIS_URL)
+    STATUS_FLUSH_INTERVAL: float = 10.0  # Seconds between flushes
+    STATUS_MAX_TRACKED: int = 10000  # Outbound message ids awaiting delivered / read
+    STATUS_LATENCY_WINDOW: int = 1000  # Recent latencies per stage kept for percentiles
     
     # Redis Configuration (for conversation storage)
     REDIS_URL: str = "redis://localhost:6379"
     REDIS_TTL: int = 3600  # 1 hour conversation TTL
     
+    # Conversation history storage
+    CONVERSATION_BACKEND: str = "memory"  # memory (single worker) or redis (shared, survives restarts)
+    CONVERSATION_MAX_MESSAGES: int = 30  # Messages kept per user (excluding system prompt)
+    # Prompt history is bounded by tokens, not messages: the newest turns that fit in the
+    # budget are sent and older ones are folded into a running summary in the background
+    CONVERSATION_TOKEN_BUDGET: int = 1500  # Summary + recent turns (counted with tiktoken if installed)
+    CONVERSATION_SUMMARY_ENABLED: bool = True
+    CONVERSATION_SUMMARY_MAX_TOKENS: int = 200
+    CONVERSATION_MAX_USERS: int = 10000  # In-memory backend: max conversations kept
+    CONVERSATION_MEMORY_MAX_BYTES: int = 50_000_000  # In-memory backend: cap on stored text
+    CONVERSATION_CACHE_SIZE: int = 1000  # Redis backend: per-process LRU cache entries
+    CONVERSATION_CACHE_TTL: float = 5.0  # Redis backend: seconds a cached history is trusted
+    
     # Server Configuration
     HOST: str = "0.0.0.0"
     PORT: int = 8000
     DEBUG: bool = False  # Production default
     PRODUCTION: bool = True
     LOG_LEVEL: str = "INFO"  # DEBUG, INFO, WARNING, ERROR
+    TRACE_MESSAGES: bool = False  # Log one line per message with its stage timings
     
     # Allowed phone numbers (comma-separated, no spaces)
     # Example: "918226053534,919876543210"
     ALLOWED_PHONE_NUMBERS: str = ""
+    # Optional file with more numbers (one per line or comma-separated), picked up
+    # without a restart when it changes; SIGHUP also re-reads ALLOWED_PHONE_NUMBERS
+    ALLOWED_PHONE_NUMBERS_FILE: str = ""
+    ALLOWED_PHONE_NUMBERS_CHECK_INTERVAL: float = 5.0  # Seconds between file change checks
     
     @property
     def allowed_phone_list(self) -> list:
@@ -55,9 +161,16 @@ class Settings(BaseSettings):
             return []
         return [p.strip() for p in self.ALLOWED_PHONE_NUMBERS.split(",")]
     
+    @property
+    def tts_prewarm_phrase_list(self) -> list:
+        """Parse TTS pre-warm phrases"""
+        if not self.TTS_PREWARM_PHRASES:
+            return []
+        return [p.strip() for p in self.TTS_PREWARM_PHRASES.split("|") if p.strip()]
+    
     @property
     def whatsapp_api_base_url(self) -> str:
-        return f"https://graph.facebook.com/{self.WHATSAPP_API_VERSION}"
+        return f"{self.WHATSAPP_API_BASE_URL}/{self.WHATSAPP_API_VERSION}"
 
     class Config:
         env_file = ".env"
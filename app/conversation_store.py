@@ -0,0 +1,222 @@
+import json
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Tuple
+from app.config import settings
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# A chat message as sent to OpenAI: {"role": ..., "content": ...}
+Message = Dict[str, Any]
+
+
+def _message_size(message: Message) -> int:
+    return len(message.get("content") or "") + 16
+
+
+class InMemoryConversationStore:
+    """
+    Per-process conversation history with TTL and memory-cap eviction
+
+    Each user's history expires `ttl` seconds after its last update. When the
+    total stored text exceeds `max_bytes` (or more than `max_users` users are
+    stored), the least recently used conversations are evicted first.
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: int, max_messages: int, max_users: int, max_bytes: int):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_users = max_users
+        self.max_bytes = max_bytes
+        # user -> (messages, expires_at, size)
+        self._conversations: "OrderedDict[str, Tuple[List[Message], float, int]]" = OrderedDict()
+        self._bytes = 0
+        self.evictions = 0
+
+    async def get_messages(self, user_phone: str) -> List[Message]:
+        """Return the stored history for a user (oldest first)"""
+        entry = self._conversations.get(user_phone)
+        if entry is None:
+            return []
+        messages, expires_at, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(user_phone)
+            return []
+        self._conversations.move_to_end(user_phone)
+        return list(messages)
+
+    async def append(self, user_phone: str, *messages: Message):
+        """Append messages, keeping the last `max_messages` and refreshing the TTL"""
+        history = await self.get_messages(user_phone)
+        history.extend(messages)
+        history = history[-self.max_messages:]
+        self._set(user_phone, history)
+
+    async def replace(self, user_phone: str, messages: List[Message]):
+        """Overwrite a user's stored history"""
+        self._set(user_phone, list(messages[-self.max_messages:]))
+
+    async def clear(self, user_phone: str):
+        """Delete a user's history"""
+        self._remove(user_phone)
+
+    def _set(self, user_phone: str, messages: List[Message]):
+        self._remove(user_phone)
+        size = sum(_message_size(m) for m in messages)
+        self._conversations[user_phone] = (messages, time.monotonic() + self.ttl, size)
+        self._bytes += size
+        self._evict()
+
+    def _remove(self, user_phone: str):
+        entry = self._conversations.pop(user_phone, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self):
+        now = time.monotonic()
+        for user_phone in [u for u, (_, expires_at, _) in self._conversations.items() if expires_at <= now]:
+            self._remove(user_phone)
+        while self._conversations and (
+            self._bytes > self.max_bytes or len(self._conversations) > self.max_users
+        ):
+            user_phone = next(iter(self._conversations))
+            self._remove(user_phone)
+            self.evictions += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "users": len(self._conversations),
+            "bytes": self._bytes,
+            "evictions": self.evictions
+        }
+
+
+class RedisConversationStore:
+    """
+    Conversation history in Redis, shared by all workers and kept across restarts
+
+    Each user's history is a Redis list updated with one pipelined
+    RPUSH + LTRIM + EXPIRE. A small per-process LRU cache sits in front of it
+    for reads; entries are refreshed after `cache_ttl` seconds so other workers'
+    writes are picked up.
+    """
+
+    backend = "redis"
+    key_prefix = "conversation:"
+
+    def __init__(self, ttl: int, max_messages: int, cache_size: int, cache_ttl: float):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        # user -> (messages, cached_at)
+        self._cache: "OrderedDict[str, Tuple[List[Message], float]]" = OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.redis_errors = 0
+
+    async def get_messages(self, user_phone: str) -> List[Message]:
+        """Return the stored history for a user (oldest first)"""
+        cached = self._cache.get(user_phone)
+        if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+            self._cache.move_to_end(user_phone)
+            self.cache_hits += 1
+            return list(cached[0])
+
+        self.cache_misses += 1
+        try:
+            raw = await get_redis().lrange(self.key_prefix + user_phone, 0, -1)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis history read failed for {user_phone}: {e}")
+            return list(cached[0]) if cached is not None else []
+
+        messages = [json.loads(item) for item in raw]
+        self._cache_set(user_phone, messages)
+        return list(messages)
+
+    async def append(self, user_phone: str, *messages: Message):
+        """Append messages, keeping the last `max_messages` and refreshing the TTL"""
+        key = self.key_prefix + user_phone
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.rpush(key, *[json.dumps(m) for m in messages])
+                pipe.ltrim(key, -self.max_messages, -1)
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis history write failed for {user_phone}: {e}")
+
+        # Write-through so this worker's next read is a cache hit. The entry keeps
+        # the time it was read from Redis, so other workers' writes still show up
+        # after cache_ttl; a stale entry may be missing them and is dropped.
+        cached = self._cache.pop(user_phone, None)
+        if cached is not None and time.monotonic() - cached[1] < self.cache_ttl:
+            self._cache[user_phone] = ((cached[0] + list(messages))[-self.max_messages:], cached[1])
+
+    async def replace(self, user_phone: str, messages: List[Message]):
+        """Overwrite a user's stored history"""
+        key = self.key_prefix + user_phone
+        messages = list(messages[-self.max_messages:])
+        try:
+            async with get_redis().pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                if messages:
+                    pipe.rpush(key, *[json.dumps(m) for m in messages])
+                    pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis history write failed for {user_phone}: {e}")
+        self._cache_set(user_phone, messages)
+
+    async def clear(self, user_phone: str):
+        """Delete a user's history"""
+        self._cache.pop(user_phone, None)
+        try:
+            await get_redis().delete(self.key_prefix + user_phone)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis history delete failed for {user_phone}: {e}")
+
+    def _cache_set(self, user_phone: str, messages: List[Message]):
+        self._cache[user_phone] = (messages, time.monotonic())
+        self._cache.move_to_end(user_phone)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "cached_users": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "redis_errors": self.redis_errors
+        }
+
+
+def build_conversation_store():
+    """Create the store selected by CONVERSATION_BACKEND"""
+    if settings.CONVERSATION_BACKEND == "redis" and get_redis() is not None:
+        return RedisConversationStore(
+            ttl=settings.REDIS_TTL,
+            max_messages=settings.CONVERSATION_MAX_MESSAGES,
+            cache_size=settings.CONVERSATION_CACHE_SIZE,
+            cache_ttl=settings.CONVERSATION_CACHE_TTL
+        )
+    return InMemoryConversationStore(
+        ttl=settings.REDIS_TTL,
+        max_messages=settings.CONVERSATION_MAX_MESSAGES,
+        max_users=settings.CONVERSATION_MAX_USERS,
+        max_bytes=settings.CONVERSATION_MEMORY_MAX_BYTES
+    )
+
+
+# Global conversation store instance
+conversation_store = build_conversation_store()
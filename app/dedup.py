@@ -0,0 +1,145 @@
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Dict
+from app.config import settings
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class InMemoryDeduplicator:
+    """
+    LRU of recently seen WhatsApp message ids with TTL eviction
+
+    Good for a single uvicorn worker. Ids expire after `ttl` seconds and the
+    oldest ids are evicted once `max_entries` is reached.
+    """
+
+    backend = "memory"
+
+    def __init__(self, ttl: int, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self.duplicates = 0
+
+    async def is_duplicate(self, message_id: str) -> bool:
+        """
+        Record `message_id` and report whether it was already seen
+
+        Args:
+            message_id: WhatsApp message id (wamid)
+
+        Returns:
+            True if the id was seen within the TTL
+        """
+        now = time.monotonic()
+        self._evict_expired(now)
+
+        if message_id in self._seen:
+            self.duplicates += 1
+            return True
+
+        self._seen[message_id] = now + self.ttl
+        while len(self._seen) > self.max_entries:
+            self._seen.popitem(last=False)
+        return False
+
+    async def forget(self, message_id: str):
+        """Drop `message_id` so a redelivery is processed (e.g. after a 503)"""
+        self._seen.pop(message_id, None)
+
+    def _evict_expired(self, now: float):
+        # Entries are in insertion order and share one TTL, so expired ids are at the front
+        while self._seen:
+            message_id, expires_at = next(iter(self._seen.items()))
+            if expires_at > now:
+                break
+            del self._seen[message_id]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "tracked_ids": len(self._seen),
+            "duplicates": self.duplicates
+        }
+
+
+class RedisDeduplicator:
+    """
+    Message id dedup shared by all workers, using Redis SET NX EX
+
+    Falls back to a local InMemoryDeduplicator if Redis is unreachable, so a
+    Redis outage never blocks message handling.
+    """
+
+    backend = "redis"
+    key_prefix = "whatsapp:msg:"
+
+    def __init__(self, ttl: int, fallback: InMemoryDeduplicator):
+        self.ttl = ttl
+        self.fallback = fallback
+        self.duplicates = 0
+        self.redis_errors = 0
+
+    async def is_duplicate(self, message_id: str) -> bool:
+        """
+        Record `message_id` and report whether it was already seen
+
+        Args:
+            message_id: WhatsApp message id (wamid)
+
+        Returns:
+            True if the id was seen within the TTL
+        """
+        redis = get_redis()
+        if redis is None:
+            return await self.fallback.is_duplicate(message_id)
+
+        try:
+            created = await redis.set(self.key_prefix + message_id, 1, nx=True, ex=self.ttl)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis dedup failed, using local cache: {e}")
+            return await self.fallback.is_duplicate(message_id)
+
+        if not created:
+            self.duplicates += 1
+            return True
+        return False
+
+    async def forget(self, message_id: str):
+        """Drop `message_id` so a redelivery is processed (e.g. after a 503)"""
+        await self.fallback.forget(message_id)
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            await redis.delete(self.key_prefix + message_id)
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis dedup forget failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend,
+            "duplicates": self.duplicates,
+            "redis_errors": self.redis_errors,
+            "fallback": self.fallback.stats()
+        }
+
+
+def build_deduplicator():
+    """Create the deduplicator selected by DEDUP_BACKEND"""
+    memory = InMemoryDeduplicator(
+        ttl=settings.DEDUP_TTL,
+        max_entries=settings.DEDUP_MAX_ENTRIES
+    )
+    if settings.DEDUP_BACKEND == "redis":
+        return RedisDeduplicator(ttl=settings.DEDUP_TTL, fallback=memory)
+    return memory
+
+
+# Global deduplicator instance
+message_deduplicator = build_deduplicator()
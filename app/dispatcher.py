@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Set, Tuple
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# A job is a zero-argument callable returning the coroutine to run
+Job = Callable[[], Awaitable[Any]]
+
+
+class DispatcherFull(Exception):
+    """Raised when the dispatcher queue stays full past the submit timeout"""
+
+
+class MessageDispatcher:
+    """
+    Bounded work queue with a fixed worker pool and per-user ordering
+
+    Jobs submitted under the same key (the sender's phone number) run strictly
+    one after another in submission order, while jobs for different keys run in
+    parallel on up to `workers` workers. At most `max_queue` jobs can be waiting;
+    submit() waits for a free slot and raises DispatcherFull after `submit_timeout`
+    seconds so the webhook can tell Meta to retry later.
+    """
+
+    def __init__(self, workers: int, max_queue: int, submit_timeout: float):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.submit_timeout = submit_timeout
+
+        self._slots = asyncio.Semaphore(max_queue)
+        self._ready: "asyncio.Queue[str]" = asyncio.Queue()
+        self._pending: Dict[str, Deque[Tuple[Job, float]]] = {}
+        self._active: Set[str] = set()
+        self._tasks: List[asyncio.Task] = []
+
+        # Stats
+        self._queued = 0
+        self._running = 0
+        self._processed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._last_wait = 0.0
+
+    async def start(self):
+        """Start the worker pool"""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i), name=f"dispatcher-{i}")
+            for i in range(self.workers)
+        ]
+        logger.info(f" Dispatcher started: {self.workers} workers, queue size {self.max_queue}")
+
+    async def stop(self):
+        """Cancel the workers (queued jobs are dropped)"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        logger.info(f" Dispatcher stopped ({self._queued} queued jobs dropped)")
+
+    async def submit(self, key: str, job: Job):
+        """
+        Queue a job for `key`, waiting for a free slot if the queue is full
+
+        Args:
+            key: Ordering key (user phone number)
+            job: Zero-argument callable returning the coroutine to run
+
+        Raises:
+            DispatcherFull: No slot became free within submit_timeout seconds
+        """
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout=self.submit_timeout)
+        except asyncio.TimeoutError:
+            self._rejected += 1
+            logger.warning(f" Dispatcher full ({self._queued} queued), rejecting job for {key}")
+            raise DispatcherFull(f"Dispatcher queue full ({self.max_queue} jobs)")
+
+        self._queued += 1
+        queue = self._pending.get(key)
+        if queue is None:
+            queue = self._pending[key] = deque()
+        queue.append((job, time.monotonic()))
+
+        # A key is on the ready queue at most once and never while it is running
+        if len(queue) == 1 and key not in self._active:
+            self._ready.put_nowait(key)
+
+    async def _worker(self, worker_id: int):
+        """Take ready keys and run their next job"""
+        while True:
+            key = await self._ready.get()
+            queue = self._pending[key]
+            job, enqueued_at = queue.popleft()
+
+            self._active.add(key)
+            self._queued -= 1
+            self._slots.release()
+
+            wait = time.monotonic() - enqueued_at
+            self._last_wait = wait
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+
+            self._running += 1
+            try:
+                await job()
+                self._processed += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed += 1
+                logger.error(f" Dispatcher job for {key} failed: {e}")
+            finally:
+                self._running -= 1
+                self._active.discard(key)
+                # Requeue the key behind other users so one chatty user can't starve them
+                if queue:
+                    self._ready.put_nowait(key)
+                else:
+                    del self._pending[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth, worker usage and wait-time stats"""
+        started = self._processed + self._failed + self._running
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queued,
+            "running": self._running,
+            "users_waiting": len(self._pending),
+            "processed": self._processed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "wait_seconds_last": round(self._last_wait, 4),
+            "wait_seconds_avg": round(self._wait_total / started, 4) if started else 0.0,
+            "wait_seconds_max": round(self._wait_max, 4)
+        }
+
+
+# Global dispatcher instance (workers started in the app startup hook)
+message_dispatcher = MessageDispatcher(
+    workers=settings.DISPATCH_WORKERS,
+    max_queue=settings.DISPATCH_QUEUE_SIZE,
+    submit_timeout=settings.DISPATCH_SUBMIT_TIMEOUT
+)
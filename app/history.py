@@ -0,0 +1,129 @@
+import logging
+from functools import lru_cache
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+
+try:
+    import tiktoken
+except ImportError:  # Optional: token counts are estimated without it
+    tiktoken = None
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, Any]
+
+# Chat format overhead per message (role, separators), as counted by OpenAI
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Stored as the first history message once older turns have been summarized
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+
+@lru_cache(maxsize=1)
+def _load_encoding():
+    """
+    tiktoken encoding for OPENAI_MODEL, loaded on first use
+
+    tiktoken downloads the BPE file the first time, so this can fail offline;
+    any failure is logged once and token counts fall back to the estimate.
+    """
+    if tiktoken is None:
+        logger.info(" tiktoken not installed, estimating history tokens from text length")
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        logger.warning(f" Could not load tiktoken encoding, estimating history tokens from text length: {e}")
+        return None
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Tokens in `text` for OPENAI_MODEL (about 4 characters per token without tiktoken)"""
+    encoding = _load_encoding()
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text))
+
+
+def message_tokens(message: Message) -> int:
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def is_summary(message: Message) -> bool:
+    return message.get("role") == "system"
+
+
+def summary_message(summary: str) -> Message:
+    return {"role": "system", "content": SUMMARY_PREFIX + summary}
+
+
+def summary_text(message: Optional[Message]) -> str:
+    if message is None:
+        return ""
+    return message["content"][len(SUMMARY_PREFIX):] if message["content"].startswith(SUMMARY_PREFIX) else message["content"]
+
+
+def split_history(history: List[Message], budget: int,
+                  max_messages: int) -> Tuple[Optional[Message], List[Message], List[Message]]:
+    """
+    Split stored history into what goes in the prompt and what should be summarized
+
+    The newest turns are kept while they fit in `budget` tokens (the summary
+    counts against it too). Older turns are returned as dropped, as are the
+    oldest turns that would fall out of the store (`max_messages`, with room
+    for the summary and the next user/assistant pair) on the next append.
+
+    Args:
+        history: Stored messages, oldest first (a summary, if any, first)
+        budget: Token budget for summary + kept turns
+        max_messages: Conversation store cap
+
+    Returns:
+        (summary message or None, kept turns, dropped turns)
+    """
+    summary = history[0] if history and is_summary(history[0]) else None
+    turns = history[1:] if summary is not None else history
+
+    remaining = budget - (message_tokens(summary) if summary is not None else 0)
+    keep = 0
+    for message in reversed(turns):
+        tokens = message_tokens(message)
+        if tokens > remaining:
+            break
+        remaining -= tokens
+        keep += 1
+    keep = min(keep, max(0, max_messages - 3))
+
+    split = len(turns) - keep
+    return summary, turns[split:], turns[:split]
+
+
+def merge_summary(current: List[Message], folded: List[Message], summary: Message) -> Optional[List[Message]]:
+    """
+    Replace the folded prefix of the stored history with `summary`
+
+    Messages appended while the summary was generated are kept. If the store
+    already trimmed part of the prefix, the rest of it is matched; if the
+    history no longer starts with any of it (cleared, replaced) None is returned.
+
+    Args:
+        current: History as stored now
+        folded: Prefix the summary was made from (old summary + dropped turns)
+        summary: New summary message
+
+    Returns:
+        New history, or None if the summary no longer applies
+    """
+    for start in range(len(folded)):
+        tail = folded[start:]
+        if current[:len(tail)] == tail:
+            return [summary] + current[len(tail):]
+    return None
+
+
+def history_tokens(messages: List[Message]) -> int:
+    return sum(message_tokens(message) for message in messages)
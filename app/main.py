@@ -1,12 +1,30 @@
-from fastapi import FastAPI, Request, Response, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, Response, HTTPException
 from fastapi.responses import JSONResponse
 from app.config import settings
 from app.whatsapp import whatsapp_client
-from app.ai_agent import get_ai_response, clear_conversation
-from app.tts_converter import convert_text_to_speech_with_cleanup
+from app.ai_agent import get_ai_response, stream_ai_response, remember_reply, clear_conversation, history_stats
+from app.conversation_store import conversation_store
+from app.tts_converter import convert_text_to_speech_with_cleanup, convert_sentences_to_speech, prewarm_tts_cache
+from app.tts_cache import tts_cache
+from app.audio_codec import audio_codec, encode_load
+from app.realtime_pool import realtime_pool
+from app.realtime_voice import process_voice_with_realtime
+from app.voice_router import voice_router, CASCADE, REALTIME
+from app.coalescer import message_coalescer, PendingInput, PendingTurn
+from app.reply_guard import reply_guard, ReplyAbandoned, ReplySuperseded
+from app.dispatcher import message_dispatcher, DispatcherFull
+from app.dedup import message_deduplicator
+from app.webhook_filter import webhook_filter, allow_list
+from app.status_aggregator import status_aggregator
+from app.webhook_ingest import InboundMessage, InvalidWebhook, SIGNATURE_HEADER, parse_webhook, verify_signature
+from app.redis_client import close_redis
+from app.metrics import track_message, tag_trace, MessageTrace, register_gauge, render_metrics
 from datetime import datetime
+import asyncio
 import logging
-from typing import Dict, Any
+import signal
+import time
+from typing import List, Tuple
 
 # Configure logging
 logging.basicConfig(
@@ -15,6 +33,25 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Component gauges (read on each /metrics scrape)
+register_gauge("voicebot_dispatch_queue_depth", "Messages waiting in the dispatcher",
+               lambda: message_dispatcher.stats()["queue_depth"])
+register_gauge("voicebot_dispatch_running", "Messages being processed by dispatcher workers",
+               lambda: message_dispatcher.stats()["running"])
+register_gauge("voicebot_encodes_active", "Opus encodes in flight",
+               lambda: encode_load.active)
+register_gauge("voicebot_realtime_sessions_open", "Pooled Realtime API sessions",
+               lambda: realtime_pool.stats()["sessions"])
+register_gauge("voicebot_whatsapp_connections", "Open connections in the WhatsApp HTTP pool",
+               lambda: whatsapp_client.pool_stats()["connections"])
+register_gauge("voicebot_delivery_latency_p95_seconds", "95th percentile of recent sent → delivered latencies",
+               lambda: status_aggregator.percentile("delivered", 0.95))
+register_gauge("voicebot_read_latency_p95_seconds", "95th percentile of recent sent → read latencies",
+               lambda: status_aggregator.percentile("read", 0.95))
+
+# Media IDs that Meta reports as failed are not reused
+status_aggregator.add_failure_listener(whatsapp_client.on_message_failed)
+
 # Initialize FastAPI app
 app = FastAPI(
     title="WhatsApp AI Chatbot",
@@ -28,6 +65,33 @@ async def startup_event():
     """Startup event handler"""
     logger.info(" Starting WhatsApp AI Chatbot...")
     logger.info(f" Server running on http://{settings.HOST}:{settings.PORT}")
+    await whatsapp_client.start()
+    await message_dispatcher.start()
+    await realtime_pool.start()
+    await status_aggregator.start()
+    if tts_cache is not None:
+        await tts_cache.start()
+    
+    # kill -HUP re-reads the allow-list without a restart
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, allow_list.reload)
+    except (NotImplementedError, AttributeError, RuntimeError):
+        pass
+    
+    # Render fixed phrases in the background so startup isn't delayed
+    asyncio.create_task(prewarm_tts_cache(settings.tts_prewarm_phrase_list))
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Shutdown event handler"""
+    logger.info(" Shutting down WhatsApp AI Chatbot...")
+    await message_coalescer.close()
+    await message_dispatcher.stop()
+    await realtime_pool.close()
+    await status_aggregator.close()
+    await whatsapp_client.close()
+    await close_redis()
 
 
 @app.get("/")
@@ -46,6 +110,34 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
 
 
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
+
+@app.get("/stats")
+async def stats():
+    """Runtime stats (connection pools, queues)"""
+    return {
+        "whatsapp_pool": whatsapp_client.pool_stats(),
+        "whatsapp_media_cache": whatsapp_client.media_cache_stats(),
+        "dispatcher": message_dispatcher.stats(),
+        "coalescer": message_coalescer.stats(),
+        "replies": reply_guard.stats(),
+        "dedup": message_deduplicator.stats(),
+        "webhook_filter": webhook_filter.stats(),
+        "delivery_status": status_aggregator.stats(),
+        "conversations": conversation_store.stats(),
+        "history": history_stats(),
+        "tts_cache": tts_cache.stats() if tts_cache else None,
+        "audio_codec": {"backend": audio_codec.name, **encode_load.stats()},
+        "realtime_sessions": realtime_pool.stats(),
+        "voice_pipeline": voice_router.stats()
+    }
+
+
 # WhatsApp Webhook Routes
 
 @app.get("/webhook")
@@ -69,78 +161,335 @@ async def verify_webhook(request: Request):
 
 
 @app.post("/webhook")
-async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
+async def receive_webhook(request: Request):
     """
     Webhook endpoint to receive WhatsApp messages
+    
+    The raw body is read once, its X-Hub-Signature-256 HMAC (APP_SECRET) is
+    checked over those bytes, and it is parsed into InboundMessage records.
+    Status-only payloads and messages from numbers outside the allow-list are
+    dropped here, before any read receipt or queued work. The remaining
+    messages are queued on the dispatcher (bounded, per-user ordered).
+    When the queue stays full we answer 503 so Meta redelivers later.
     """
     try:
-        body = await request.json()
-        logger.info(f" Received webhook: {body}")
+        raw = await request.body()
+        if settings.WEBHOOK_VERIFY_SIGNATURE and not verify_signature(
+            raw, request.headers.get(SIGNATURE_HEADER), settings.APP_SECRET
+        ):
+            webhook_filter.reject("bad_signature")
+            logger.warning(f" Webhook rejected: missing or invalid {SIGNATURE_HEADER} ({len(raw)} bytes)")
+            return JSONResponse(content={"status": "error", "message": "Invalid signature"}, status_code=401)
         
-        # Process webhook in background
-        background_tasks.add_task(process_webhook, body)
+        try:
+            body = parse_webhook(raw)
+            messages = webhook_filter.select(body)
+        except InvalidWebhook as e:
+            webhook_filter.reject("malformed")
+            logger.warning(f" Webhook rejected: {e}")
+            return JSONResponse(content={"status": "error", "message": str(e)}, status_code=400)
+        
+        logger.info(f" Received webhook: {len(raw)} bytes, {len(messages)} message(s) to handle")
+        if not messages:
+            return JSONResponse(content={"status": "received"}, status_code=200)
+        
+        await process_webhook(messages)
         
         return JSONResponse(content={"status": "received"}, status_code=200)
     
+    except DispatcherFull as e:
+        logger.warning(f" Webhook deferred, dispatcher is full: {e}")
+        return JSONResponse(content={"status": "busy", "message": str(e)}, status_code=503)
+    
     except Exception as e:
         logger.error(f" Error processing webhook: {e}")
         return JSONResponse(content={"status": "error", "message": str(e)}, status_code=500)
 
 
-async def process_webhook(body: Dict[str, Any]):
-    """Process WhatsApp webhook payload"""
+async def process_webhook(messages: List[InboundMessage]):
+    """
+    Queue the messages picked out of a webhook payload by webhook_filter
+    
+    Args:
+        messages: Messages from allowed senders, in payload order
+    
+    Redelivered messages (same message id) are dropped before any API call.
+    Each message is queued on the dispatcher under its sender's number, so one
+    user's messages are handled in order while different users run in parallel.
+    
+    Raises:
+        DispatcherFull: The dispatcher queue stayed full
+    """
     try:
-        if body.get("object") != "whatsapp_business_account":
-            logger.warning(f" Unknown webhook object: {body.get('object')}")
-            return
-        
-        for entry in body.get("entry", []):
-            for change in entry.get("changes", []):
-                value = change.get("value", {})
-                
-                # Handle messages
-                if "messages" in value:
-                    for message in value["messages"]:
-                        await handle_incoming_message(message, value)
-                
-                # Handle status updates
-                if "statuses" in value:
-                    for status in value["statuses"]:
-                        logger.info(f" Status update: {status.get('status')} for {status.get('id')}")
+        for message in messages:
+            message_id = message.id
+            if message_id and await message_deduplicator.is_duplicate(message_id):
+                logger.info(f" Duplicate delivery of {message_id}, skipping")
+                continue
+            
+            # A message we answer supersedes the sender's reply in progress
+            from_number = message.from_number
+            if message.type in ("text", "audio"):
+                generation = reply_guard.bump(from_number)
+            else:
+                generation = reply_guard.current(from_number)
+            received = time.monotonic()
+            
+            try:
+                await message_dispatcher.submit(
+                    from_number,
+                    lambda message=message, generation=generation, received=received:
+                        handle_incoming_message(message, generation, received)
+                )
+            except DispatcherFull:
+                # Not queued - let Meta's redelivery through
+                if message_id:
+                    await message_deduplicator.forget(message_id)
+                raise
     
+    except DispatcherFull:
+        raise
     except Exception as e:
         logger.error(f" Error in process_webhook: {e}")
 
 
-async def handle_incoming_message(message: dict, value: dict):
-    """Handle incoming WhatsApp message"""
+async def generate_voice_reply(from_number: str, text: str) -> Tuple[str, bytes]:
+    """
+    Get the AI reply for `text` and render it as a voice note
+    
+    With STREAMING_REPLIES the LLM reply is streamed and TTS starts at the first
+    sentence; otherwise the full reply is generated before TTS starts.
+    The turn is not added to the history (see reply_to_turn).
+    
+    Returns:
+        (reply text, audio bytes in OGG format)
+    """
+    if settings.STREAMING_REPLIES:
+        sentences: List[str] = []
+        
+        async def collect():
+            stream = stream_ai_response(from_number, text, remember=False)
+            try:
+                async for sentence in stream:
+                    sentences.append(sentence)
+                    yield sentence
+            finally:
+                await stream.aclose()
+        
+        voice_bytes = await convert_sentences_to_speech(collect())
+        return " ".join(sentences), voice_bytes
+    
+    ai_response = await get_ai_response(from_number, text, remember=False)
+    logger.info(f" AI response: {ai_response[:100]}...")
+    return ai_response, await convert_text_to_speech_with_cleanup(ai_response)
+
+
+async def reply_to_turn(from_number: str, text: str, voice_inputs: List[PendingInput]):
+    """
+    Reply stage: get the AI reply for one user turn, render it and send it
+    
+    The turn is added to the conversation history only once the reply is
+    sent, so a reply dropped on the way leaves no trace in the history.
+    
+    Args:
+        from_number: User's phone number
+        text: The turn's text (one message, or several coalesced ones)
+        voice_inputs: Transcribed voice notes in the turn, whose cascade
+                      latency / outcome is reported to voice_router
+    """
+    started = time.perf_counter()
     try:
-        message_id = message.get("id")
-        from_number = message.get("from")
-        message_type = message.get("type")
-        timestamp = datetime.fromtimestamp(int(message.get("timestamp", 0)))
+        logger.info(" Generating voice reply...")
+        reply_text, voice_bytes = await generate_voice_reply(from_number, text)
+    except ReplyAbandoned:
+        raise
+    except Exception:
+        for item in voice_inputs:
+            voice_router.record(CASCADE, item.input_seconds + time.perf_counter() - started, ok=False)
+        raise
+    for item in voice_inputs:
+        voice_router.record(CASCADE, item.input_seconds + time.perf_counter() - started, ok=True)
+    
+    reply_guard.check("upload_audio")
+    await whatsapp_client.send_audio_message(
+        to=from_number,
+        audio_bytes=voice_bytes
+    )
+    logger.info(f" Sent voice response to {from_number}")
+    await remember_reply(from_number, text, reply_text)
+
+
+async def answer_turn(turn: PendingTurn):
+    """
+    Reply to a turn unless it is already stale
+    
+    A turn superseded before its reply was sent (LLM, TTS or upload) goes
+    back to the coalescer, so the user's next turn answers these messages too.
+    
+    Raises:
+        ReplyAbandoned: Superseded or past its deadline (see app/reply_guard.py)
+    """
+    voice_inputs = [item for item in turn.inputs if item.message_type == "audio"]
+    try:
+        reply_guard.check("get_ai_response")
+        await reply_to_turn(turn.user_phone, turn.text, voice_inputs)
+    except ReplySuperseded:
+        message_coalescer.restore(turn)
+        raise
+
+
+async def handle_turn(turn: PendingTurn):
+    """Reply to a coalesced turn (one trace, under the id of its last message)"""
+    last = turn.inputs[-1]
+    message_type = "audio" if any(item.message_type == "audio" for item in turn.inputs) else "text"
+    async with track_message(last.message_id, message_type) as trace:
+        trace.merged_ids = turn.message_ids[:-1]
+        tag_trace("coalesced", str(len(turn.inputs)))
+        with reply_guard.scope(turn.user_phone, last.generation, last.received):
+            try:
+                await answer_turn(turn)
+            except ReplyAbandoned as e:
+                trace.outcome = e.outcome
+                logger.info(f" Reply to {turn.user_phone} dropped: {e}")
+            except Exception as e:
+                trace.outcome = "error"
+                logger.error(f" Failed to convert/send voice: {e}")
+
+
+async def submit_turn(turn: PendingTurn):
+    """Coalescer flush: queue the turn's reply behind the user's other messages"""
+    await message_dispatcher.submit(turn.user_phone, lambda: handle_turn(turn))
+
+
+message_coalescer.set_flush_handler(submit_turn)
+
+
+async def queue_user_input(from_number: str, item: PendingInput, trace: MessageTrace):
+    """
+    Hand a message's text to the reply stage
+    
+    With COALESCE_WINDOW set it waits in the coalescer for the user's next
+    messages; otherwise it is answered right away.
+    
+    Raises:
+        ReplyAbandoned: Answered right away, and superseded or past its deadline
+    """
+    item.generation, item.received = reply_guard.current_scope()
+    if message_coalescer.enabled:
+        message_coalescer.add(from_number, item)
+        trace.outcome = "coalesced"
+        return
+    
+    # Messages restored from a superseded reply are answered together with this one
+    pending = message_coalescer.take(from_number)
+    turn = PendingTurn(from_number, (pending.inputs if pending else []) + [item])
+    trace.merged_ids.extend(turn.message_ids[:-1])
+    await answer_turn(turn)
+
+
+async def handle_voice_note(from_number: str, message_id: str, audio_bytes: bytes, trace: MessageTrace):
+    """
+    Answer a voice note on the pipeline picked by voice_router
+    
+    cascade transcribes it (Whisper) and passes the text on like a text
+    message (see queue_user_input); realtime answers the audio through the
+    Realtime API and sends the reply. With VOICE_PIPELINE=auto a pipeline that
+    fails before replying is retried once on the other one.
+    """
+    pipeline = voice_router.choose()
+    retried = False
+    while True:
+        started = time.perf_counter()
+        try:
+            if pipeline == REALTIME:
+                # Answer the user's pending texts first so replies stay in order
+                pending = message_coalescer.take(from_number)
+                if pending is not None:
+                    trace.merged_ids.extend(pending.message_ids)
+                    await answer_turn(pending)
+                    started = time.perf_counter()
+                reply_guard.check("realtime")
+                logger.info(" Processing voice note with the Realtime API...")
+                voice_bytes = await process_voice_with_realtime(audio_bytes, from_number)
+            else:
+                # Transcribe voice to text (Whisper)
+                reply_guard.check("transcribe_audio")
+                logger.info(" Transcribing audio with Whisper...")
+                from app.tts_converter import transcribe_audio
+                transcribed_text = await transcribe_audio(audio_bytes)
+                logger.info(f" Transcription: {transcribed_text[:100]}...")
+        except ReplyAbandoned:
+            raise
+        except Exception as e:
+            voice_router.record(pipeline, time.perf_counter() - started, ok=False)
+            fallback = voice_router.fallback(pipeline) if not retried else None
+            if fallback is None:
+                raise
+            logger.warning(f" {pipeline} pipeline failed ({e}), retrying voice note on {fallback}")
+            pipeline = fallback
+            retried = True
+            continue
+        break
+    
+    if pipeline == REALTIME:
+        voice_router.record(pipeline, time.perf_counter() - started, ok=True)
+        logger.info(f" Voice generated: {len(voice_bytes)} bytes")
+        reply_guard.check("upload_audio")
+        await whatsapp_client.send_audio_message(
+            to=from_number,
+            audio_bytes=voice_bytes
+        )
+        logger.info(f" Voice response sent to {from_number}")
+        return
+    
+    # Get AI response in Dutch and convert to Saman's voice (ElevenLabs), now or with the next messages
+    item = PendingInput(message_id, transcribed_text, "audio", input_seconds=time.perf_counter() - started)
+    await queue_user_input(from_number, item, trace)
+
+
+async def handle_incoming_message(message: InboundMessage, generation: int, received: float):
+    """
+    Handle incoming WhatsApp message (stage timings recorded in app.metrics)
+    
+    Runs under reply_guard with the generation the message was queued with,
+    so a newer message from the same user stops this one's reply.
+    """
+    async with track_message(message.id, message.type) as trace:
+        with reply_guard.scope(message.from_number, generation, received):
+            await process_message(message, trace)
+
+
+async def process_message(message: InboundMessage, trace: MessageTrace):
+    """Process one incoming WhatsApp message"""
+    try:
+        message_id = message.id
+        from_number = message.from_number
+        message_type = message.type
+        timestamp = datetime.fromtimestamp(message.timestamp)
         
         logger.info(f" Message from {from_number}: Type={message_type}")
         
-        # Mark message as read
-        await whatsapp_client.mark_message_as_read(message_id)
-        
-        # Check if message is from authorized user
-        allowed_phones = settings.allowed_phone_list
-        if allowed_phones and from_number not in allowed_phones:
+        # Check if message is from authorized user (normally already filtered in
+        # receive_webhook; re-checked in case the allow-list changed while queued)
+        if not allow_list.allowed(from_number):
+            trace.outcome = "unauthorized"
             logger.warning(f" Unauthorized number: {from_number}")
             # Silently ignore unauthorized users
             return
         
+        # Mark message as read
+        await whatsapp_client.mark_message_as_read(message_id)
+        
         # Handle TEXT messages (AI chat → Voice response)
         if message_type == "text":
             # Get message content
-            content = message.get("text", {}).get("body", "")
+            content = message.text
             logger.info(f" Message content: {content}")
             
             # Check for special commands
             if content.lower().strip() == "/clear":
-                clear_conversation(from_number)
+                message_coalescer.discard(from_number)
+                await clear_conversation(from_number)
                 
                 # Send voice confirmation for /clear command
                 try:
@@ -151,37 +500,34 @@ async def handle_incoming_message(message: dict, value: dict):
                         audio_bytes=voice_bytes
                     )
                     logger.info(f" Sent voice confirmation to {from_number}")
+                except ReplyAbandoned as e:
+                    trace.outcome = e.outcome
+                    logger.info(f" Confirmation to {from_number} dropped: {e}")
                 except Exception as e:
+                    trace.outcome = "error"
                     logger.error(f" Failed to send voice confirmation: {e}")
                     # Error logged, no fallback message
                 return
             
-            # Get AI text response (maintains conversation history)
-            ai_response = await get_ai_response(from_number, content)
-            logger.info(f" AI response: {ai_response[:100]}...")
-            
-            # Convert AI response to voice and send
+            # Get AI response (maintains conversation history), convert to voice and send
             try:
-                logger.info(" Converting AI response to voice...")
-                voice_bytes = await convert_text_to_speech_with_cleanup(ai_response)
-                
-                await whatsapp_client.send_audio_message(
-                    to=from_number,
-                    audio_bytes=voice_bytes
-                )
-                logger.info(f" Sent voice response to {from_number}")
+                await queue_user_input(from_number, PendingInput(message_id, content, "text"), trace)
                 
+            except ReplyAbandoned as e:
+                trace.outcome = e.outcome
+                logger.info(f" Reply to {from_number} dropped: {e}")
             except Exception as e:
+                trace.outcome = "error"
                 logger.error(f" Failed to convert/send voice: {e}")
                 # Error logged, no fallback message sent
 
         
         # Handle AUDIO/VOICE messages (Voice-to-Voice with Realtime API)
         elif message_type == "audio":
-            logger.info(f" Voice message received - processing with Realtime API...")
+            logger.info(f" Voice message received - processing ({settings.VOICE_PIPELINE} pipeline)...")
             try:
                 # Get media ID
-                media_id = message.get("audio", {}).get("id")
+                media_id = message.media_id
                 if not media_id:
                     raise Exception("No media ID found in audio message")
                 
@@ -192,33 +538,16 @@ async def handle_incoming_message(message: dict, value: dict):
                 audio_bytes = await whatsapp_client.download_media(media_id)
                 logger.info(f" Downloaded {len(audio_bytes)} bytes")
                 
-                # Step 1: Transcribe voice to text (Whisper)
-                logger.info(" Transcribing audio with Whisper...")
-                from app.tts_converter import transcribe_audio
-                transcribed_text = await transcribe_audio(audio_bytes)
-                logger.info(f" Transcription: {transcribed_text[:100]}...")
-                
-                # Step 2: Get AI response in Dutch (same as text messages)
-                logger.info(" Getting AI response in Dutch...")
-                ai_response = await get_ai_response(from_number, transcribed_text)
-                logger.info(f" AI response: {ai_response[:100]}...")
-                
-                # Step 3: Convert to voice using Saman's voice (ElevenLabs)
-                logger.info(" Converting response to Saman's voice...")
-                voice_bytes = await convert_text_to_speech_with_cleanup(ai_response)
-                logger.info(f" Voice generated: {len(voice_bytes)} bytes")
-                
-                # Step 4: Send voice response
-                logger.info(" Sending voice response...")
-                await whatsapp_client.send_audio_message(
-                    to=from_number,
-                    audio_bytes=voice_bytes
-                )
-                
-                logger.info(f" Voice response sent to {from_number} (Saman's voice)")
+                # Voice note → voice reply (cascade or Realtime API, see handle_voice_note)
+                await handle_voice_note(from_number, message_id, audio_bytes, trace)
                 return
                 
+            except ReplyAbandoned as e:
+                trace.outcome = e.outcome
+                logger.info(f" Reply to {from_number} dropped: {e}")
+                return
             except Exception as e:
+                trace.outcome = "error"
                 logger.error(f" Voice processing failed: {e}")
                 # Error logged, no message sent to user
                 return
@@ -229,6 +558,7 @@ async def handle_incoming_message(message: dict, value: dict):
             # Silently ignore unsupported message types
     
     except Exception as e:
+        trace.outcome = "error"
         logger.error(f" Error handling incoming message: {e}")
         # Error logged, no message sent to user
 
@@ -278,7 +608,7 @@ async def clear_user_conversation(data: dict):
     if not phone:
         raise HTTPException(status_code=400, detail="Missing 'phone'")
     
-    clear_conversation(phone)
+    await clear_conversation(phone)
     return {"status": "success", "message": f"Cleared conversation for {phone}"}
 
 
@@ -0,0 +1,169 @@
+import logging
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages take anywhere from a few ms (ffmpeg) to tens of seconds (LLM + TTS)
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 15.0, 30.0, 60.0)
+
+STAGE_SECONDS = Histogram(
+    "voicebot_stage_seconds",
+    "Duration of each pipeline stage",
+    ["stage", "message_type"],
+    buckets=LATENCY_BUCKETS
+)
+MESSAGE_SECONDS = Histogram(
+    "voicebot_message_seconds",
+    "End-to-end handling time per incoming message",
+    ["message_type", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+UPSTREAM_ERRORS = Counter(
+    "voicebot_upstream_errors_total",
+    "Failed calls to upstream services",
+    ["upstream", "stage"]
+)
+UPSTREAM_RETRIES = Counter(
+    "voicebot_upstream_retries_total",
+    "Retried calls to upstream services",
+    ["upstream", "stage"]
+)
+STAGES_INTERRUPTED = Counter(
+    "voicebot_stages_interrupted_total",
+    "Stages stopped on purpose (reply superseded, past its deadline), not counted as errors",
+    ["stage", "outcome"]
+)
+PIPELINES_IN_FLIGHT = Gauge(
+    "voicebot_pipelines_in_flight",
+    "Incoming messages currently being handled",
+    ["message_type"]
+)
+
+
+class StageInterrupted(Exception):
+    """Base for exceptions that stop work on purpose rather than on failure"""
+
+    outcome = "interrupted"
+
+
+class MessageTrace:
+    """Stage timings collected while handling one incoming message"""
+
+    def __init__(self, message_id: str, message_type: str):
+        self.message_id = message_id
+        self.message_type = message_type
+        self.started = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+        self.outcome = "ok"
+        self.finished: Optional[float] = None
+        self.tags: Dict[str, str] = {}  # Decisions made on the way (encode profile...)
+        self.merged_ids: List[str] = []  # Earlier messages answered by this message's reply
+
+    def summary(self) -> str:
+        total = (self.finished or time.perf_counter()) - self.started
+        stages = " ".join(f"{name}={seconds:.3f}s" for name, seconds in self.stages)
+        tags = "".join(f" {key}={value}" for key, value in self.tags.items())
+        return (
+            f"message={self.message_id} type={self.message_type} "
+            f"outcome={self.outcome} total={total:.3f}s {stages}{tags}"
+        )
+
+
+_current_trace: ContextVar[Optional[MessageTrace]] = ContextVar("current_trace", default=None)
+
+# Callbacks receiving every finished trace (used by the benchmark harness)
+_trace_listeners: List[Callable[[MessageTrace], None]] = []
+
+
+def add_trace_listener(listener: Callable[[MessageTrace], None]):
+    """Call `listener` with each finished MessageTrace"""
+    _trace_listeners.append(listener)
+
+
+def current_trace() -> Optional[MessageTrace]:
+    """Trace of the message being handled in this task, if any"""
+    return _current_trace.get()
+
+
+@asynccontextmanager
+async def track_message(message_id: str, message_type: str) -> AsyncIterator[MessageTrace]:
+    """
+    Track one incoming message: in-flight gauge, end-to-end histogram and trace
+
+    Stages timed with stage() inside this block are attached to the trace.
+    With TRACE_MESSAGES enabled one summary line is logged per message.
+    """
+    trace = MessageTrace(message_id, message_type)
+    token = _current_trace.set(trace)
+    in_flight = PIPELINES_IN_FLIGHT.labels(message_type)
+    in_flight.inc()
+    try:
+        yield trace
+    except StageInterrupted as e:
+        trace.outcome = e.outcome
+        raise
+    except Exception:
+        trace.outcome = "error"
+        raise
+    finally:
+        trace.finished = time.perf_counter()
+        in_flight.dec()
+        _current_trace.reset(token)
+        MESSAGE_SECONDS.labels(message_type, trace.outcome).observe(trace.finished - trace.started)
+        if settings.TRACE_MESSAGES:
+            logger.info(f" Trace {trace.summary()}")
+        for listener in _trace_listeners:
+            listener(trace)
+
+
+@asynccontextmanager
+async def stage(name: str, upstream: Optional[str] = None) -> AsyncIterator[None]:
+    """
+    Time a pipeline stage
+
+    Args:
+        name: Stage name (e.g. "transcribe_audio")
+        upstream: Upstream service called in this stage; failures count as its errors
+    """
+    trace = _current_trace.get()
+    started = time.perf_counter()
+    try:
+        yield
+    except StageInterrupted as e:
+        STAGES_INTERRUPTED.labels(name, e.outcome).inc()
+        raise
+    except Exception:
+        UPSTREAM_ERRORS.labels(upstream or "local", name).inc()
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(name, trace.message_type if trace else "none").observe(elapsed)
+        if trace is not None:
+            trace.stages.append((name, elapsed))
+
+
+def tag_trace(key: str, value: str):
+    """Attach a tag to the current message's trace (no-op outside a message)"""
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.tags[key] = value
+
+
+def record_retry(upstream: str, stage_name: str):
+    """Count a retried upstream call"""
+    UPSTREAM_RETRIES.labels(upstream, stage_name).inc()
+
+
+def register_gauge(name: str, description: str, read: Callable[[], float]):
+    """Expose a value read from a component (queue depth, pool size...) as a gauge"""
+    Gauge(name, description).set_function(read)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """Prometheus exposition (body, content type)"""
+    return generate_latest(), CONTENT_TYPE_LATEST
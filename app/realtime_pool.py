@@ -0,0 +1,256 @@
+import asyncio
+import json
+import logging
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+import websockets
+from prometheus_client import Counter, Histogram
+from app.config import settings
+from app.metrics import LATENCY_BUCKETS, stage
+
+logger = logging.getLogger(__name__)
+
+Message = Dict[str, str]
+
+REALTIME_SESSIONS = Counter(
+    "voicebot_realtime_sessions_total",
+    "Realtime API sessions used for voice notes, by whether they were reused",
+    ["result"]
+)
+REALTIME_SETUP_SECONDS = Histogram(
+    "voicebot_realtime_setup_seconds",
+    "Time to connect and configure a new Realtime API session",
+    buckets=LATENCY_BUCKETS
+)
+REALTIME_SETUP_SAVED = Counter(
+    "voicebot_realtime_setup_seconds_saved_total",
+    "Estimated session setup time avoided by reusing Realtime API sessions"
+)
+
+
+def conversation_item(message: Message) -> Dict[str, Any]:
+    """conversation.item.create event for a stored chat message"""
+    content_type = "text" if message["role"] == "assistant" else "input_text"
+    return {
+        "type": "conversation.item.create",
+        "item": {
+            "type": "message",
+            "role": message["role"],
+            "content": [{"type": content_type, "text": message["content"]}]
+        }
+    }
+
+
+class RealtimeSession:
+    """
+    One configured Realtime API WebSocket, reused across a user's voice notes
+
+    `history` mirrors the conversation the server-side session already holds,
+    so the pool can tell whether the stored conversation moved on without it
+    (text messages, cleared history) and the session has to be rebuilt.
+    """
+
+    def __init__(self, user_phone: str, ws, config: Dict[str, Any], history: List[Message], setup_seconds: float):
+        self.user_phone = user_phone
+        self.ws = ws
+        self.config = config
+        self.history = list(history)
+        self.setup_seconds = setup_seconds
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.turns = 0
+        self.in_use = False
+        self.pooled = False
+
+    async def send(self, event: Dict[str, Any]):
+        await self.ws.send(json.dumps(event))
+
+    def record_turn(self, *messages: Message):
+        """Remember messages the session produced, trimmed like the conversation store"""
+        self.turns += 1
+        self.history = (self.history + list(messages))[-settings.CONVERSATION_MAX_MESSAGES:]
+
+    def expired(self, now: float, idle_timeout: float, max_age: float) -> bool:
+        return not self.in_use and (now - self.last_used > idle_timeout or now - self.created > max_age)
+
+    async def close(self):
+        try:
+            await self.ws.close()
+        except Exception as e:
+            logger.debug(f" Error closing Realtime session for {self.user_phone}: {e}")
+
+
+class RealtimeSessionPool:
+    """
+    Realtime API sessions keyed by user phone
+
+    A session is connected and configured (session.update, conversation
+    history as conversation items) once, then reused for that user's next
+    voice notes. Sessions idle for `idle_timeout` seconds or older than
+    `max_age` are closed, and at most `max_sessions` stay open (least
+    recently used idle sessions are closed first; when all are busy the
+    extra session is closed after its turn).
+    """
+
+    def __init__(self, max_sessions: int, idle_timeout: float, max_age: float):
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.max_age = max_age
+        self._sessions: "OrderedDict[str, RealtimeSession]" = OrderedDict()
+        self._reaper: Optional[asyncio.Task] = None
+        self.created = 0
+        self.reused = 0
+        self.seconds_saved = 0.0
+        self._setup_seconds_total = 0.0
+
+    async def start(self):
+        """Start closing idle sessions in the background"""
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap())
+
+    async def close(self):
+        """Close all sessions (call at shutdown)"""
+        if self._reaper is not None:
+            self._reaper.cancel()
+            self._reaper = None
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            await session.close()
+
+    @asynccontextmanager
+    async def session(self, user_phone: str, history: List[Message],
+                      config: Dict[str, Any]) -> AsyncIterator[RealtimeSession]:
+        """
+        Check out the user's session for one turn
+
+        Args:
+            user_phone: User's phone number
+            history: Stored conversation, sent as items when a session is created
+            config: session.update payload; a session with another config is rebuilt
+
+        Yields:
+            RealtimeSession ready for input_audio_buffer events
+        """
+        session = await self._checkout(user_phone, history, config)
+        try:
+            yield session
+        except BaseException:
+            # The server state of an interrupted turn is unknown, don't reuse it
+            self._forget(session)
+            await session.close()
+            raise
+        session.in_use = False
+        session.last_used = time.monotonic()
+        if not session.pooled:
+            await session.close()
+
+    async def _checkout(self, user_phone: str, history: List[Message], config: Dict[str, Any]) -> RealtimeSession:
+        history = history[-settings.CONVERSATION_MAX_MESSAGES:]
+        session = self._sessions.get(user_phone)
+        if session is not None and not session.in_use:
+            if session.ws.open and session.config == config and session.history == history \
+                    and time.monotonic() - session.created < self.max_age:
+                session.in_use = True
+                self._sessions.move_to_end(user_phone)
+                self._record_reuse()
+                return session
+            self._forget(session)
+            await session.close()
+
+        session = await self._open(user_phone, history, config)
+        session.in_use = True
+        if user_phone not in self._sessions and await self._make_room():
+            session.pooled = True
+            self._sessions[user_phone] = session
+        return session
+
+    async def _open(self, user_phone: str, history: List[Message], config: Dict[str, Any]) -> RealtimeSession:
+        ws_url = f"{settings.REALTIME_API_URL}?model={settings.OPENAI_REALTIME_MODEL}"
+        headers = {
+            "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
+            "OpenAI-Beta": "realtime=v1"
+        }
+
+        started = time.perf_counter()
+        async with stage("realtime_connect", upstream="openai"):
+            ws = await websockets.connect(ws_url, extra_headers=headers)
+            try:
+                await ws.send(json.dumps({"type": "session.update", "session": config}))
+                await self._wait_for(ws, "session.updated")
+                for message in history:
+                    await ws.send(json.dumps(conversation_item(message)))
+            except BaseException:
+                await ws.close()
+                raise
+        setup_seconds = time.perf_counter() - started
+
+        self.created += 1
+        self._setup_seconds_total += setup_seconds
+        REALTIME_SESSIONS.labels("created").inc()
+        REALTIME_SETUP_SECONDS.observe(setup_seconds)
+        logger.info(f" Realtime session opened for {user_phone} in {setup_seconds:.3f}s ({len(history)} history items)")
+        return RealtimeSession(user_phone, ws, config, history, setup_seconds)
+
+    @staticmethod
+    async def _wait_for(ws, event_type: str):
+        async for message in ws:
+            event = json.loads(message)
+            if event.get("type") == event_type:
+                return
+            if event.get("type") == "error":
+                raise Exception(f"Realtime API error: {event.get('error', {})}")
+        raise Exception(f"Realtime API closed the connection before {event_type}")
+
+    def _record_reuse(self):
+        saved = self._setup_seconds_total / self.created if self.created else 0.0
+        self.reused += 1
+        self.seconds_saved += saved
+        REALTIME_SESSIONS.labels("reused").inc()
+        REALTIME_SETUP_SAVED.inc(saved)
+
+    async def _make_room(self) -> bool:
+        if len(self._sessions) < self.max_sessions:
+            return True
+        for session in self._sessions.values():
+            if not session.in_use:
+                self._forget(session)
+                await session.close()
+                return True
+        return False
+
+    def _forget(self, session: RealtimeSession):
+        if self._sessions.get(session.user_phone) is session:
+            del self._sessions[session.user_phone]
+        session.pooled = False
+
+    async def _reap(self):
+        while True:
+            await asyncio.sleep(min(30.0, self.idle_timeout))
+            now = time.monotonic()
+            expired = [s for s in self._sessions.values() if s.expired(now, self.idle_timeout, self.max_age)]
+            for session in expired:
+                self._forget(session)
+                await session.close()
+
+    def stats(self) -> Dict[str, Any]:
+        uses = self.created + self.reused
+        return {
+            "sessions": len(self._sessions),
+            "in_use": sum(1 for session in self._sessions.values() if session.in_use),
+            "created": self.created,
+            "reused": self.reused,
+            "reuse_rate": round(self.reused / uses, 4) if uses else 0.0,
+            "avg_setup_seconds": round(self._setup_seconds_total / self.created, 4) if self.created else 0.0,
+            "seconds_saved": round(self.seconds_saved, 3)
+        }
+
+
+# Global Realtime session pool
+realtime_pool = RealtimeSessionPool(
+    max_sessions=settings.REALTIME_MAX_SESSIONS,
+    idle_timeout=settings.REALTIME_SESSION_IDLE_TIMEOUT,
+    max_age=settings.REALTIME_SESSION_MAX_AGE
+)
@@ -4,27 +4,35 @@ import json
 import logging
 import websockets
 import io
-import subprocess
 import tempfile
 import os
-from typing import List
+from typing import Any, AsyncIterator, Dict, List, Optional, Union
 from app.config import settings
+from app.audio_codec import audio_codec
+from app.conversation_store import conversation_store
+from app.realtime_pool import realtime_pool
+from app.metrics import stage
 
 logger = logging.getLogger(__name__)
 
+# Raw PCM per input_audio_buffer.append frame (~128ms at 24kHz). A multiple of 3
+# so every frame base64-encodes to whole groups, and of 2 so samples stay whole.
+APPEND_CHUNK_BYTES = 6144
+
 
 async def process_voice_with_realtime(
     audio_bytes: bytes,
-    user_phone: str,
-    conversation_context: str = ""
+    user_phone: str
 ) -> bytes:
     """
     Process voice message using OpenAI Realtime API
     
+    The conversation so far comes from the conversation store and both turns
+    are stored afterwards, so the Realtime path and the cascade share history.
+    
     Args:
         audio_bytes: Input audio bytes (OGG format from WhatsApp)
-        user_phone: User's phone number for context
-        conversation_context: Previous conversation context
+        user_phone: User's phone number (session and conversation key)
         
     Returns:
         Response audio bytes (OGG format for WhatsApp)
@@ -32,20 +40,14 @@ async def process_voice_with_realtime(
     try:
         logger.info(f" Processing voice message with Realtime API for {user_phone}")
         
-        # Step 1: Convert WhatsApp OGG to PCM for Realtime API
-        logger.info("🔄 Converting OGG to PCM...")
-        pcm_audio = convert_to_pcm(audio_bytes)
-        logger.info(f" Converted to PCM: {len(pcm_audio)} bytes")
+        # Step 1 + 2: Convert WhatsApp OGG to PCM and stream it over the user's
+        # (pooled) Realtime session while it is being decoded
+        logger.info("🔌 Streaming audio to OpenAI Realtime API...")
+        pcm_chunks = audio_codec.decode_to_pcm_stream(audio_bytes, 24000)
         
-        # Step 2: Connect to Realtime API and process
-        logger.info("🔌 Connecting to OpenAI Realtime API...")
-        response_pcm = await send_to_realtime_api(pcm_audio, user_phone, conversation_context)
-        logger.info(f" Received response: {len(response_pcm)} bytes")
-        
-        # Step 3: Convert response PCM back to OGG for WhatsApp
-        logger.info("🔄 Converting PCM to OGG...")
-        ogg_audio = convert_from_pcm(response_pcm)
-        logger.info(f" Converted to OGG: {len(ogg_audio)} bytes")
+        # Step 3: Response PCM is encoded to OGG for WhatsApp while it streams in
+        ogg_audio = await send_to_realtime_api(pcm_chunks, user_phone, encode_ogg=True)
+        logger.info(f" Received response: {len(ogg_audio)} bytes OGG")
         
         return ogg_audio
         
@@ -56,9 +58,9 @@ async def process_voice_with_realtime(
 
 def convert_to_pcm(audio_bytes: bytes) -> bytes:
     """
-    Convert WhatsApp audio (OGG/Opus) to PCM format for Realtime API using ffmpeg CLI
+    Convert WhatsApp audio (OGG/Opus) to PCM format for Realtime API
     
-    Uses stdin/stdout piping to avoid temp file permission issues with snap
+    Uses the audio codec backend (ffmpeg CLI with stdin/stdout piping, or in-process PyAV)
     
     Required format:
     - Sample rate: 24000 Hz
@@ -73,29 +75,10 @@ def convert_to_pcm(audio_bytes: bytes) -> bytes:
         PCM audio bytes
     """
     try:
-        # Use ffmpeg with stdin/stdout pipes (no temp files needed!)
-        # -i pipe:0: read from stdin
-        # -f s16le: output format (signed 16-bit little-endian PCM)
-        # -ac 1: 1 audio channel (mono)
-        # -ar 24000: sample rate 24kHz
-        # pipe:1: write to stdout
-        result = subprocess.run([
-            'ffmpeg',
-            '-i', 'pipe:0',  # Read from stdin
-            '-f', 's16le',
-            '-ac', '1',
-            '-ar', '24000',
-            '-loglevel', 'error',  # Only show errors
-            'pipe:1'  # Write to stdout
-        ], input=audio_bytes, capture_output=True, check=True)
-        
-        pcm_data = result.stdout
-        logger.info(f" ffmpeg conversion successful: {len(pcm_data)} bytes")
+        pcm_data = audio_codec.decode_to_pcm_sync(audio_bytes, 24000)
+        logger.info(f" {audio_codec.name} conversion successful: {len(pcm_data)} bytes")
         return pcm_data
         
-    except subprocess.CalledProcessError as e:
-        logger.error(f" ffmpeg conversion failed: {e.stderr.decode()}")
-        raise Exception(f"Audio conversion failed: {e.stderr.decode()}")
     except Exception as e:
         logger.error(f" Error converting to PCM: {e}")
         raise
@@ -103,10 +86,11 @@ def convert_to_pcm(audio_bytes: bytes) -> bytes:
 
 def convert_from_pcm(pcm_bytes: bytes) -> bytes:
     """
-    Convert PCM audio to OGG format for WhatsApp using ffmpeg CLI
+    Convert PCM audio to OGG format for WhatsApp
     
-    Uses stdin/stdout piping to avoid temp file permission issues with snap
-    Optimized for WhatsApp voice message waveform display
+    Uses the audio codec backend (ffmpeg CLI with stdin/stdout piping, or in-process PyAV)
+    Optimized for WhatsApp voice message waveform display:
+    resampled to 16kHz, Opus 16k VBR, 60ms frames, voip application
     
     Args:
         pcm_bytes: PCM audio bytes (24kHz, mono, 16-bit)
@@ -115,151 +99,214 @@ def convert_from_pcm(pcm_bytes: bytes) -> bytes:
         OGG audio bytes (properly formatted for WhatsApp at 16kHz)
     """
     try:
-        # Use ffmpeg with stdin/stdout pipes (no temp files needed!)
-        # -f s16le: input format (signed 16-bit little-endian PCM)
-        # -ar 24000: input sample rate (from Realtime API)
-        # -ac 1: input channels (mono)
-        # -i pipe:0: read from stdin
-        # -ar 16000: RESAMPLE to 16kHz (WhatsApp standard for voice messages!)
-        # -c:a libopus: use Opus codec (WhatsApp compatible)
-        # -b:a 16k: bitrate optimized for 16kHz voice
-        # -vbr on: variable bitrate for better quality
-        # -compression_level 10: maximum compression quality
-        # -frame_duration 60: 60ms frames (WhatsApp standard)
-        # -application voip: optimize for voice (not music)
-        # -f ogg: output format
-        # pipe:1: write to stdout
-        result = subprocess.run([
-            'ffmpeg',
-            '-f', 's16le',
-            '-ar', '24000',  # Input is 24kHz from Realtime API
-            '-ac', '1',
-            '-i', 'pipe:0',  # Read from stdin
-            '-ar', '16000',  # RESAMPLE to 16kHz for WhatsApp!
-            '-c:a', 'libopus',
-            '-b:a', '16k',  # Lower bitrate for 16kHz
-            '-vbr', 'on',   # Variable bitrate
-            '-compression_level', '10',  # Max quality
-            '-frame_duration', '60',     # 60ms frames
-            '-application', 'voip',      # Voice optimized
-            '-f', 'ogg',
-            '-loglevel', 'error',  # Only show errors
-            'pipe:1'  # Write to stdout
-        ], input=pcm_bytes, capture_output=True, check=True)
-        
-        ogg_data = result.stdout
-        logger.info(f" ffmpeg conversion successful (16kHz): {len(ogg_data)} bytes")
+        ogg_data = audio_codec.encode_sync(pcm_bytes, "pcm_24000")
+        logger.info(f" {audio_codec.name} conversion successful (16kHz): {len(ogg_data)} bytes")
         return ogg_data
         
-    except subprocess.CalledProcessError as e:
-        logger.error(f" ffmpeg conversion failed: {e.stderr.decode()}")
-        raise Exception(f"Audio conversion failed: {e.stderr.decode()}")
     except Exception as e:
         logger.error(f" Error converting from PCM: {e}")
         raise
 
 
+def build_session_config() -> Dict[str, Any]:
+    """
+    session.update payload for voice note sessions
+    
+    Conversation history is not part of it: new sessions get the stored
+    messages as conversation items, reused sessions already hold them.
+    In manual turn mode server VAD is off and turns are committed explicitly.
+    """
+    if settings.REALTIME_TURN_MODE == "server_vad":
+        turn_detection = {"type": "server_vad"}
+    else:
+        turn_detection = None
+    
+    return {
+        "modalities": ["audio", "text"],  # API requires both
+        "voice": settings.OPENAI_REALTIME_VOICE,
+        "instructions": build_instructions(),
+        "input_audio_format": "pcm16",
+        "output_audio_format": "pcm16",
+        "input_audio_transcription": {"model": "whisper-1"},  # User turn text for the conversation store
+        "turn_detection": turn_detection
+    }
+
+
+async def stream_audio_to_realtime(session, pcm_chunks: AsyncIterator[bytes]) -> int:
+    """
+    Send PCM as input_audio_buffer.append frames while it is being produced
+    
+    Frames are base64-encoded straight from memoryview slices of one buffer,
+    so no extra copy of the audio is made per frame, and the first frames
+    go out before decoding has finished.
+    
+    Args:
+        session: RealtimeSession to send on
+        pcm_chunks: PCM16 audio chunks of any size
+        
+    Returns:
+        PCM bytes sent
+    """
+    async def send_frame(data: memoryview):
+        # base64 needs no JSON escaping, so the event is assembled directly
+        audio_b64 = base64.b64encode(data).decode('ascii')
+        await session.ws.send('{"type":"input_audio_buffer.append","audio":"' + audio_b64 + '"}')
+    
+    buffer = bytearray()
+    sent = 0
+    async for chunk in pcm_chunks:
+        buffer += chunk
+        usable = len(buffer) - len(buffer) % APPEND_CHUNK_BYTES
+        if not usable:
+            continue
+        view = memoryview(buffer)
+        try:
+            for offset in range(0, usable, APPEND_CHUNK_BYTES):
+                await send_frame(view[offset:offset + APPEND_CHUNK_BYTES])
+        finally:
+            view.release()
+        del buffer[:usable]
+        sent += usable
+    
+    if buffer:
+        with memoryview(buffer) as view:
+            await send_frame(view)
+        sent += len(buffer)
+    return sent
+
+
+async def _single_chunk(data: bytes) -> AsyncIterator[bytes]:
+    yield data
+
+
+async def _wait_for_input_transcript(ws, item_id: str, timeout: float) -> str:
+    """
+    Read events until the input transcription of `item_id` arrives
+    
+    Whisper transcription of the input runs alongside the response and usually
+    completes after response.done.
+    
+    Returns:
+        The transcript, or "" if it failed or took longer than `timeout`
+    """
+    async def receive() -> str:
+        async for message in ws:
+            try:
+                event = json.loads(message)
+            except json.JSONDecodeError:
+                continue
+            if event.get("item_id") != item_id:
+                continue
+            if event.get("type") == "conversation.item.input_audio_transcription.completed":
+                return event.get("transcript", "").strip()
+            if event.get("type") == "conversation.item.input_audio_transcription.failed":
+                logger.warning(f" Input transcription failed: {event.get('error')}")
+                return ""
+        return ""
+    
+    try:
+        return await asyncio.wait_for(receive(), timeout)
+    except asyncio.TimeoutError:
+        logger.warning(f" No input transcript within {timeout}s, storing the turn without it")
+        return ""
+
+
 async def send_to_realtime_api(
-    pcm_audio: bytes,
+    pcm_audio: Union[bytes, AsyncIterator[bytes]],
     user_phone: str,
-    conversation_context: str = ""
+    history: Optional[List[Dict[str, str]]] = None,
+    encode_ogg: bool = False
 ) -> bytes:
     """
     Send audio to OpenAI Realtime API and receive response
     
+    Uses the user's pooled session (see app/realtime_pool.py), so the
+    WebSocket, TLS and session setup are paid once per conversation rather
+    than per voice note.
+    
+    With encode_ogg, response.audio.delta PCM is fed to an Ogg/Opus encoder
+    as it arrives instead of being collected: the voice note is ready right
+    after response.done and memory stays bounded whatever the reply length.
+    
     Args:
-        pcm_audio: PCM audio bytes
+        pcm_audio: PCM audio bytes, or an async iterator of PCM chunks
+                   (e.g. audio_codec.decode_to_pcm_stream) streamed as they come
         user_phone: User's phone number
-        conversation_context: Previous conversation context
+        history: Conversation so far (default: read from the conversation store)
+        encode_ogg: Return a WhatsApp voice note instead of raw PCM
         
     Returns:
-        Response PCM audio bytes
+        Response audio bytes (PCM 24kHz, or OGG with encode_ogg)
     """
-    # Build WebSocket URL
-    ws_url = f"{settings.REALTIME_API_URL}?model={settings.OPENAI_REALTIME_MODEL}"
-    
-    # Headers for authentication
-    headers = {
-        "Authorization": f"Bearer {settings.OPENAI_API_KEY}",
-        "OpenAI-Beta": "realtime=v1"
-    }
+    if history is None:
+        history = await conversation_store.get_messages(user_phone)
     
     response_audio_chunks: List[bytes] = []
+    response_audio_bytes = 0
+    input_item_id = None
+    user_transcript = ""
+    response_transcript = ""
+    
+    # Started before the turn so encoder startup overlaps the network round trip
+    encoder = None
+    finishing: Optional[asyncio.Task] = None
+    if encode_ogg:
+        encoder = audio_codec.open_encoder("pcm_24000")
+        await encoder.start()
     
     try:
-        # Connect to WebSocket
-        async with websockets.connect(ws_url, extra_headers=headers) as ws:
-            logger.info(" Connected to Realtime API WebSocket")
-            
-            # Step 1: Configure session
-            session_config = {
-                "type": "session.update",
-                "session": {
-                    "modalities": ["audio", "text"],  # API requires both
-                    "voice": settings.OPENAI_REALTIME_VOICE,
-                    "instructions": build_instructions(user_phone, conversation_context),
-                    "input_audio_format": "pcm16",
-                    "output_audio_format": "pcm16",
-                    "turn_detection": {
-                        "type": "server_vad"
-                    }
-                }
-            }
-            await ws.send(json.dumps(session_config))
-            logger.info("📤 Sent session configuration")
+        async with realtime_pool.session(user_phone, history, build_session_config()) as session:
+            ws = session.ws
             
-            # Step 2: Send audio input
-            audio_b64 = base64.b64encode(pcm_audio).decode('utf-8')
+            # Step 1: Send audio input
+            if isinstance(pcm_audio, (bytes, bytearray)):
+                pcm_audio = _single_chunk(pcm_audio)
+            sent = await stream_audio_to_realtime(session, pcm_audio)
+            logger.info(f"📤 Sent audio input: {sent} bytes")
             
-            # Send in chunks if audio is large
-            chunk_size = 8192  # Send 8KB at a time
-            for i in range(0, len(audio_b64), chunk_size):
-                chunk = audio_b64[i:i + chunk_size]
-                append_event = {
-                    "type": "input_audio_buffer.append",
-                    "audio": chunk
-                }
-                await ws.send(json.dumps(append_event))
-            
-            logger.info("📤 Sent audio input")
-            
-            # Step 3: Wait for server VAD to detect end of speech
-            # Server VAD will automatically commit the buffer and trigger response
-            # No manual commit needed when using server_vad mode
-            
-            # Step 4: Receive response
-            logger.info(" Waiting for server VAD to detect end of speech and generate response...")
+            # Step 2: End the turn
+            if settings.REALTIME_TURN_MODE == "server_vad":
+                # Server VAD will automatically commit the buffer and trigger response
+                # once it detects the end of speech (after its silence timeout)
+                logger.info(" Waiting for server VAD to detect end of speech and generate response...")
+            else:
+                # A voice note is a complete recording: commit it and ask for the
+                # response right away instead of waiting for VAD silence detection
+                await session.send({"type": "input_audio_buffer.commit"})
+                await session.send({"type": "response.create"})
+                logger.info(" Committed audio, waiting for response...")
             
+            # Step 3: Receive response
             async for message in ws:
                 try:
                     event = json.loads(message)
                     event_type = event.get("type")
                     
                     # Log events
-                    if event_type == "session.created":
-                        logger.info(" Session created")
-                    elif event_type == "session.updated":
-                        logger.info(" Session updated")
-                    elif event_type == "input_audio_buffer.committed":
+                    if event_type == "input_audio_buffer.committed":
                         logger.info(" Audio committed")
-                    elif event_type == "conversation.item.created":
-                        logger.info(" Conversation item created")
+                        input_item_id = event.get("item_id")
+                    elif event_type == "conversation.item.input_audio_transcription.completed":
+                        # Transcription is asynchronous; ignore late results of earlier turns
+                        if event.get("item_id") == input_item_id:
+                            user_transcript = event.get("transcript", "").strip()
                     elif event_type == "response.created":
                         logger.info(" Response created")
-                    elif event_type == "response.output_item.added":
-                        logger.info(" Output item added")
-                    elif event_type == "response.content_part.added":
-                        logger.info(" Content part added")
                     elif event_type == "response.audio_transcript.delta":
                         # Log transcription for debugging
-                        transcript = event.get("delta", "")
-                        logger.info(f"📝 Transcript: {transcript}")
+                        logger.debug(f"📝 Transcript: {event.get('delta', '')}")
+                    elif event_type == "response.audio_transcript.done":
+                        response_transcript = event.get("transcript", "")
                     elif event_type == "response.audio.delta":
                         # Receive audio chunks
                         audio_delta = event.get("delta")
                         if audio_delta:
                             audio_chunk = base64.b64decode(audio_delta)
-                            response_audio_chunks.append(audio_chunk)
+                            response_audio_bytes += len(audio_chunk)
+                            if encoder is not None:
+                                await encoder.write(audio_chunk)
+                            else:
+                                response_audio_chunks.append(audio_chunk)
                             logger.debug(f" Received audio chunk: {len(audio_chunk)} bytes")
                     elif event_type == "response.audio.done":
                         logger.info(" Audio response complete")
@@ -274,32 +321,56 @@ async def send_to_realtime_api(
                 except json.JSONDecodeError:
                     logger.warning(f" Failed to parse message: {message}")
                     continue
+            
+            if not response_audio_bytes:
+                raise Exception("No audio response received from API")
+            
+            if not user_transcript and input_item_id:
+                if encoder is not None:
+                    # Encode the tail while the transcript is on its way
+                    finishing = asyncio.create_task(encoder.finish())
+                user_transcript = await _wait_for_input_transcript(ws, input_item_id, settings.REALTIME_TRANSCRIPT_WAIT)
+            
+            turn = (
+                {"role": "user", "content": user_transcript or "[voice note]"},
+                {"role": "assistant", "content": response_transcript}
+            )
+            session.record_turn(*turn)
         
-        # Combine all audio chunks
-        if not response_audio_chunks:
-            raise Exception("No audio response received from API")
+        await conversation_store.append(user_phone, *turn)
+        
+        if encoder is not None:
+            # Only the tail after the last delta is left to encode
+            async with stage("realtime_encode_tail"):
+                ogg_audio = await (finishing if finishing is not None else encoder.finish())
+            logger.info(f" Encoded {response_audio_bytes} PCM bytes to OGG: {len(ogg_audio)} bytes")
+            return ogg_audio
         
+        # Combine all audio chunks
         combined_audio = b''.join(response_audio_chunks)
         logger.info(f" Combined {len(response_audio_chunks)} chunks into {len(combined_audio)} bytes")
         
         return combined_audio
         
-    except websockets.exceptions.WebSocketException as e:
-        logger.error(f" WebSocket error: {e}")
-        raise
-    except Exception as e:
-        logger.error(f" Error in send_to_realtime_api: {e}")
+    except BaseException as e:
+        if finishing is not None and not finishing.done():
+            finishing.cancel()
+        if encoder is not None:
+            await encoder.abort()
+        if isinstance(e, websockets.exceptions.WebSocketException):
+            logger.error(f" WebSocket error: {e}")
+        elif isinstance(e, Exception):
+            logger.error(f" Error in send_to_realtime_api: {e}")
         raise
 
 
-def build_instructions(user_phone: str, conversation_context: str) -> str:
+def build_instructions() -> str:
     """
     Build system instructions for the Realtime API
     
-    Args:
-        user_phone: User's phone number
-        conversation_context: Previous conversation context
-        
+    Conversation context is not pasted in here; it is sent to the session as
+    conversation items (see app/realtime_pool.py).
+    
     Returns:
         Instructions string
     """
@@ -337,9 +408,6 @@ Stel deze vragen dan ÉÉN VOOR ÉÉN (wacht op elk antwoord voordat je de volge
 - Stel niet alle vragen tegelijk - maak het conversationeel
 - Reageer ALTIJD in het Nederlands, ongeacht de taal van de gebruiker"""
     
-    if conversation_context:
-        instructions += f"\n\nEerdere gesprekscontext:\n{conversation_context}"
-    
     return instructions
 
 
@@ -0,0 +1,39 @@
+import logging
+from typing import Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis.asyncio as redis_asyncio
+except ImportError:  # redis is an optional production dependency
+    redis_asyncio = None
+
+_redis = None
+_warned_missing = False
+
+
+def get_redis() -> Optional["redis_asyncio.Redis"]:
+    """
+    Shared async Redis client for REDIS_URL
+
+    Returns:
+        Redis client, or None if the redis package is not installed
+    """
+    global _redis, _warned_missing
+    if redis_asyncio is None:
+        if not _warned_missing:
+            _warned_missing = True
+            logger.warning(" redis package not installed, Redis features disabled")
+        return None
+    if _redis is None:
+        _redis = redis_asyncio.from_url(settings.REDIS_URL)
+    return _redis
+
+
+async def close_redis():
+    """Close the shared Redis client (call at shutdown)"""
+    global _redis
+    if _redis is not None:
+        await _redis.aclose()
+        _redis = None
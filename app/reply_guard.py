@@ -0,0 +1,148 @@
+import logging
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional, Tuple
+from prometheus_client import Counter
+from app.config import settings
+from app.metrics import StageInterrupted, tag_trace
+
+logger = logging.getLogger(__name__)
+
+REPLIES_ABANDONED = Counter(
+    "voicebot_replies_abandoned_total",
+    "Replies stopped before finishing, by reason and the stage they would have started",
+    ["reason", "stage"]
+)
+
+
+class ReplyAbandoned(StageInterrupted):
+    """Raised at a stage boundary when the reply being produced is no longer wanted"""
+
+    outcome = "abandoned"
+
+
+class ReplySuperseded(ReplyAbandoned):
+    """The user sent a newer message, which gets the reply instead"""
+
+    outcome = "superseded"
+
+
+class ReplyDeadlineExceeded(ReplyAbandoned):
+    """The reply ran past REPLY_DEADLINE"""
+
+    outcome = "deadline"
+
+
+# (user phone, generation, received) of the reply produced in this task
+_current_reply: ContextVar[Optional[Tuple[str, int, float]]] = ContextVar("current_reply", default=None)
+
+
+class ReplyGuard:
+    """
+    Per-user reply generations and end-to-end deadlines
+
+    Every message we answer bumps its sender's generation when it is queued.
+    Work for a message runs inside scope() with the generation it was queued
+    with and a deadline `deadline` seconds after it arrived; check() is called
+    before each expensive stage (transcription, LLM, TTS, upload) and raises
+    ReplySuperseded once a newer message is queued for the user, or
+    ReplyDeadlineExceeded once the deadline has passed. Stages already
+    running are not interrupted.
+
+    A user's generation is forgotten `deadline` seconds after their last
+    message: every reply for it is past its deadline by then anyway.
+    """
+
+    def __init__(self, deadline: float, supersede: bool = True):
+        self.deadline = deadline
+        self.supersede = supersede
+        # user phone -> (generation, time.monotonic() of the last bump), oldest bump first
+        self._generations: "OrderedDict[str, Tuple[int, float]]" = OrderedDict()
+        self.superseded = 0
+        self.deadline_exceeded = 0
+
+    def bump(self, user_phone: str) -> int:
+        """Register a new message from the user, superseding replies in progress"""
+        if not self.supersede:
+            return self.current(user_phone)
+        now = time.monotonic()
+        self._evict_expired(now)
+        generation = self.current(user_phone) + 1
+        self._generations.pop(user_phone, None)
+        self._generations[user_phone] = (generation, now)
+        return generation
+
+    def current(self, user_phone: str) -> int:
+        entry = self._generations.get(user_phone)
+        return entry[0] if entry is not None else 0
+
+    def _evict_expired(self, now: float):
+        while self._generations:
+            user_phone, (_, bumped) = next(iter(self._generations.items()))
+            if bumped + self.deadline > now:
+                break
+            del self._generations[user_phone]
+
+    @contextmanager
+    def scope(self, user_phone: str, generation: int, received: float) -> Iterator[None]:
+        """
+        Run reply work for one message (or coalesced turn)
+
+        Args:
+            user_phone: User's phone number
+            generation: Generation returned by bump() for the (last) message
+            received: time.monotonic() when the (last) message arrived
+        """
+        token = _current_reply.set((user_phone, generation, received))
+        try:
+            yield
+        finally:
+            _current_reply.reset(token)
+
+    def check(self, stage_name: str):
+        """
+        Stage boundary: stop if the current reply is stale (no-op outside scope())
+
+        Raises:
+            ReplySuperseded: A newer message from the user is queued
+            ReplyDeadlineExceeded: The reply's deadline has passed
+        """
+        reply = _current_reply.get()
+        if reply is None:
+            return
+        user_phone, generation, received = reply
+        # A forgotten user (see _evict_expired) is past the deadline, checked below
+        if user_phone in self._generations and self.current(user_phone) != generation:
+            self.superseded += 1
+            self._abandon("superseded", stage_name)
+            raise ReplySuperseded(f"Newer message from {user_phone}, skipping {stage_name}")
+        if time.monotonic() > received + self.deadline:
+            self.deadline_exceeded += 1
+            self._abandon("deadline", stage_name)
+            raise ReplyDeadlineExceeded(f"Reply deadline passed before {stage_name}")
+
+    def current_scope(self) -> Tuple[int, float]:
+        """(generation, received) of the current scope, for work handed to a later stage"""
+        reply = _current_reply.get()
+        if reply is None:
+            return 0, time.monotonic()
+        return reply[1], reply[2]
+
+    @staticmethod
+    def _abandon(reason: str, stage_name: str):
+        REPLIES_ABANDONED.labels(reason, stage_name).inc()
+        tag_trace("abandoned_at", stage_name)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "deadline_seconds": self.deadline,
+            "users": len(self._generations),
+            "superseded": self.superseded,
+            "deadline_exceeded": self.deadline_exceeded
+        }
+
+
+# Global reply guard
+reply_guard = ReplyGuard(deadline=settings.REPLY_DEADLINE, supersede=settings.REPLY_SUPERSEDE)
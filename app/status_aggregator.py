@@ -0,0 +1,226 @@
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+from prometheus_client import Counter, Histogram
+from app.config import settings
+from app.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Sent → delivered / read takes seconds to hours (phone offline, chat unopened)
+DELIVERY_BUCKETS = (1, 2, 5, 10, 30, 60, 300, 900, 3600, 4 * 3600, 24 * 3600)
+
+MESSAGE_STATUSES = Counter(
+    "voicebot_message_statuses_total",
+    "Delivery status callbacks for outbound messages",
+    ["status"]
+)
+DELIVERY_SECONDS = Histogram(
+    "voicebot_delivery_latency_seconds",
+    "Time from an outbound message being sent to it being delivered / read",
+    ["stage"],
+    buckets=DELIVERY_BUCKETS
+)
+
+# Latency stages, named after the status that ends them (measured from "sent")
+STAGES = ("delivered", "read")
+
+# Called with (message id, errors from the callback) for each failed message
+FailureListener = Callable[[str, List[Dict[str, Any]]], None]
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "p50": round(pick(0.50), 3),
+        "p95": round(pick(0.95), 3),
+        "p99": round(pick(0.99), 3),
+        "max": round(ordered[-1], 3)
+    }
+
+
+class DeliveryStatusAggregator:
+    """
+    Aggregates WhatsApp delivery status callbacks (sent, delivered, read, failed)
+
+    record() only updates in-memory state: per outbound message id the sent
+    timestamp and the statuses seen so far are kept (at most `max_tracked`
+    ids, least recent dropped), so delivered / read callbacks turn into
+    sent → delivered / read latencies and Meta's redeliveries of a status
+    already recorded are ignored. Callbacks are not ordered: a delivered /
+    read that arrives before its sent is held until the sent comes in, and
+    only counts as unmatched if the message is dropped without one.
+    Counts and latencies are flushed to Prometheus every `flush_interval`
+    seconds and, with `use_redis`, to Redis in one pipeline per flush, so
+    all workers' numbers add up. The last `window` latencies per stage give
+    the percentiles in stats().
+    Failure listeners (add_failure_listener) see each failed message once,
+    with Meta's error objects.
+    """
+
+    redis_key = "whatsapp:statuses"
+
+    def __init__(self, max_tracked: int, flush_interval: float, window: int, use_redis: bool):
+        self.max_tracked = max_tracked
+        self.flush_interval = flush_interval
+        self.use_redis = use_redis
+        # message id -> (sent timestamp or None, statuses recorded,
+        # stage -> timestamp of delivered / read seen before sent), least recent first
+        self._messages: "OrderedDict[str, Tuple[Optional[int], Set[str], Dict[str, int]]]" = OrderedDict()
+        # Waiting for the next flush
+        self._counts: Dict[str, int] = {}
+        self._latencies: List[Tuple[str, float]] = []
+        # Rolling window for percentiles
+        self._recent: Dict[str, Deque[float]] = {stage: deque(maxlen=window) for stage in STAGES}
+        self._totals: Dict[str, int] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        self._failure_listeners: List[FailureListener] = []
+        self.unmatched = 0
+        self.duplicates = 0
+        self.flushes = 0
+        self.redis_errors = 0
+
+    def add_failure_listener(self, listener: FailureListener):
+        """Call `listener` for every failed message (see FailureListener)"""
+        self._failure_listeners.append(listener)
+
+    def record(self, message_id: str, status: str, timestamp: int, errors: Optional[List[Dict[str, Any]]] = None):
+        """
+        Record one status callback (no I/O)
+
+        Args:
+            message_id: Outbound message id (wamid)
+            status: sent, delivered, read or failed
+            timestamp: Unix timestamp from the callback
+            errors: The callback's error objects (failed statuses)
+        """
+        sent, seen, early = self._messages.pop(message_id, (None, set(), {}))
+        if status == "sent" and sent is None:
+            sent = timestamp
+        self._messages[message_id] = (sent, seen, early)
+        while len(self._messages) > self.max_tracked:
+            _, (_, _, dropped_early) = self._messages.popitem(last=False)
+            self.unmatched += len(dropped_early)
+
+        if status in seen:
+            self.duplicates += 1
+            return
+        seen.add(status)
+        self._counts[status] = self._counts.get(status, 0) + 1
+
+        if status == "failed":
+            for listener in self._failure_listeners:
+                try:
+                    listener(message_id, errors or [])
+                except Exception as e:
+                    logger.warning(f" Failure listener error for {message_id}: {e}")
+
+        if status == "sent":
+            # Delivered / read callbacks that overtook this one
+            for stage in STAGES:
+                if stage in early:
+                    self._observe(stage, early.pop(stage) - sent)
+            return
+        if status not in STAGES:
+            return
+        if sent is None:
+            early[status] = timestamp
+            return
+        self._observe(status, timestamp - sent)
+
+    def _observe(self, stage: str, seconds: int):
+        latency = float(max(0, seconds))
+        self._latencies.append((stage, latency))
+        self._recent[stage].append(latency)
+
+    async def start(self):
+        """Start flushing in the background"""
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_periodically())
+
+    async def close(self):
+        """Stop the background flush and flush what is left (call at shutdown)"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning(f" Status flush failed: {e}")
+
+    async def flush(self):
+        """Push counts and latencies gathered since the last flush"""
+        counts, self._counts = self._counts, {}
+        latencies, self._latencies = self._latencies, []
+        if not counts and not latencies:
+            return
+        self.flushes += 1
+
+        for status, count in counts.items():
+            MESSAGE_STATUSES.labels(status).inc(count)
+            self._totals[status] = self._totals.get(status, 0) + count
+        for stage, latency in latencies:
+            DELIVERY_SECONDS.labels(stage).observe(latency)
+
+        if self.use_redis:
+            await self._flush_redis(counts, latencies)
+
+    async def _flush_redis(self, counts: Dict[str, int], latencies: List[Tuple[str, float]]):
+        redis = get_redis()
+        if redis is None:
+            return
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for status, count in counts.items():
+                    pipe.hincrby(f"{self.redis_key}:counts", status, count)
+                for stage in STAGES:
+                    values = [latency for name, latency in latencies if name == stage]
+                    if values:
+                        key = f"{self.redis_key}:{stage}_seconds"
+                        pipe.rpush(key, *values)
+                        pipe.ltrim(key, -self._recent[stage].maxlen, -1)
+                await pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            logger.warning(f" Redis status flush failed: {e}")
+
+    def percentile(self, stage: str, q: float) -> float:
+        """Latency percentile over the recent window (0 when empty), for gauges"""
+        values = sorted(self._recent[stage])
+        if not values:
+            return 0.0
+        return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "statuses": dict(self._totals),
+            "tracked_messages": len(self._messages),
+            "awaiting_sent": sum(1 for _, _, early in self._messages.values() if early),
+            "unmatched": self.unmatched,
+            "duplicates": self.duplicates,
+            "flushes": self.flushes,
+            "redis_errors": self.redis_errors,
+            "latency_seconds": {stage: _percentiles(list(self._recent[stage])) for stage in STAGES}
+        }
+
+
+# Global status aggregator (flushing started in the app startup hook)
+status_aggregator = DeliveryStatusAggregator(
+    max_tracked=settings.STATUS_MAX_TRACKED,
+    flush_interval=settings.STATUS_FLUSH_INTERVAL,
+    window=settings.STATUS_LATENCY_WINDOW,
+    use_redis=settings.STATUS_BACKEND == "redis"
+)
@@ -0,0 +1,209 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def make_cache_key(**parts: Any) -> str:
+    """
+    Content address for a rendered voice note
+
+    Args:
+        parts: Everything that affects the audio (text, voice, model, settings, encoder profile)
+
+    Returns:
+        sha256 hex digest
+    """
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TTSCache:
+    """
+    Two-tier cache of finished OGG/Opus voice notes
+
+    A memory LRU capped at `memory_max_bytes` sits in front of an on-disk tier
+    in `disk_dir` capped at `disk_max_bytes` (least recently used files are
+    deleted first). Pass an empty `disk_dir` to use memory only.
+
+    Disk writes happen in the background, tracked by an in-memory LRU index
+    of the files under a lock, since they run on worker threads. The
+    directory is created and indexed (from the files' mtimes) in start(), or
+    on first disk access for callers that skip it. Only texts up to `max_text_chars` are stored
+    on their first render; longer ones once they are rendered a second time.
+    """
+
+    def __init__(self, memory_max_bytes: int, disk_dir: str, disk_max_bytes: int, max_text_chars: int = 200):
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.max_text_chars = max_text_chars
+
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+
+        # key -> file size, least recently used first
+        self._disk_index: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        self._disk_lock = threading.Lock()
+        self._disk_opened = False
+        self._writes: Set[asyncio.Task] = set()
+
+        # Keys of long texts rendered once (admitted when seen again)
+        self._seen: "OrderedDict[str, None]" = OrderedDict()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.skipped = 0
+
+    async def start(self):
+        """Create and index the disk tier off the event loop (call from the app startup hook)"""
+        if self.disk_dir:
+            await asyncio.to_thread(self._open_disk)
+
+    def _open_disk(self):
+        """Create `disk_dir` and index the files already in it, once (worker thread)"""
+        with self._disk_lock:
+            if self._disk_opened:
+                return
+            self._disk_opened = True
+            try:
+                os.makedirs(self.disk_dir, exist_ok=True)
+                entries = sorted(
+                    (entry for entry in os.scandir(self.disk_dir) if entry.name.endswith(".ogg")),
+                    key=lambda entry: entry.stat().st_mtime
+                )
+                for entry in entries:
+                    size = entry.stat().st_size
+                    self._disk_index[entry.name[:-len(".ogg")]] = size
+                    self._disk_bytes += size
+            except OSError as e:
+                logger.warning(f" TTS cache directory {self.disk_dir} unavailable: {e}")
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.ogg")
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Return cached audio for `key`, or None"""
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.memory_hits += 1
+            return data
+
+        if self.disk_dir:
+            data = await asyncio.to_thread(self._read_disk, key)
+            if data is not None:
+                self.disk_hits += 1
+                self._remember(key, data)
+                return data
+
+        self.misses += 1
+        return None
+
+    def admit(self, key: str, text_length: int) -> bool:
+        """Whether a freshly rendered text is worth caching (short, or rendered before)"""
+        if text_length <= self.max_text_chars or key in self._seen:
+            self._seen.pop(key, None)
+            return True
+        self._seen[key] = None
+        while len(self._seen) > 4096:
+            self._seen.popitem(last=False)
+        self.skipped += 1
+        return False
+
+    def put_nowait(self, key: str, data: bytes):
+        """Store audio for `key` in memory now and on disk in the background"""
+        self._remember(key, data)
+        if self.disk_dir:
+            task = asyncio.create_task(asyncio.to_thread(self._write_disk, key, data))
+            self._writes.add(task)
+            task.add_done_callback(self._writes.discard)
+
+    def _remember(self, key: str, data: bytes):
+        if len(data) > self.memory_max_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous)
+        self._memory[key] = data
+        self._memory_bytes += len(data)
+        while self._memory_bytes > self.memory_max_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        self._open_disk()
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)  # mtime orders the index after a restart
+            with self._disk_lock:
+                if key in self._disk_index:
+                    self._disk_index.move_to_end(key)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f" TTS cache read failed for {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, data: bytes):
+        self._open_disk()
+        path = self._path(key)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f" TTS cache write failed for {key}: {e}")
+            return
+
+        evicted: List[str] = []
+        with self._disk_lock:
+            self._disk_bytes += len(data) - self._disk_index.pop(key, 0)
+            self._disk_index[key] = len(data)
+            while self._disk_bytes > self.disk_max_bytes and len(self._disk_index) > 1:
+                old_key, size = self._disk_index.popitem(last=False)
+                self._disk_bytes -= size
+                evicted.append(old_key)
+
+        for old_key in evicted:
+            try:
+                os.remove(self._path(old_key))
+            except OSError:
+                continue
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        hits = self.memory_hits + self.disk_hits
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "skipped": self.skipped,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "miss_rate": round(self.misses / lookups, 4) if lookups else 0.0
+        }
+
+
+# Global TTS cache instance (None when disabled)
+tts_cache = TTSCache(
+    memory_max_bytes=settings.TTS_CACHE_MEMORY_MAX_BYTES,
+    disk_dir=settings.TTS_CACHE_DIR,
+    disk_max_bytes=settings.TTS_CACHE_DISK_MAX_BYTES,
+    max_text_chars=settings.TTS_CACHE_MAX_TEXT_CHARS
+) if settings.TTS_CACHE_ENABLED else None
@@ -1,15 +1,62 @@
+import asyncio
 import logging
-import subprocess
 import io
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional, Union
 from elevenlabs.client import ElevenLabs
 from openai import AsyncOpenAI
 from app.config import settings
+from app.tts_cache import tts_cache, make_cache_key
+from app.audio_codec import audio_codec, encode_load, ffmpeg_encode_command
+from app.metrics import stage
+from app.reply_guard import reply_guard
 
 logger = logging.getLogger(__name__)
 
 # Initialize clients
-elevenlabs_client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY)
-openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+elevenlabs_client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY, base_url=settings.ELEVENLABS_BASE_URL)
+openai_client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, base_url=settings.OPENAI_BASE_URL)
+
+# ElevenLabs voice settings (human-like delivery)
+VOICE_SETTINGS = {
+    "stability": 0.3,           # LOW = more tonal variation, less monotone
+    "similarity_boost": 0.8,    # Keep Saman's voice strong
+    "style": 0.7,               # HIGH = more emotion and pitch variation
+    "use_speaker_boost": True   # Better voice clarity
+}
+
+# Speed up 1.25x (Dutch speaking pace)
+TTS_TEMPO = 1.25
+
+
+def tts_encode_command(output_format: Optional[str] = None, profile: str = "quality") -> List[str]:
+    """
+    ffmpeg command turning ElevenLabs output into a WhatsApp voice note
+    
+    MP3 has to be decoded first; raw PCM (pcm_16000, pcm_24000, ...) goes straight
+    into tempo + Opus encoding in one step, with no lossy decode/re-encode.
+    The PyAV backend applies the same filters and encoder options in-process.
+    
+    Args:
+        output_format: ElevenLabs output format (default: TTS_OUTPUT_FORMAT)
+        profile: Opus encoding profile (quality, balanced, fast)
+        
+    Returns:
+        ffmpeg argument list reading stdin and writing OGG to stdout
+    """
+    return ffmpeg_encode_command(output_format or settings.TTS_OUTPUT_FORMAT, TTS_TEMPO, profile)
+
+
+# The ElevenLabs client is blocking, so it runs on a bounded thread pool.
+# The semaphore caps how many renders run at once (synthesis + encoding): a
+# whole reply, or one segment of a streamed reply. Every render holds at most
+# one pool thread, so a slot always finds a free thread.
+_tts_executor = ThreadPoolExecutor(
+    max_workers=settings.TTS_MAX_CONCURRENCY,
+    thread_name_prefix="tts"
+)
+_tts_semaphore = asyncio.Semaphore(settings.TTS_MAX_CONCURRENCY)
 
 
 def add_natural_pauses(text: str) -> str:
@@ -53,10 +100,41 @@ def add_natural_pauses(text: str) -> str:
     return text
 
 
+def _elevenlabs_chunks(text: str) -> Iterator[bytes]:
+    """Blocking iterator over ElevenLabs audio chunks as they are downloaded"""
+    return elevenlabs_client.text_to_speech.convert(
+        voice_id=settings.ELEVENLABS_VOICE_ID,
+        text=text,
+        model_id=settings.ELEVENLABS_MODEL,
+        voice_settings=VOICE_SETTINGS,
+        output_format=settings.TTS_OUTPUT_FORMAT
+    )
+
+
+def synthesize_speech_sync(text: str) -> bytes:
+    """
+    Call ElevenLabs TTS with the custom cloned voice (blocking)
+    
+    Args:
+        text: Text to speak (natural pauses already added)
+        
+    Returns:
+        Audio bytes in TTS_OUTPUT_FORMAT (MP3 by default, or raw PCM)
+    """
+    audio_generator = _elevenlabs_chunks(text)
+    
+    # Collect all audio chunks
+    audio_bytes = b"".join(audio_generator)
+    logger.info(f" ElevenLabs TTS response: {len(audio_bytes)} bytes ({settings.TTS_OUTPUT_FORMAT})")
+    return audio_bytes
+
+
 def convert_text_to_speech_sync(text: str) -> bytes:
     """
     Convert text to speech using ElevenLabs API with custom cloned voice (sync)
     
+    Blocks the calling thread - use convert_text_to_speech_async from async code.
+    
     Args:
         text: Text to convert to speech
         
@@ -70,24 +148,10 @@ def convert_text_to_speech_sync(text: str) -> bytes:
         text_with_pauses = add_natural_pauses(text)
         
         # Step 1: Call ElevenLabs TTS API with human-like settings
-        audio_generator = elevenlabs_client.text_to_speech.convert(
-            voice_id=settings.ELEVENLABS_VOICE_ID,
-            text=text_with_pauses,
-            model_id=settings.ELEVENLABS_MODEL,
-            voice_settings={
-                "stability": 0.3,           # LOW = more tonal variation, less monotone
-                "similarity_boost": 0.8,    # Keep Saman's voice strong
-                "style": 0.7,               # HIGH = more emotion and pitch variation
-                "use_speaker_boost": True   # Better voice clarity
-            }
-        )
-        
-        # Collect all audio chunks
-        mp3_bytes = b"".join(audio_generator)
-        logger.info(f" ElevenLabs TTS response: {len(mp3_bytes)} bytes (MP3)")
-        
-        # Step 2: Convert MP3 to OGG for WhatsApp
-        ogg_bytes = convert_mp3_to_ogg(mp3_bytes)
+        audio_bytes = synthesize_speech_sync(text_with_pauses)
+        
+        # Step 2: Convert to OGG for WhatsApp
+        ogg_bytes = convert_tts_audio_to_ogg(audio_bytes)
         logger.info(f" Converted to OGG: {len(ogg_bytes)} bytes")
         
         return ogg_bytes
@@ -97,12 +161,136 @@ def convert_text_to_speech_sync(text: str) -> bytes:
         raise
 
 
+class SpeechStream:
+    """
+    ElevenLabs audio for one text, delivered chunk by chunk while it downloads
+    
+    The blocking SDK iterator runs on the TTS thread pool and hands chunks to
+    the event loop through a queue. With `max_buffered_chunks` set, the download
+    waits whenever that many chunks are pending, so memory stays bounded.
+    """
+    
+    def __init__(self, text: str, max_buffered_chunks: int = 0):
+        self._loop = asyncio.get_running_loop()
+        self._queue: "asyncio.Queue[Union[bytes, Exception, None]]" = asyncio.Queue(max_buffered_chunks)
+        self._stopped = threading.Event()
+        self._future = self._loop.run_in_executor(_tts_executor, self._pump, text)
+        self.bytes_received = 0
+    
+    def _put(self, item: Union[bytes, Exception, None]):
+        asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop).result()
+    
+    def _pump(self, text: str):
+        try:
+            for chunk in _elevenlabs_chunks(text):
+                if self._stopped.is_set():
+                    return
+                if chunk:
+                    self._put(chunk)
+        except Exception as e:
+            self._put(e)
+            return
+        self._put(None)
+    
+    async def chunks(self) -> AsyncIterator[bytes]:
+        """Yield audio chunks in order as they arrive"""
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            self.bytes_received += len(item)
+            yield item
+        await self._future
+    
+    def close(self):
+        """Stop the download early (frees the pool thread)"""
+        self._stopped.set()
+        while not self._queue.empty():
+            self._queue.get_nowait()
+
+
+async def convert_text_to_speech_async(text: str, profile: Optional[str] = None) -> bytes:
+    """
+    Convert text to speech without blocking the event loop
+    
+    ElevenLabs runs on the TTS thread pool and encoding runs on the audio
+    codec backend (ffmpeg subprocess or in-process PyAV). At most
+    TTS_MAX_CONCURRENCY replies are rendered at once. With TTS_STREAM_ENCODE,
+    audio chunks are fed to the encoder as they arrive, so encoding overlaps
+    the download.
+    
+    Args:
+        text: Text to convert to speech
+        profile: Opus encoding profile (default: chosen by current encode load)
+        
+    Returns:
+        Audio bytes in OGG format (WhatsApp compatible)
+    """
+    async with _tts_semaphore:
+        # Waiting for a render slot can take a while, re-check before paying for TTS
+        reply_guard.check("elevenlabs")
+        try:
+            logger.info(f" Converting text to speech with ElevenLabs: {text[:50]}...")
+            
+            text_with_pauses = add_natural_pauses(text)
+            
+            stage_name = "convert_pcm_to_ogg" if settings.TTS_OUTPUT_FORMAT.startswith("pcm_") else "convert_mp3_to_ogg"
+            
+            if settings.TTS_STREAM_ENCODE:
+                ogg_bytes = await _stream_speech_to_ogg(text_with_pauses, stage_name, profile)
+                logger.info(f" Converted to OGG: {len(ogg_bytes)} bytes")
+                return ogg_bytes
+            
+            loop = asyncio.get_running_loop()
+            async with stage("elevenlabs", upstream="elevenlabs"):
+                audio_bytes = await loop.run_in_executor(
+                    _tts_executor, synthesize_speech_sync, text_with_pauses
+                )
+            
+            async with stage(stage_name):
+                ogg_bytes = await convert_tts_audio_to_ogg_async(audio_bytes, profile)
+            logger.info(f" Converted to OGG: {len(ogg_bytes)} bytes")
+            
+            return ogg_bytes
+            
+        except Exception as e:
+            logger.error(f" Error converting text to speech with ElevenLabs: {e}")
+            raise
+
+
+async def _stream_speech_to_ogg(text: str, encode_stage: str, profile: Optional[str] = None) -> bytes:
+    """
+    Feed ElevenLabs chunks into a running encoder as they download
+    
+    Only a few chunks are ever buffered. The encode stage records just the
+    tail left after the last chunk arrives.
+    """
+    encoder = audio_codec.open_encoder(settings.TTS_OUTPUT_FORMAT, TTS_TEMPO, profile)
+    await encoder.start()
+    speech = SpeechStream(text, max_buffered_chunks=settings.TTS_STREAM_BUFFER_CHUNKS)
+    try:
+        async with stage("elevenlabs", upstream="elevenlabs"):
+            async for chunk in speech.chunks():
+                await encoder.write(chunk)
+        logger.info(f" ElevenLabs TTS streamed: {speech.bytes_received} bytes ({settings.TTS_OUTPUT_FORMAT})")
+        
+        async with stage(encode_stage):
+            return await encoder.finish()
+    except BaseException:
+        speech.close()
+        await encoder.abort()
+        raise
+
+
 def convert_mp3_to_ogg(mp3_bytes: bytes) -> bytes:
     """
     Convert MP3 audio to OGG/Opus format for WhatsApp
     
-    Uses ffmpeg with stdin/stdout piping (similar to realtime_voice.py)
-    Optimized for WhatsApp voice message waveform display
+    Uses the audio codec backend (ffmpeg CLI or in-process PyAV)
+    Optimized for WhatsApp voice message waveform display:
+    16kHz, Opus 16k VBR, 60ms frames, voip application
     
     Args:
         mp3_bytes: MP3 audio bytes from TTS API
@@ -111,57 +299,71 @@ def convert_mp3_to_ogg(mp3_bytes: bytes) -> bytes:
         OGG audio bytes (16kHz, Opus codec)
     """
     try:
-        # Use ffmpeg with stdin/stdout pipes
-        # -i pipe:0: read MP3 from stdin
-        # -ar 16000: resample to 16kHz (WhatsApp voice message standard)
-        # -c:a libopus: use Opus codec
-        # -b:a 16k: bitrate optimized for 16kHz voice
-        # -vbr on: variable bitrate for better quality
-        # -compression_level 10: maximum compression quality
-        # -frame_duration 60: 60ms frames (WhatsApp standard)
-        # -application voip: optimize for voice
-        # -f ogg: output format
-        # pipe:1: write to stdout
-        result = subprocess.run([
-            'ffmpeg',
-            '-i', 'pipe:0',  # Read MP3 from stdin
-            '-af', 'atempo=1.25',  # Speed up 1.25x (Dutch speaking pace)
-            '-ar', '16000',  # WhatsApp voice standard: 16kHz
-            '-c:a', 'libopus',
-            '-b:a', '16k',
-            '-vbr', 'on',
-            '-compression_level', '10',
-            '-frame_duration', '60',
-            '-application', 'voip',
-            '-f', 'ogg',
-            '-loglevel', 'error',  # Only show errors
-            'pipe:1'  # Write to stdout
-        ], input=mp3_bytes, capture_output=True, check=True)
-        
-        ogg_data = result.stdout
-        logger.info(f" ffmpeg MP3→OGG conversion successful: {len(ogg_data)} bytes")
+        ogg_data = audio_codec.encode_sync(mp3_bytes, "mp3_44100_128", TTS_TEMPO)
+        logger.info(f" {audio_codec.name} MP3→OGG conversion successful: {len(ogg_data)} bytes")
         return ogg_data
         
-    except subprocess.CalledProcessError as e:
-        logger.error(f" ffmpeg conversion failed: {e.stderr.decode()}")
-        raise Exception(f"Audio conversion failed: {e.stderr.decode()}")
     except Exception as e:
         logger.error(f" Error converting MP3 to OGG: {e}")
         raise
 
 
-async def convert_text_to_speech_with_cleanup(text: str, max_length: int = 4000) -> bytes:
+def convert_tts_audio_to_ogg(audio_bytes: bytes) -> bytes:
     """
-    Convert text to speech with text cleanup and length limits
+    Convert ElevenLabs output (TTS_OUTPUT_FORMAT) to OGG/Opus for WhatsApp
     
-    Removes emojis and truncates long text to fit TTS API limits
+    Args:
+        audio_bytes: Audio bytes from synthesize_speech_sync
+        
+    Returns:
+        OGG audio bytes (16kHz, Opus codec)
+    """
+    ogg_data = audio_codec.encode_sync(audio_bytes, settings.TTS_OUTPUT_FORMAT, TTS_TEMPO)
+    logger.info(f" {audio_codec.name} conversion successful: {len(ogg_data)} bytes")
+    return ogg_data
+
+
+async def convert_tts_audio_to_ogg_async(audio_bytes: bytes, profile: Optional[str] = None) -> bytes:
+    """
+    Convert ElevenLabs output (TTS_OUTPUT_FORMAT) to OGG/Opus for WhatsApp (non-blocking)
     
     Args:
-        text: Text to convert
+        audio_bytes: Audio bytes from synthesize_speech_sync
+        profile: Opus encoding profile (default: chosen by current encode load)
+        
+    Returns:
+        OGG audio bytes (16kHz, Opus codec)
+    """
+    return await audio_codec.encode(audio_bytes, settings.TTS_OUTPUT_FORMAT, TTS_TEMPO, profile)
+
+
+async def convert_mp3_to_ogg_async(mp3_bytes: bytes) -> bytes:
+    """
+    Convert MP3 audio to OGG/Opus format for WhatsApp (non-blocking)
+    
+    Same encoding as convert_mp3_to_ogg, without blocking the event loop
+    
+    Args:
+        mp3_bytes: MP3 audio bytes from TTS API
+        
+    Returns:
+        OGG audio bytes (16kHz, Opus codec)
+    """
+    ogg_data = await audio_codec.encode(mp3_bytes, "mp3_44100_128", TTS_TEMPO)
+    logger.info(f" {audio_codec.name} MP3→OGG conversion successful: {len(ogg_data)} bytes")
+    return ogg_data
+
+
+def clean_tts_text(text: str, max_length: int = 4000) -> str:
+    """
+    Remove emojis and truncate text to fit TTS API limits
+    
+    Args:
+        text: Text to clean
         max_length: Maximum character length (TTS API limit is 4096)
         
     Returns:
-        Audio bytes in OGG format
+        Cleaned text
     """
     # Remove or replace emojis for better pronunciation
     import re
@@ -172,8 +374,159 @@ async def convert_text_to_speech_with_cleanup(text: str, max_length: int = 4000)
         cleaned_text = cleaned_text[:max_length] + "..."
         logger.warning(f" Text truncated to {max_length} characters")
     
-    # Call sync function (ElevenLabs is synchronous)
-    return convert_text_to_speech_sync(cleaned_text)
+    return cleaned_text
+
+
+async def convert_text_to_speech_with_cleanup(text: str, max_length: int = 4000, always_cache: bool = False) -> bytes:
+    """
+    Convert text to speech with text cleanup and length limits
+    
+    Removes emojis and truncates long text to fit TTS API limits.
+    Finished voice notes are served from the TTS cache when possible. Only
+    audio encoded with the preferred profile is cached, so notes degraded
+    during a load spike are not replayed later, and only short or repeated
+    texts (see TTSCache.admit); the cache write doesn't delay the reply.
+    
+    Args:
+        text: Text to convert
+        max_length: Maximum character length (TTS API limit is 4096)
+        always_cache: Cache the audio whatever its length (fixed phrases)
+        
+    Returns:
+        Audio bytes in OGG format
+    """
+    cleaned_text = clean_tts_text(text, max_length)
+    if tts_cache is None:
+        return await convert_text_to_speech_async(cleaned_text)
+    
+    key = tts_cache_key(cleaned_text)
+    cached = await tts_cache.get(key)
+    if cached is not None:
+        logger.info(f" TTS cache hit: {cleaned_text[:50]}...")
+        return cached
+    
+    profile = encode_load.select_profile()
+    ogg_bytes = await convert_text_to_speech_async(cleaned_text, profile)
+    if profile == encode_load.preferred_profile and (always_cache or tts_cache.admit(key, len(cleaned_text))):
+        tts_cache.put_nowait(key, ogg_bytes)
+    return ogg_bytes
+
+
+def tts_cache_key(cleaned_text: str) -> str:
+    """Cache key covering everything that changes the rendered audio"""
+    return make_cache_key(
+        text=cleaned_text,
+        voice_id=settings.ELEVENLABS_VOICE_ID,
+        model=settings.ELEVENLABS_MODEL,
+        voice_settings=VOICE_SETTINGS,
+        ffmpeg_profile=" ".join(tts_encode_command(profile=encode_load.preferred_profile)),
+        codec_backend=audio_codec.name
+    )
+
+
+async def prewarm_tts_cache(phrases: List[str]):
+    """
+    Render fixed phrases into the TTS cache (run at startup)
+    
+    Args:
+        phrases: Texts to render, e.g. settings.tts_prewarm_phrase_list
+    """
+    if tts_cache is None:
+        return
+    for phrase in phrases:
+        try:
+            await convert_text_to_speech_with_cleanup(phrase, always_cache=True)
+        except Exception as e:
+            logger.warning(f" Failed to pre-warm TTS cache for '{phrase}': {e}")
+    logger.info(f" TTS cache pre-warmed with {len(phrases)} phrases")
+
+
+async def convert_sentences_to_speech(sentences: AsyncIterator[str]) -> bytes:
+    """
+    Convert a stream of sentences into one voice note, overlapping every stage
+    
+    Each sentence is sent to ElevenLabs as soon as it arrives (up to
+    TTS_STREAM_MAX_SEGMENTS segments synthesize concurrently), and segment
+    audio is fed in order
+    into a single running encoder - the current segment chunk by chunk
+    as it downloads, later ones once they are reached (MP3 frames and raw PCM
+    both concatenate cleanly). LLM streaming, synthesis and encoding therefore
+    run at the same time, and the result is one Ogg stream.
+    
+    Each segment takes a TTS slot (and with it a pool thread) only from the
+    start of its synthesis until it is encoded, so a reply waiting on the
+    LLM holds no slot and other replies render in between its sentences.
+    The sentence iterator is closed when the voice note is done or dropped.
+    
+    Args:
+        sentences: Async iterator of reply sentences (e.g. stream_ai_response)
+        
+    Returns:
+        Audio bytes in OGG format (WhatsApp compatible)
+    """
+    segments: "asyncio.Queue[Optional[SpeechStream]]" = asyncio.Queue()
+    # Segments started but not yet encoded; released as the encoder finishes each one
+    in_flight = asyncio.Semaphore(max(1, settings.TTS_STREAM_MAX_SEGMENTS))
+    started: List[SpeechStream] = []
+    # TTS slots taken by segments that are not encoded yet
+    held = 0
+    
+    async def produce():
+        nonlocal held
+        # Start synthesis for each sentence as soon as there is room, keep the streams in order
+        try:
+            async for sentence in sentences:
+                cleaned = clean_tts_text(sentence)
+                if not cleaned.strip():
+                    continue
+                await in_flight.acquire()
+                await _tts_semaphore.acquire()
+                held += 1
+                reply_guard.check("elevenlabs")
+                logger.info(f" Synthesizing segment: {cleaned[:50]}...")
+                speech = SpeechStream(add_natural_pauses(cleaned), max_buffered_chunks=settings.TTS_STREAM_BUFFER_CHUNKS)
+                started.append(speech)
+                await segments.put(speech)
+        finally:
+            await segments.put(None)
+            aclose = getattr(sentences, "aclose", None)
+            if aclose is not None:
+                await aclose()
+    
+    async with stage("tts_stream", upstream="elevenlabs"):
+        encoder = audio_codec.open_encoder(settings.TTS_OUTPUT_FORMAT, TTS_TEMPO)
+        await encoder.start()
+        producer = asyncio.create_task(produce())
+        try:
+            segment_count = 0
+            while True:
+                segment = await segments.get()
+                if segment is None:
+                    break
+                async for chunk in segment.chunks():
+                    await encoder.write(chunk)
+                held -= 1
+                _tts_semaphore.release()
+                in_flight.release()
+                segment_count += 1
+            await producer
+            
+            if segment_count == 0:
+                raise Exception("No text to convert to speech")
+            
+            ogg_bytes = await encoder.finish()
+            logger.info(f" Streamed {segment_count} segments to OGG: {len(ogg_bytes)} bytes")
+            return ogg_bytes
+        
+        except BaseException:
+            producer.cancel()
+            for speech in started:
+                speech.close()
+            for _ in range(held):
+                _tts_semaphore.release()
+            held = 0
+            await encoder.abort()
+            raise
 
 
 async def transcribe_audio(audio_bytes: bytes) -> str:
@@ -194,10 +547,11 @@ async def transcribe_audio(audio_bytes: bytes) -> str:
         audio_file.name = "voice.ogg"
         
         # Transcribe using Whisper
-        transcription = await openai_client.audio.transcriptions.create(
-            model="whisper-1",
-            file=audio_file
-        )
+        async with stage("transcribe_audio", upstream="openai"):
+            transcription = await openai_client.audio.transcriptions.create(
+                model="whisper-1",
+                file=audio_file
+            )
         
         transcribed_text = transcription.text
         logger.info(f" Transcription: {transcribed_text[:100]}...")
@@ -0,0 +1,147 @@
+import logging
+import random
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from prometheus_client import Counter, Histogram
+from app.config import settings
+from app.metrics import LATENCY_BUCKETS, tag_trace
+
+logger = logging.getLogger(__name__)
+
+# Voice note → voice reply pipelines
+CASCADE = "cascade"  # Whisper → chat model → ElevenLabs
+REALTIME = "realtime"  # OpenAI Realtime API, audio in and out
+PIPELINES = (CASCADE, REALTIME)
+
+VOICE_ROUTES = Counter(
+    "voicebot_voice_pipeline_routes_total",
+    "Voice notes routed to each pipeline, by why it was chosen",
+    ["pipeline", "reason"]
+)
+VOICE_PIPELINE_SECONDS = Histogram(
+    "voicebot_voice_pipeline_seconds",
+    "Time from downloaded voice note to rendered voice reply, per pipeline",
+    ["pipeline", "outcome"],
+    buckets=LATENCY_BUCKETS
+)
+
+
+class VoicePipelineRouter:
+    """
+    Chooses the pipeline that answers each voice note
+
+    `mode` is cascade or realtime (always that pipeline) or auto. In auto mode
+    the last `window` results of each pipeline are kept; pipelines whose error
+    rate is above `max_error_rate` are unhealthy, and of the healthy ones the
+    one with the lower median latency wins. A pipeline with fewer than
+    `min_samples` voice notes routed to it is tried first, and `explore_rate` of voice notes go
+    to the other pipeline so its numbers stay current (and an unhealthy one
+    can recover).
+    """
+
+    def __init__(self, mode: str, window: int, min_samples: int,
+                 max_error_rate: float, explore_rate: float):
+        if mode not in PIPELINES and mode != "auto":
+            logger.warning(f" Unknown VOICE_PIPELINE {mode!r}, using {CASCADE}")
+            mode = CASCADE
+        self.mode = mode
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.explore_rate = explore_rate
+        # (seconds, ok) per pipeline, newest last
+        self._results: Dict[str, Deque[Tuple[float, bool]]] = {
+            pipeline: deque(maxlen=window) for pipeline in PIPELINES
+        }
+        self._routes: Dict[str, int] = {pipeline: 0 for pipeline in PIPELINES}
+
+    def choose(self) -> str:
+        """
+        Pick the pipeline for the next voice note (counted in metrics and the trace)
+
+        Returns:
+            "cascade" or "realtime"
+        """
+        pipeline, reason = self._pick()
+        self._routes[pipeline] += 1
+        VOICE_ROUTES.labels(pipeline, reason).inc()
+        tag_trace("voice_pipeline", pipeline)
+        logger.debug(f" Voice note routed to {pipeline} ({reason})")
+        return pipeline
+
+    def _pick(self) -> Tuple[str, str]:
+        if self.mode != "auto":
+            return self.mode, "configured"
+
+        # Learn both pipelines before comparing them (counts routes, not results,
+        # so a burst of concurrent voice notes doesn't all land on one pipeline)
+        for pipeline in PIPELINES:
+            if self._routes[pipeline] < self.min_samples:
+                return pipeline, "warmup"
+
+        healthy = [p for p in PIPELINES if self.error_rate(p) <= self.max_error_rate]
+        if healthy:
+            best = min(healthy, key=lambda p: self.median_latency(p))
+            reason = "fastest"
+        else:
+            best = min(PIPELINES, key=self.error_rate)
+            reason = "least_errors"
+
+        if random.random() < self.explore_rate:
+            return next(p for p in PIPELINES if p != best), "explore"
+        return best, reason
+
+    def record(self, pipeline: str, seconds: float, ok: bool):
+        """
+        Record the outcome of one voice note
+
+        Args:
+            pipeline: Pipeline that handled it
+            seconds: Time from downloaded audio to rendered reply
+            ok: False if the pipeline failed
+        """
+        self._results[pipeline].append((seconds, ok))
+        VOICE_PIPELINE_SECONDS.labels(pipeline, "ok" if ok else "error").observe(seconds)
+
+    def fallback(self, failed: str) -> Optional[str]:
+        """Pipeline to retry a voice note on after `failed` errored (auto mode only)"""
+        if self.mode != "auto":
+            return None
+        pipeline = next(p for p in PIPELINES if p != failed)
+        self._routes[pipeline] += 1
+        VOICE_ROUTES.labels(pipeline, "fallback").inc()
+        tag_trace("voice_pipeline", f"{failed}>{pipeline}")
+        return pipeline
+
+    def error_rate(self, pipeline: str) -> float:
+        results = self._results[pipeline]
+        if not results:
+            return 0.0
+        return sum(1 for _, ok in results if not ok) / len(results)
+
+    def median_latency(self, pipeline: str) -> float:
+        latencies: List[float] = sorted(seconds for seconds, ok in self._results[pipeline] if ok)
+        if not latencies:
+            return float("inf")
+        return latencies[len(latencies) // 2]
+
+    def stats(self) -> Dict[str, Any]:
+        pipelines = {}
+        for pipeline in PIPELINES:
+            latency = self.median_latency(pipeline)
+            pipelines[pipeline] = {
+                "routed": self._routes[pipeline],
+                "samples": len(self._results[pipeline]),
+                "error_rate": round(self.error_rate(pipeline), 4),
+                "median_seconds": round(latency, 4) if latency != float("inf") else None
+            }
+        return {"mode": self.mode, "pipelines": pipelines}
+
+
+# Global voice pipeline router
+voice_router = VoicePipelineRouter(
+    mode=settings.VOICE_PIPELINE,
+    window=settings.VOICE_ROUTER_WINDOW,
+    min_samples=settings.VOICE_ROUTER_MIN_SAMPLES,
+    max_error_rate=settings.VOICE_ROUTER_MAX_ERROR_RATE,
+    explore_rate=settings.VOICE_ROUTER_EXPLORE_RATE
+)
@@ -0,0 +1,236 @@
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+from prometheus_client import Counter
+from app.config import settings
+from app.webhook_ingest import InboundMessage, InvalidWebhook
+from app.status_aggregator import DeliveryStatusAggregator, status_aggregator
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_FILTERED = Counter(
+    "voicebot_webhook_filtered_total",
+    "Webhook payloads dropped before dispatch (or rejected), one reason per payload",
+    ["reason"]
+)
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def _dict_items(value: Any, name: str) -> List[Dict[str, Any]]:
+    """`value` as a list of objects (missing = empty)"""
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(isinstance(item, dict) for item in value):
+        raise InvalidWebhook(f"Webhook {name} is not a list of objects")
+    return value
+
+
+def normalize_phone(number: str) -> str:
+    """Digits only, international format without + or 00 ("+91 82260-53534" → "918226053534")"""
+    digits = _NON_DIGITS.sub("", number or "")
+    return digits[2:] if digits.startswith("00") else digits
+
+
+def parse_phone_numbers(raw: str) -> FrozenSet[str]:
+    """Normalized numbers from a comma / newline separated list (# starts a comment)"""
+    numbers = set()
+    for line in raw.splitlines():
+        for part in line.split("#", 1)[0].split(","):
+            number = normalize_phone(part)
+            if number:
+                numbers.add(number)
+    return frozenset(numbers)
+
+
+class AllowList:
+    """
+    Set of phone numbers allowed to talk to the bot (empty = everyone)
+
+    Built from ALLOWED_PHONE_NUMBERS plus ALLOWED_PHONE_NUMBERS_FILE, if set.
+    The file's mtime is checked at most every `check_interval` seconds and the
+    set is rebuilt when it changes, so numbers can be added without a restart;
+    reload() also re-reads the environment / .env.
+    """
+
+    def __init__(self, numbers: str, path: str, check_interval: float):
+        self.path = path
+        self.check_interval = check_interval
+        self._inline = parse_phone_numbers(numbers)
+        self._numbers: FrozenSet[str] = self._inline
+        self._mtime: Optional[float] = None
+        self._next_check = 0.0
+        self.reloads = 0
+        self._load_file()
+
+    def allowed(self, number: str) -> bool:
+        """Whether `number` (as sent by WhatsApp, or in any common format) may use the bot"""
+        self._maybe_reload()
+        return not self._numbers or normalize_phone(number) in self._numbers
+
+    def reload(self):
+        """Re-read ALLOWED_PHONE_NUMBERS (environment / .env) and the allow-list file"""
+        from app.config import Settings
+        try:
+            fresh = Settings()
+        except Exception as e:
+            logger.error(f" Allow-list reload failed, keeping {len(self._numbers)} numbers: {e}")
+            return
+        self._inline = parse_phone_numbers(fresh.ALLOWED_PHONE_NUMBERS)
+        self.path = fresh.ALLOWED_PHONE_NUMBERS_FILE
+        self._mtime = None
+        self._load_file()
+        logger.info(f" Allow-list reloaded: {len(self._numbers)} numbers")
+
+    def _maybe_reload(self):
+        if not self.path:
+            return
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        self._next_check = now + self.check_interval
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != self._mtime:
+            self._load_file()
+            logger.info(f" Allow-list file changed, {len(self._numbers)} numbers")
+
+    def _load_file(self):
+        numbers = self._inline
+        if self.path:
+            try:
+                with open(self.path) as f:
+                    numbers = numbers | parse_phone_numbers(f.read())
+                self._mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                self._mtime = None
+                logger.warning(f" Could not read allow-list file {self.path}: {e}")
+        self._numbers = numbers
+        self.reloads += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "numbers": len(self._numbers),
+            "file": self.path or None,
+            "reloads": self.reloads
+        }
+
+
+class WebhookFilter:
+    """
+    Pre-dispatch filter for webhook payloads
+
+    Picks out the messages worth handling - inbound messages from allowed
+    numbers - so status-only payloads and unauthorized senders are dropped in
+    the request handler, before dedup, read receipts or any queued work.
+    Delivery statuses are handed to the status aggregator on the way.
+
+    `counts` has one reason per payload: accepted (at least one message
+    dispatched), unauthorized (messages, none from an allowed sender),
+    status_only (no messages), or the reason it was refused. `messages`
+    counts the individual messages accepted and dropped.
+    """
+
+    def __init__(self, allow_list: AllowList, statuses: DeliveryStatusAggregator):
+        self.allow_list = allow_list
+        self.statuses = statuses
+        self.counts = {
+            "accepted": 0, "unauthorized": 0, "status_only": 0, "unknown_object": 0,
+            "bad_signature": 0, "malformed": 0
+        }
+        self.messages = {"accepted": 0, "unauthorized": 0}
+
+    def select(self, body: Dict[str, Any]) -> List[InboundMessage]:
+        """
+        Messages to dispatch from a webhook payload
+
+        Args:
+            body: Parsed webhook JSON
+
+        Returns:
+            Messages from allowed senders, in payload order
+
+        Raises:
+            InvalidWebhook: The payload doesn't have the webhook's shape
+                            (nothing is recorded then)
+        """
+        if body.get("object") != "whatsapp_business_account":
+            self._drop("unknown_object")
+            logger.warning(f" Unknown webhook object: {body.get('object')}")
+            return []
+
+        statuses, messages = self._read_changes(body)
+        for status in statuses:
+            self._record_status(status)
+
+        selected = []
+        for message in messages:
+            if self.allow_list.allowed(message.from_number):
+                selected.append(message)
+            else:
+                logger.debug(f" Dropped message from unauthorized number {message.from_number}")
+        self.messages["accepted"] += len(selected)
+        self.messages["unauthorized"] += len(messages) - len(selected)
+
+        if selected:
+            self.counts["accepted"] += 1
+        elif messages:
+            self._drop("unauthorized")
+        else:
+            self._drop("status_only")
+        return selected
+
+    @staticmethod
+    def _read_changes(body: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[InboundMessage]]:
+        """Validate the payload's shape; (status objects, parsed messages)"""
+        statuses: List[Dict[str, Any]] = []
+        messages: List[InboundMessage] = []
+        for entry in _dict_items(body.get("entry"), "entry"):
+            for change in _dict_items(entry.get("changes"), "changes"):
+                value = change.get("value", {})
+                if not isinstance(value, dict):
+                    raise InvalidWebhook("Webhook change value is not an object")
+                statuses.extend(_dict_items(value.get("statuses"), "statuses"))
+                for message in _dict_items(value.get("messages"), "messages"):
+                    if not isinstance(message.get("from", ""), str) or not isinstance(message.get("id", ""), str):
+                        raise InvalidWebhook("Webhook message has a non-string id / from")
+                    try:
+                        messages.append(InboundMessage.from_payload(message))
+                    except (AttributeError, TypeError) as e:
+                        raise InvalidWebhook(f"Malformed webhook message: {e}")
+        return statuses, messages
+
+    def _record_status(self, status: Dict[str, Any]):
+        try:
+            timestamp = int(status.get("timestamp", 0))
+        except (TypeError, ValueError):
+            return
+        message_id, name = status.get("id", ""), status.get("status", "unknown")
+        errors = status.get("errors")
+        errors = [error for error in errors if isinstance(error, dict)] if isinstance(errors, list) else []
+        if isinstance(message_id, str) and isinstance(name, str):
+            self.statuses.record(message_id, name, timestamp, errors)
+
+    def reject(self, reason: str):
+        """Count a payload refused before parsing (bad_signature, malformed)"""
+        self._drop(reason)
+
+    def _drop(self, reason: str):
+        self.counts[reason] += 1
+        WEBHOOK_FILTERED.labels(reason).inc()
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self.counts, "messages": dict(self.messages), "allow_list": self.allow_list.stats()}
+
+
+# Global allow-list and webhook filter
+allow_list = AllowList(
+    numbers=settings.ALLOWED_PHONE_NUMBERS,
+    path=settings.ALLOWED_PHONE_NUMBERS_FILE,
+    check_interval=settings.ALLOWED_PHONE_NUMBERS_CHECK_INTERVAL
+)
+webhook_filter = WebhookFilter(allow_list, status_aggregator)
@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import json
+import logging
+from typing import Any, Dict, NamedTuple, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional: stdlib json is used without it
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = "X-Hub-Signature-256"
+SIGNATURE_PREFIX = "sha256="
+
+
+class InvalidWebhook(Exception):
+    """Raised for webhook bodies that are not JSON objects"""
+
+
+def verify_signature(raw: bytes, header: Optional[str], secret: str) -> bool:
+    """
+    Check Meta's X-Hub-Signature-256 header against the raw request body
+
+    Args:
+        raw: Request body exactly as received
+        header: Header value ("sha256=<hex digest>")
+        secret: App secret the payload is signed with
+
+    Returns:
+        True if the HMAC-SHA256 of `raw` matches
+    """
+    if not header or not header.startswith(SIGNATURE_PREFIX):
+        return False
+    expected = hmac.new(secret.encode(), raw, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, header[len(SIGNATURE_PREFIX):])
+
+
+def parse_webhook(raw: bytes) -> Dict[str, Any]:
+    """
+    Decode a webhook body (orjson if installed, else json)
+
+    Raises:
+        InvalidWebhook: Not a JSON object
+    """
+    try:
+        body = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    except ValueError as e:
+        raise InvalidWebhook(f"Malformed webhook JSON: {e}")
+    if not isinstance(body, dict):
+        raise InvalidWebhook("Webhook body is not a JSON object")
+    return body
+
+
+class InboundMessage(NamedTuple):
+    """The fields of an incoming WhatsApp message the bot uses"""
+    id: str
+    from_number: str
+    type: str
+    timestamp: int
+    text: str = ""  # text messages: body
+    media_id: str = ""  # audio messages: media to download
+
+    @classmethod
+    def from_payload(cls, message: Dict[str, Any]) -> "InboundMessage":
+        message_type = message.get("type", "unknown")
+        media = message.get(message_type) if message_type in ("audio", "image", "video", "document", "sticker") else None
+        try:
+            timestamp = int(message.get("timestamp", 0))
+        except (TypeError, ValueError):
+            timestamp = 0
+        return cls(
+            id=message.get("id", ""),
+            from_number=message.get("from", ""),
+            type=message_type,
+            timestamp=timestamp,
+            text=(message.get("text") or {}).get("body", "") if message_type == "text" else "",
+            media_id=(media or {}).get("id", "")
+        )
@@ -1,14 +1,49 @@
+import hashlib
 import httpx
 import logging
 import io
-from typing import Dict, Optional, Any
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Any, Tuple
 from app.config import settings
+from app.metrics import stage, record_retry
 
 logger = logging.getLogger(__name__)
 
+# Graph API error codes meaning the media itself can't be used (expired / unknown media ID)
+MEDIA_ERROR_CODES = {131052, 131053}
+# Generic "invalid parameter" code, a media error only when it names the media ID
+INVALID_PARAMETER_CODE = 100
+
+
+def is_media_id_error(response: httpx.Response) -> bool:
+    """Whether a failed send was rejected because of its media ID (not recipient, policy...)"""
+    try:
+        error = response.json().get("error", {})
+    except ValueError:
+        return False
+    return is_media_error(error)
+
+
+def is_media_error(error: Dict[str, Any]) -> bool:
+    """Whether a Graph error object (send response or failed status) is about the media ID"""
+    code = error.get("code")
+    if code in MEDIA_ERROR_CODES:
+        return True
+    if code == INVALID_PARAMETER_CODE:
+        details = f"{error.get('message', '')} {error.get('error_data', {}).get('details', '')}".lower()
+        return "media" in details or "['id']" in details
+    return False
+
 
 class WhatsAppClient:
-    """WhatsApp Business API Client"""
+    """WhatsApp Business API Client
+    
+    All calls share one long-lived httpx.AsyncClient (keep-alive, HTTP/2) so
+    requests to graph.facebook.com reuse pooled connections instead of doing a
+    TCP + TLS handshake each time. Call start() at app startup and close() at
+    shutdown; the client is also opened lazily for scripts that skip start().
+    """
     
     def __init__(self):
         self.base_url = settings.whatsapp_api_base_url
@@ -18,6 +53,99 @@ class WhatsAppClient:
             "Authorization": f"Bearer {self.access_token}",
             "Content-Type": "application/json"
         }
+        self._client: Optional[httpx.AsyncClient] = None
+        
+        # Request counters for pool_stats()
+        self._requests_total = 0
+        self._requests_in_flight = 0
+        self._request_errors = 0
+        
+        # Audio content hash -> (media_id, expires_at) for recently uploaded audio
+        self._media_ids: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self._media_cache_hits = 0
+        self._media_cache_misses = 0
+        self._media_cache_rejected = 0
+        # Sent message id (wamid) -> (content hash, media_id), for failed status callbacks
+        self._sent_media: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._media_cache_failed = 0
+    
+    def _build_client(self) -> httpx.AsyncClient:
+        """Create the shared pooled HTTP client"""
+        limits = httpx.Limits(
+            max_connections=settings.WHATSAPP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.WHATSAPP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.WHATSAPP_KEEPALIVE_EXPIRY
+        )
+        return httpx.AsyncClient(
+            http2=settings.WHATSAPP_HTTP2,
+            limits=limits,
+            timeout=30.0
+        )
+    
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client (opened on first use if start() was not called)"""
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+    
+    async def start(self):
+        """Open the shared HTTP client (call from the app startup hook)"""
+        _ = self.client
+        logger.info(
+            f" WhatsApp HTTP client ready (http2={settings.WHATSAPP_HTTP2}, "
+            f"max_connections={settings.WHATSAPP_MAX_CONNECTIONS})"
+        )
+    
+    async def close(self):
+        """Close the shared HTTP client and its pooled connections"""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+            logger.info(" WhatsApp HTTP client closed")
+        self._client = None
+    
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request through the shared client, tracking pool counters"""
+        self._requests_total += 1
+        self._requests_in_flight += 1
+        try:
+            return await self.client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            self._request_errors += 1
+            raise
+        finally:
+            self._requests_in_flight -= 1
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        """
+        Connection pool metrics for the shared client
+        
+        Returns:
+            Dict with request counters and open/idle/HTTP2 connection counts
+        """
+        stats = {
+            "open": self._client is not None and not self._client.is_closed,
+            "http2": settings.WHATSAPP_HTTP2,
+            "max_connections": settings.WHATSAPP_MAX_CONNECTIONS,
+            "max_keepalive_connections": settings.WHATSAPP_MAX_KEEPALIVE_CONNECTIONS,
+            "requests_total": self._requests_total,
+            "requests_in_flight": self._requests_in_flight,
+            "request_errors": self._request_errors,
+            "connections": 0,
+            "idle_connections": 0,
+            "http2_connections": 0
+        }
+        
+        # httpx does not expose pool state publicly; read it from httpcore
+        pool = getattr(getattr(self._client, "_transport", None), "_pool", None)
+        for connection in getattr(pool, "connections", []):
+            stats["connections"] += 1
+            if connection.is_idle():
+                stats["idle_connections"] += 1
+            if "HTTP/2" in connection.info():
+                stats["http2_connections"] += 1
+        
+        return stats
     
     async def send_text_message(
         self, 
@@ -53,17 +181,18 @@ class WhatsAppClient:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+            async with stage("send_message", upstream="whatsapp"):
+                response = await self._request(
+                    "POST",
                     url,
                     json=payload,
                     headers=self.headers,
                     timeout=30.0
                 )
                 response.raise_for_status()
-                result = response.json()
-                logger.info(f" Message sent to {to}: {result}")
-                return result
+            result = response.json()
+            logger.info(f" Message sent to {to}: {result}")
+            return result
         except httpx.HTTPError as e:
             logger.error(f" Failed to send message to {to}: {e}")
             if hasattr(e, 'response') and e.response is not None:
@@ -109,17 +238,17 @@ class WhatsAppClient:
             payload["template"]["components"] = components
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url,
-                    json=payload,
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                response.raise_for_status()
-                result = response.json()
-                logger.info(f" Template message sent to {to}: {result}")
-                return result
+            response = await self._request(
+                "POST",
+                url,
+                json=payload,
+                headers=self.headers,
+                timeout=30.0
+            )
+            response.raise_for_status()
+            result = response.json()
+            logger.info(f" Template message sent to {to}: {result}")
+            return result
         except httpx.HTTPError as e:
             logger.error(f" Failed to send template message to {to}: {e}")
             if hasattr(e, 'response') and e.response is not None:
@@ -137,15 +266,16 @@ class WhatsAppClient:
         }
         
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
+            async with stage("mark_read", upstream="whatsapp"):
+                response = await self._request(
+                    "POST",
                     url,
                     json=payload,
                     headers=self.headers,
                     timeout=30.0
                 )
                 response.raise_for_status()
-                return response.json()
+            return response.json()
         except httpx.HTTPError as e:
             logger.error(f" Failed to mark message as read: {e}")
             raise
@@ -161,11 +291,12 @@ class WhatsAppClient:
             Media file bytes
         """
         try:
-            # Step 1: Get media URL
-            url = f"{self.base_url}/{media_id}"
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.get(
+            async with stage("download_media", upstream="whatsapp"):
+                # Step 1: Get media URL
+                url = f"{self.base_url}/{media_id}"
+                
+                response = await self._request(
+                    "GET",
                     url,
                     headers=self.headers,
                     timeout=30.0
@@ -180,16 +311,17 @@ class WhatsAppClient:
                 logger.info(f" Downloading media from: {media_url}")
                 
                 # Step 2: Download media file
-                media_response = await client.get(
+                media_response = await self._request(
+                    "GET",
                     media_url,
                     headers=self.headers,
                     timeout=60.0
                 )
                 media_response.raise_for_status()
-                
-                media_bytes = media_response.content
-                logger.info(f" Downloaded {len(media_bytes)} bytes")
-                return media_bytes
+            
+            media_bytes = media_response.content
+            logger.info(f" Downloaded {len(media_bytes)} bytes")
+            return media_bytes
                 
         except httpx.HTTPError as e:
             logger.error(f" Failed to download media {media_id}: {e}")
@@ -197,6 +329,141 @@ class WhatsAppClient:
                 logger.error(f"Response: {e.response.text}")
             raise
     
+    async def upload_media(
+        self,
+        audio_bytes: bytes,
+        filename: str = "voice_message.ogg"
+    ) -> str:
+        """
+        Upload audio to WhatsApp media storage
+        
+        Args:
+            audio_bytes: Audio file bytes (OGG format)
+            filename: Filename for the audio
+            
+        Returns:
+            WhatsApp media ID
+        """
+        upload_url = f"{self.base_url}/{self.phone_number_id}/media"
+        
+        # Create file-like object from bytes
+        # IMPORTANT: MIME type must be 'audio/ogg; codecs=opus' for waveform display!
+        files = {
+            'file': (filename, io.BytesIO(audio_bytes), 'audio/ogg; codecs=opus')
+        }
+        
+        upload_headers = {
+            "Authorization": f"Bearer {self.access_token}"
+        }
+        
+        async with stage("upload_media", upstream="whatsapp"):
+            upload_response = await self._request(
+                "POST",
+                upload_url,
+                files=files,
+                headers=upload_headers,
+                data={"messaging_product": "whatsapp"},
+                timeout=60.0
+            )
+            upload_response.raise_for_status()
+        upload_result = upload_response.json()
+        
+        media_id = upload_result.get("id")
+        if not media_id:
+            raise Exception("No media ID in upload response")
+        
+        logger.info(f"📤 Uploaded audio, media_id: {media_id}")
+        return media_id
+    
+    async def _send_audio_by_id(self, to: str, media_id: str) -> Dict[str, Any]:
+        """Send an already uploaded audio as a voice message"""
+        message_url = f"{self.base_url}/{self.phone_number_id}/messages"
+        
+        payload = {
+            "messaging_product": "whatsapp",
+            "recipient_type": "individual",
+            "to": to,
+            "type": "audio",
+            "audio": {
+                "id": media_id,
+                "voice": True  # THIS enables waveform display!
+            }
+        }
+        
+        async with stage("send_message", upstream="whatsapp"):
+            message_response = await self._request(
+                "POST",
+                message_url,
+                json=payload,
+                headers=self.headers,
+                timeout=30.0
+            )
+            message_response.raise_for_status()
+        return message_response.json()
+    
+    def _cached_media_id(self, digest: str) -> Optional[str]:
+        """Media ID of a recent upload with the same content, if still retained by Meta"""
+        entry = self._media_ids.get(digest)
+        if entry is None:
+            self._media_cache_misses += 1
+            return None
+        media_id, expires_at = entry
+        if expires_at <= time.time():
+            del self._media_ids[digest]
+            self._media_cache_misses += 1
+            return None
+        self._media_ids.move_to_end(digest)
+        self._media_cache_hits += 1
+        return media_id
+    
+    def _remember_media_id(self, digest: str, media_id: str):
+        self._media_ids[digest] = (media_id, time.time() + settings.WHATSAPP_MEDIA_CACHE_TTL)
+        self._media_ids.move_to_end(digest)
+        while len(self._media_ids) > settings.WHATSAPP_MEDIA_CACHE_SIZE:
+            self._media_ids.popitem(last=False)
+    
+    def _remember_sent_media(self, result: Dict[str, Any], digest: str, media_id: str):
+        for message in result.get("messages") or []:
+            message_id = message.get("id") if isinstance(message, dict) else None
+            if message_id:
+                self._sent_media[message_id] = (digest, media_id)
+        while len(self._sent_media) > settings.WHATSAPP_MEDIA_CACHE_SIZE:
+            self._sent_media.popitem(last=False)
+    
+    def on_message_failed(self, message_id: str, errors: List[Dict[str, Any]]):
+        """
+        Failed status callback: drop the message's media ID from the cache
+        
+        Graph often accepts a send with an expired or unknown media ID and
+        reports the problem later as a failed status, so this is where stale
+        IDs are usually found. Only media errors evict; the next send of that
+        audio uploads it again.
+        
+        Args:
+            message_id: Outbound message id (wamid)
+            errors: Error objects from the status callback
+        """
+        sent = self._sent_media.pop(message_id, None)
+        if sent is None or not any(is_media_error(error) for error in errors):
+            return
+        digest, media_id = sent
+        entry = self._media_ids.get(digest)
+        # A newer upload of the same audio may have replaced the failed ID already
+        if entry is not None and entry[0] == media_id:
+            del self._media_ids[digest]
+            self._media_cache_failed += 1
+            logger.warning(f" Message {message_id} failed on media_id {media_id}, dropped from the media cache")
+    
+    def media_cache_stats(self) -> Dict[str, Any]:
+        """Media ID reuse counters"""
+        return {
+            "entries": len(self._media_ids),
+            "hits": self._media_cache_hits,
+            "misses": self._media_cache_misses,
+            "rejected": self._media_cache_rejected,
+            "failed": self._media_cache_failed
+        }
+    
     async def send_audio_message(
         self,
         to: str,
@@ -206,6 +473,12 @@ class WhatsAppClient:
         """
         Send an audio/voice message via WhatsApp
         
+        Identical audio uploaded recently is not uploaded again: the cached
+        media ID is reused (WHATSAPP_MEDIA_CACHE_TTL stays inside Meta's media
+        retention window). If Meta rejects a cached ID the audio is re-uploaded;
+        if it reports the failure later in a status callback, the ID is dropped
+        (see on_message_failed) and the next send uploads again.
+        
         Args:
             to: Recipient phone number
             audio_bytes: Audio file bytes (OGG format)
@@ -215,64 +488,39 @@ class WhatsAppClient:
             API response dict
         """
         to = to.replace("+", "").replace(" ", "").replace("-", "")
+        digest = hashlib.sha256(audio_bytes).hexdigest()
         
         try:
-            # Step 1: Upload media to WhatsApp
-            upload_url = f"{self.base_url}/{self.phone_number_id}/media"
+            # Step 1: Reuse a cached media ID for identical audio
+            media_id = self._cached_media_id(digest) if settings.WHATSAPP_MEDIA_CACHE_SIZE > 0 else None
+            if media_id:
+                try:
+                    result = await self._send_audio_by_id(to, media_id)
+                    self._remember_sent_media(result, digest, media_id)
+                    logger.info(f" Audio message sent to {to} (reused media_id {media_id}): {result}")
+                    return result
+                except httpx.HTTPStatusError as e:
+                    # Only errors about the media ID itself warrant a new upload; anything
+                    # else (recipient, policy, rate limit) would fail again
+                    if not 400 <= e.response.status_code < 500 or not is_media_id_error(e.response):
+                        raise
+                    self._media_cache_rejected += 1
+                    record_retry("whatsapp", "upload_media")
+                    self._media_ids.pop(digest, None)
+                    logger.warning(f" Cached media_id {media_id} rejected, uploading again: {e.response.text}")
             
-            # Create file-like object from bytes
-            # IMPORTANT: MIME type must be 'audio/ogg; codecs=opus' for waveform display!
-            files = {
-                'file': (filename, io.BytesIO(audio_bytes), 'audio/ogg; codecs=opus')
-            }
+            # Step 2: Upload media to WhatsApp
+            media_id = await self.upload_media(audio_bytes, filename)
+            if settings.WHATSAPP_MEDIA_CACHE_SIZE > 0:
+                self._remember_media_id(digest, media_id)
             
-            upload_headers = {
-                "Authorization": f"Bearer {self.access_token}"
-            }
+            # Step 3: Send audio message
+            result = await self._send_audio_by_id(to, media_id)
+            if settings.WHATSAPP_MEDIA_CACHE_SIZE > 0:
+                self._remember_sent_media(result, digest, media_id)
             
-            async with httpx.AsyncClient() as client:
-                # Upload media
-                upload_response = await client.post(
-                    upload_url,
-                    files=files,
-                    headers=upload_headers,
-                    data={"messaging_product": "whatsapp"},
-                    timeout=60.0
-                )
-                upload_response.raise_for_status()
-                upload_result = upload_response.json()
-                
-                media_id = upload_result.get("id")
-                if not media_id:
-                    raise Exception("No media ID in upload response")
-                
-                logger.info(f"📤 Uploaded audio, media_id: {media_id}")
-                
-                # Step 2: Send audio message
-                message_url = f"{self.base_url}/{self.phone_number_id}/messages"
-                
-                payload = {
-                    "messaging_product": "whatsapp",
-                    "recipient_type": "individual",
-                    "to": to,
-                    "type": "audio",
-                    "audio": {
-                        "id": media_id,
-                        "voice": True  # THIS enables waveform display!
-                    }
-                }
-                
-                message_response = await client.post(
-                    message_url,
-                    json=payload,
-                    headers=self.headers,
-                    timeout=30.0
-                )
-                message_response.raise_for_status()
-                result = message_response.json()
-                
-                logger.info(f" Audio message sent to {to}: {result}")
-                return result
+            logger.info(f" Audio message sent to {to}: {result}")
+            return result
                 
         except httpx.HTTPError as e:
             logger.error(f" Failed to send audio message to {to}: {e}")
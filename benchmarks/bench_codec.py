@@ -0,0 +1,117 @@
+"""
+Compare audio codec backends: ffmpeg CLI (process per call) vs in-process PyAV
+
+Runs the conversions the bot does - TTS output (MP3 or 24kHz PCM) to a
+WhatsApp voice note, and WhatsApp OGG to 24kHz PCM for the Realtime API -
+through each backend in app.audio_codec, measuring latency, CPU time
+(this process + children) and throughput.
+
+Usage (from the repository root, needs ffmpeg for the fixtures; PyAV is
+skipped when not installed):
+
+    python -m benchmarks.bench_codec --seconds 8 --iterations 50 --concurrency 4
+    python -m benchmarks.bench_codec --profile fast
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+from benchmarks.fake_upstreams import render_fixture
+from benchmarks.run_benchmark import BENCHMARK_ENV, percentiles
+
+# (operation, fixture format)
+OPERATIONS = [
+    ("encode", "mp3_44100_128"),
+    ("encode", "pcm_24000"),
+    ("decode", "ogg_opus"),
+]
+
+
+def cpu_seconds() -> float:
+    total = 0.0
+    for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN):
+        usage = resource.getrusage(who)
+        total += usage.ru_utime + usage.ru_stime
+    return total
+
+
+async def bench_operation(codec, operation: str, audio_format: str, audio: bytes,
+                          iterations: int, concurrency: int, profile: str) -> Dict[str, object]:
+    latencies: List[float] = []
+    output_bytes: List[int] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run_once():
+        async with semaphore:
+            started = time.perf_counter()
+            if operation == "encode":
+                tempo = 1.25 if audio_format.startswith("mp3") else 1.0
+                output = await codec.encode(audio, audio_format, tempo, profile)
+            else:
+                output = await codec.decode_to_pcm(audio, 24000)
+            latencies.append(time.perf_counter() - started)
+            output_bytes.append(len(output))
+
+    await run_once()  # Warm-up (imports, codec tables)
+    latencies.clear()
+
+    cpu_before = cpu_seconds()
+    started = time.perf_counter()
+    await asyncio.gather(*(run_once() for _ in range(iterations)))
+    wall = time.perf_counter() - started
+    cpu = cpu_seconds() - cpu_before
+
+    return {
+        "output_bytes": output_bytes[-1],
+        "latency": percentiles(latencies),
+        "cpu_seconds_per_op": round(cpu / iterations, 4),
+        "ops_per_sec": round(iterations / wall, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=8.0, help="Length of the test audio")
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--backends", nargs="+", default=["ffmpeg", "pyav"])
+    parser.add_argument("--profile", default="quality", help="Opus encoding profile (quality, balanced, fast)")
+    args = parser.parse_args(argv)
+
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
+    from app import audio_codec as codec_module
+
+    codecs = {}
+    if "ffmpeg" in args.backends:
+        codecs["ffmpeg"] = codec_module.FfmpegCodec()
+    if "pyav" in args.backends:
+        if codec_module.av is None:
+            print("PyAV not installed, skipping the pyav backend (pip install av)")
+        else:
+            codecs["pyav"] = codec_module.PyAVCodec(workers=args.concurrency)
+
+    fixtures = {audio_format: render_fixture(audio_format, args.seconds) for _, audio_format in OPERATIONS}
+
+    print(f"{'operation':<24}{'backend':<10}{'output':>10}{'p50':>10}{'p95':>10}{'cpu/op':>10}{'ops/s':>10}")
+    for operation, audio_format in OPERATIONS:
+        baseline = None
+        for name, codec in codecs.items():
+            result = asyncio.run(bench_operation(
+                codec, operation, audio_format, fixtures[audio_format], args.iterations, args.concurrency, args.profile
+            ))
+            baseline = baseline or result
+            cpu_delta = ""
+            if result is not baseline and baseline["cpu_seconds_per_op"]:
+                change = result["cpu_seconds_per_op"] / baseline["cpu_seconds_per_op"] - 1
+                cpu_delta = f" ({change * 100:+.0f}%)"
+            print(f"{operation + ' ' + audio_format:<24}{name:<10}{result['output_bytes']:>10}"
+                  f"{result['latency']['p50']:>9.3f}s{result['latency']['p95']:>9.3f}s"
+                  f"{result['cpu_seconds_per_op']:>9.3f}s{result['ops_per_sec']:>10}{cpu_delta}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
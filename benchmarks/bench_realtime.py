@@ -0,0 +1,109 @@
+"""
+Realtime API turn latency: server VAD vs manual commit
+
+Replays voice notes through app.realtime_voice.send_to_realtime_api against
+the fake Realtime WebSocket in fake_upstreams.py, once per REALTIME_TURN_MODE,
+and reports turn latency (audio sent → response.done) per mode.
+
+With server_vad the fake ends a turn REALTIME_VAD_SILENCE seconds after the
+last audio, like the real server waiting for trailing silence; in manual mode
+the bot commits the clip and requests the response itself.
+
+Usage (from the repository root):
+
+    python -m benchmarks.bench_realtime --users 10 --turns 5
+    python -m benchmarks.bench_realtime --latency openai.realtime=1.2:0.3
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+from benchmarks.fake_upstreams import FakeUpstreams, render_fixture
+from benchmarks.run_benchmark import BENCHMARK_ENV, free_port, parse_profiles, percentiles, start_fake_server
+
+MODES = ["server_vad", "manual"]
+
+
+async def run_mode(mode: str, users: int, turns: int, voice_note: bytes) -> Dict[str, object]:
+    from app.config import settings
+    from app.realtime_pool import realtime_pool
+    from app.realtime_voice import send_to_realtime_api
+
+    settings.REALTIME_TURN_MODE = mode
+    latencies: List[float] = []
+    first_turns: List[float] = []
+    errors = 0
+
+    async def conversation(user_phone: str):
+        nonlocal errors
+        for turn in range(turns):
+            started = time.perf_counter()
+            try:
+                await send_to_realtime_api(voice_note, user_phone)
+            except Exception:
+                errors += 1
+                continue
+            (first_turns if turn == 0 else latencies).append(time.perf_counter() - started)
+
+    try:
+        await asyncio.gather(*(conversation(f"3162{i:07d}") for i in range(users)))
+    finally:
+        await realtime_pool.close()
+
+    return {
+        "turn": percentiles(latencies),
+        "first_turn": percentiles(first_turns),
+        "errors": errors,
+        "sessions": realtime_pool.stats(),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10, help="Concurrent conversations")
+    parser.add_argument("--turns", type=int, default=5, help="Voice notes per conversation")
+    parser.add_argument("--audio-seconds", type=float, default=4.0, help="Length of each voice note")
+    parser.add_argument("--latency", action="append", default=[], metavar="ENDPOINT=MEDIAN[:JITTER]")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="ENDPOINT=P")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    fake = FakeUpstreams(parse_profiles(args.latency, args.error_rate), audio_seconds=args.audio_seconds)
+    fake.fixture("pcm_24000")
+    voice_note = render_fixture("pcm_24000", args.audio_seconds)
+
+    port = free_port()
+    server = start_fake_server(fake, port)
+    os.environ.update(BENCHMARK_ENV)
+    os.environ["REALTIME_API_URL"] = f"ws://127.0.0.1:{port}/openai/v1/realtime"
+
+    results = {}
+    try:
+        for mode in MODES:
+            results[mode] = asyncio.run(run_mode(mode, args.users, args.turns, voice_note))
+    finally:
+        server.should_exit = True
+
+    baseline = results[MODES[0]]["turn"]
+    print(f"{'mode':<12}{'turns':>7}{'p50':>18}{'p95':>18}{'first turn p50':>16}{'errors':>8}")
+    for mode, result in results.items():
+        turn = result["turn"]
+        if not turn.get("count"):
+            print(f"{mode:<12}{0:>7}")
+            continue
+        cells = ""
+        for q in ("p50", "p95"):
+            delta = ""
+            if result["turn"] is not baseline and baseline.get(q):
+                delta = f" ({(turn[q] - baseline[q]) / baseline[q] * 100:+.1f}%)"
+            cells += f"{turn[q]:>9.3f}s{delta:<9}"
+        first = result["first_turn"].get("p50", 0.0)
+        print(f"{mode:<12}{turn['count']:>7}{cells}{first:>15.3f}s{result['errors']:>8}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Compare TTS output formats: MP3 decode + re-encode vs raw PCM → Opus
+
+For each ElevenLabs output format, renders a speech-length fixture and runs
+the bot's own ffmpeg command (app.tts_converter.tts_encode_command) on it,
+measuring wall-clock latency and ffmpeg CPU time (user + sys of the child).
+
+Usage (from the repository root, needs ffmpeg):
+
+    python -m benchmarks.bench_tts_formats --seconds 12 --iterations 20 --concurrency 4
+
+For the effect on the whole reply path, run the load test with both formats:
+
+    python -m benchmarks.run_benchmark --output mp3.json
+    python -m benchmarks.run_benchmark --set TTS_OUTPUT_FORMAT=pcm_16000 --compare mp3.json
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import time
+from typing import Dict, List, Optional
+from benchmarks.fake_upstreams import render_fixture
+from benchmarks.run_benchmark import BENCHMARK_ENV, percentiles
+
+FORMATS = ["mp3_44100_128", "pcm_16000", "pcm_24000"]
+
+
+def children_cpu_seconds() -> float:
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+async def bench_format(audio_format: str, audio: bytes, iterations: int, concurrency: int) -> Dict[str, object]:
+    from app.audio_codec import StreamingOggEncoder
+    from app.tts_converter import tts_encode_command
+
+    command = tts_encode_command(audio_format)
+    latencies: List[float] = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def encode_once():
+        async with semaphore:
+            started = time.perf_counter()
+            encoder = StreamingOggEncoder(command)
+            await encoder.start()
+            await encoder.write(audio)
+            await encoder.finish()
+            latencies.append(time.perf_counter() - started)
+
+    cpu_before = children_cpu_seconds()
+    started = time.perf_counter()
+    await asyncio.gather(*(encode_once() for _ in range(iterations)))
+    wall = time.perf_counter() - started
+    cpu = children_cpu_seconds() - cpu_before
+
+    return {
+        "input_bytes": len(audio),
+        "latency": percentiles(latencies),
+        "cpu_seconds_per_reply": round(cpu / iterations, 4),
+        "replies_per_sec": round(iterations / wall, 2),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seconds", type=float, default=12.0, help="Length of the synthetic reply")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--formats", nargs="+", default=FORMATS)
+    args = parser.parse_args(argv)
+
+    for key, value in BENCHMARK_ENV.items():
+        os.environ.setdefault(key, value)
+
+    print(f"{'format':<16}{'input':>12}{'p50':>10}{'p95':>10}{'cpu/reply':>12}{'replies/s':>12}")
+    baseline = None
+    for audio_format in args.formats:
+        audio = render_fixture(audio_format, args.seconds)
+        result = asyncio.run(bench_format(audio_format, audio, args.iterations, args.concurrency))
+        baseline = baseline or result
+        cpu_delta = ""
+        if result is not baseline and baseline["cpu_seconds_per_reply"]:
+            change = result["cpu_seconds_per_reply"] / baseline["cpu_seconds_per_reply"] - 1
+            cpu_delta = f" ({change * 100:+.0f}%)"
+        print(f"{audio_format:<16}{result['input_bytes']:>12}"
+              f"{result['latency']['p50']:>9.3f}s{result['latency']['p95']:>9.3f}s"
+              f"{result['cpu_seconds_per_reply']:>11.3f}s{result['replies_per_sec']:>12}{cpu_delta}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
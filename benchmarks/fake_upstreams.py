@@ -0,0 +1,347 @@
+"""
+Local stand-ins for the Graph API, OpenAI and ElevenLabs
+
+One FastAPI app serves all three under path prefixes, so the bot can be
+pointed at it with settings only:
+
+    WHATSAPP_API_BASE_URL = http://127.0.0.1:<port>/graph
+    OPENAI_BASE_URL       = http://127.0.0.1:<port>/openai/v1
+    ELEVENLABS_BASE_URL   = http://127.0.0.1:<port>/elevenlabs
+    REALTIME_API_URL      = ws://127.0.0.1:<port>/openai/v1/realtime
+
+Every endpoint waits a sampled latency (median * lognormal jitter) and fails
+with HTTP 500 at a configurable rate. Audio fixtures are real files rendered
+with ffmpeg, so the bot's transcoding runs exactly as in production.
+"""
+import asyncio
+import base64
+import itertools
+import json
+import random
+import subprocess
+import time
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, Optional
+from fastapi import FastAPI, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+@dataclass
+class EndpointProfile:
+    """Latency and error distribution of one fake endpoint"""
+    latency: float = 0.0  # Median seconds
+    jitter: float = 0.0  # Lognormal sigma (0 = fixed latency)
+    error_rate: float = 0.0  # Probability of answering HTTP 500
+
+    def sample_latency(self) -> float:
+        if self.jitter <= 0:
+            return self.latency
+        return self.latency * random.lognormvariate(0.0, self.jitter)
+
+
+# Rough production medians
+DEFAULT_PROFILES: Dict[str, EndpointProfile] = {
+    "graph.messages": EndpointProfile(0.15, 0.3),
+    "graph.media_upload": EndpointProfile(0.4, 0.3),
+    "graph.media_info": EndpointProfile(0.1, 0.3),
+    "graph.media_download": EndpointProfile(0.2, 0.3),
+    "openai.chat": EndpointProfile(1.0, 0.4),
+    "openai.transcription": EndpointProfile(0.8, 0.3),
+    "elevenlabs.tts": EndpointProfile(1.2, 0.4),
+    "openai.realtime": EndpointProfile(0.8, 0.3),  # Committed turn → response.done
+    "openai.realtime_connect": EndpointProfile(0.3, 0.3),  # WebSocket + session.update
+}
+
+# Silence the fake server VAD waits for after the last audio before it ends a turn
+REALTIME_VAD_SILENCE = 0.5
+
+# ffmpeg output arguments for each fixture format
+FIXTURE_FORMATS = {
+    "mp3_44100_128": ["-ar", "44100", "-b:a", "128k", "-f", "mp3"],
+    "pcm_16000": ["-ar", "16000", "-ac", "1", "-f", "s16le"],
+    "pcm_24000": ["-ar", "24000", "-ac", "1", "-f", "s16le"],
+    "ogg_opus": ["-ar", "16000", "-c:a", "libopus", "-b:a", "16k", "-f", "ogg"],
+}
+
+REPLY_TEXT = (
+    "Nou kijk, eigenlijk werken we met ontwikkelingskosten vooraf, en dan een kleine "
+    "maandelijkse fee voor onderhoud. Vrij standaard! Vertel eens, met welk probleem zit je nu?"
+)
+
+
+def render_fixture(audio_format: str, seconds: float = 4.0) -> bytes:
+    """Render a test tone in one of FIXTURE_FORMATS with ffmpeg"""
+    result = subprocess.run([
+        'ffmpeg',
+        '-f', 'lavfi',
+        '-i', f'sine=frequency=220:duration={seconds}',
+        *FIXTURE_FORMATS[audio_format],
+        '-loglevel', 'error',
+        'pipe:1'
+    ], capture_output=True, check=True)
+    return result.stdout
+
+
+class FakeUpstreams:
+    """FastAPI app faking the upstream APIs, with request and error counters"""
+
+    def __init__(self, profiles: Optional[Dict[str, EndpointProfile]] = None, audio_seconds: float = 4.0):
+        self.profiles = dict(DEFAULT_PROFILES)
+        self.profiles.update(profiles or {})
+        self.audio_seconds = audio_seconds
+        self.requests: Counter = Counter()
+        self.errors: Counter = Counter()
+        self._fixtures: Dict[str, bytes] = {}
+        self._ids = itertools.count(1)
+        self.app = self._build_app()
+
+    def fixture(self, audio_format: str) -> bytes:
+        if audio_format not in self._fixtures:
+            self._fixtures[audio_format] = render_fixture(audio_format, self.audio_seconds)
+        return self._fixtures[audio_format]
+
+    async def _simulate(self, endpoint: str) -> Optional[Response]:
+        """Wait the endpoint's latency; return an error response if this call fails"""
+        profile = self.profiles.get(endpoint, EndpointProfile())
+        self.requests[endpoint] += 1
+        await asyncio.sleep(profile.sample_latency())
+        if random.random() < profile.error_rate:
+            self.errors[endpoint] += 1
+            return JSONResponse({"error": {"message": f"Injected failure in {endpoint}"}}, status_code=500)
+        return None
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        return {
+            endpoint: {"requests": self.requests[endpoint], "errors": self.errors[endpoint]}
+            for endpoint in sorted(self.requests)
+        }
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI(title="Fake upstreams")
+
+        # --- WhatsApp Graph API ---
+
+        @app.post("/graph/{version}/{phone_number_id}/messages")
+        async def graph_messages(version: str, phone_number_id: str, request: Request):
+            if (error := await self._simulate("graph.messages")) is not None:
+                return error
+            payload = await request.json()
+            if payload.get("status") == "read":
+                return {"success": True}
+            return {
+                "messaging_product": "whatsapp",
+                "contacts": [{"input": payload.get("to"), "wa_id": payload.get("to")}],
+                "messages": [{"id": f"wamid.fake.{next(self._ids)}"}]
+            }
+
+        @app.post("/graph/{version}/{phone_number_id}/media")
+        async def graph_media_upload(version: str, phone_number_id: str, request: Request):
+            await request.body()
+            if (error := await self._simulate("graph.media_upload")) is not None:
+                return error
+            return {"id": f"media.fake.{next(self._ids)}"}
+
+        @app.get("/graph/{version}/{media_id}")
+        async def graph_media_info(version: str, media_id: str, request: Request):
+            if (error := await self._simulate("graph.media_info")) is not None:
+                return error
+            return {
+                "id": media_id,
+                "mime_type": "audio/ogg; codecs=opus",
+                "url": f"{str(request.base_url).rstrip('/')}/graph-media/{media_id}"
+            }
+
+        @app.get("/graph-media/{media_id}")
+        async def graph_media_download(media_id: str):
+            if (error := await self._simulate("graph.media_download")) is not None:
+                return error
+            return Response(self.fixture("ogg_opus"), media_type="audio/ogg")
+
+        # --- OpenAI ---
+
+        @app.post("/openai/v1/chat/completions")
+        async def openai_chat(request: Request):
+            body = await request.json()
+            model = body.get("model", "gpt-4o-mini")
+            if not body.get("stream"):
+                if (error := await self._simulate("openai.chat")) is not None:
+                    return error
+                return {
+                    "id": f"chatcmpl-fake-{next(self._ids)}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": REPLY_TEXT},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {"prompt_tokens": 500, "completion_tokens": 60, "total_tokens": 560}
+                }
+
+            # Streaming: ~30% of the latency before the first token, the rest spread over tokens
+            profile = self.profiles["openai.chat"]
+            self.requests["openai.chat"] += 1
+            if random.random() < profile.error_rate:
+                self.errors["openai.chat"] += 1
+                return JSONResponse({"error": {"message": "Injected failure in openai.chat"}}, status_code=500)
+            total = profile.sample_latency()
+            words = REPLY_TEXT.split(" ")
+            completion_id = f"chatcmpl-fake-{next(self._ids)}"
+
+            async def events():
+                await asyncio.sleep(total * 0.3)
+                for i, word in enumerate(words):
+                    chunk = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{
+                            "index": 0,
+                            "delta": {"content": word if i == 0 else " " + word},
+                            "finish_reason": None
+                        }]
+                    }
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(total * 0.7 / len(words))
+                yield "data: [DONE]\n\n"
+
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        @app.post("/openai/v1/audio/transcriptions")
+        async def openai_transcription(request: Request):
+            await request.body()
+            if (error := await self._simulate("openai.transcription")) is not None:
+                return error
+            return {"text": "Hoe ziet jullie proces eruit?"}
+
+        # --- ElevenLabs ---
+
+        @app.post("/elevenlabs/v1/text-to-speech/{voice_id}")
+        async def elevenlabs_tts(voice_id: str, request: Request):
+            await request.body()
+            audio_format = request.query_params.get("output_format", "mp3_44100_128")
+            profile = self.profiles["elevenlabs.tts"]
+            self.requests["elevenlabs.tts"] += 1
+            if random.random() < profile.error_rate:
+                self.errors["elevenlabs.tts"] += 1
+                return JSONResponse({"detail": {"message": "Injected failure in elevenlabs.tts"}}, status_code=500)
+
+            # Like the real API, audio is streamed: first bytes after ~40% of the
+            # latency, the rest in chunks spread over the remainder
+            audio = self.fixture(audio_format)
+            total = profile.sample_latency()
+            chunk_size = 8192
+            chunk_count = max(1, -(-len(audio) // chunk_size))
+
+            async def chunks():
+                await asyncio.sleep(total * 0.4)
+                for offset in range(0, len(audio), chunk_size):
+                    yield audio[offset:offset + chunk_size]
+                    await asyncio.sleep(total * 0.6 / chunk_count)
+
+            return StreamingResponse(chunks(), media_type="application/octet-stream")
+
+        # --- OpenAI Realtime ---
+
+        @app.websocket("/openai/v1/realtime")
+        async def openai_realtime(websocket: WebSocket):
+            await websocket.accept()
+            await RealtimeFake(self, websocket).run()
+
+        return app
+
+
+class RealtimeFake:
+    """
+    One fake Realtime API session
+
+    With server_vad turn detection a turn ends REALTIME_VAD_SILENCE seconds
+    after the last input_audio_buffer.append; with turn_detection null it
+    ends on input_audio_buffer.commit + response.create. The response takes
+    the openai.realtime latency and streams the pcm_24000 fixture as deltas.
+    """
+
+    def __init__(self, fake: FakeUpstreams, websocket: WebSocket):
+        self.fake = fake
+        self.websocket = websocket
+        self.server_vad = True
+        self.audio_bytes = 0
+        self._vad_timer: Optional[asyncio.Task] = None
+        self._turns = itertools.count(1)
+
+    async def send(self, event: dict):
+        await self.websocket.send_text(json.dumps(event))
+
+    async def run(self):
+        await asyncio.sleep(self.fake.profiles["openai.realtime_connect"].sample_latency())
+        self.fake.requests["openai.realtime_connect"] += 1
+        await self.send({"type": "session.created"})
+        try:
+            while True:
+                event = json.loads(await self.websocket.receive_text())
+                await self.handle(event)
+        except WebSocketDisconnect:
+            pass
+        finally:
+            if self._vad_timer is not None:
+                self._vad_timer.cancel()
+
+    async def handle(self, event: dict):
+        event_type = event.get("type")
+        if event_type == "session.update":
+            self.server_vad = event["session"].get("turn_detection") is not None
+            await self.send({"type": "session.updated"})
+        elif event_type == "conversation.item.create":
+            await self.send({"type": "conversation.item.created"})
+        elif event_type == "input_audio_buffer.append":
+            self.audio_bytes += len(event.get("audio", "")) * 3 // 4
+            if self.server_vad:
+                if self._vad_timer is not None:
+                    self._vad_timer.cancel()
+                self._vad_timer = asyncio.create_task(self._vad_end_of_speech())
+        elif event_type == "input_audio_buffer.commit":
+            await self.commit()
+        elif event_type == "response.create":
+            asyncio.create_task(self.respond())
+
+    async def commit(self) -> str:
+        item_id = f"item_fake_{next(self._turns)}"
+        self.audio_bytes = 0
+        await self.send({"type": "input_audio_buffer.committed", "item_id": item_id})
+        await self.send({
+            "type": "conversation.item.input_audio_transcription.completed",
+            "item_id": item_id,
+            "transcript": "Hoe ziet jullie proces eruit?"
+        })
+        return item_id
+
+    async def _vad_end_of_speech(self):
+        await asyncio.sleep(REALTIME_VAD_SILENCE)
+        await self.commit()
+        await self.respond()
+
+    async def respond(self):
+        profile = self.fake.profiles["openai.realtime"]
+        self.fake.requests["openai.realtime"] += 1
+        if random.random() < profile.error_rate:
+            self.fake.errors["openai.realtime"] += 1
+            await self.send({"type": "error", "error": {"message": "Injected failure in openai.realtime"}})
+            return
+
+        # First audio after ~30% of the latency, the rest spread over the deltas
+        total = profile.sample_latency()
+        await self.send({"type": "response.created"})
+        audio = self.fake.fixture("pcm_24000")
+        delta_size = 4800  # 100ms of 24kHz PCM16
+        delta_count = max(1, -(-len(audio) // delta_size))
+        await asyncio.sleep(total * 0.3)
+        for offset in range(0, len(audio), delta_size):
+            delta = base64.b64encode(audio[offset:offset + delta_size]).decode()
+            await self.send({"type": "response.audio.delta", "delta": delta})
+            await asyncio.sleep(total * 0.7 / delta_count)
+        await self.send({"type": "response.audio.done"})
+        await self.send({"type": "response.audio_transcript.done", "transcript": REPLY_TEXT})
+        await self.send({"type": "response.done"})
@@ -0,0 +1,332 @@
+"""
+Offline load test for the webhook → voice reply path
+
+Starts the fake upstreams (benchmarks/fake_upstreams.py), points Settings at
+them, replays synthetic webhook traffic against app.main:app in-process and
+reports messages/sec plus p50/p95/p99 latency end to end and per stage.
+Requires ffmpeg, like the bot itself. No real API is called.
+
+Usage (from the repository root):
+
+    python -m benchmarks.run_benchmark --messages 200 --rate 20 --users 50
+    python -m benchmarks.run_benchmark --latency openai.chat=0.5:0.2 --error-rate elevenlabs.tts=0.02
+    python -m benchmarks.run_benchmark --set STREAMING_REPLIES=true --output streaming.json --compare baseline.json
+    python -m benchmarks.run_benchmark --audio-ratio 1 --set VOICE_PIPELINE=auto
+
+--latency takes endpoint=median[:jitter] and --error-rate endpoint=probability;
+see DEFAULT_PROFILES in fake_upstreams.py for the endpoint names. --set
+overrides any Settings field for the run.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+import httpx
+import uvicorn
+from benchmarks.fake_upstreams import EndpointProfile, FakeUpstreams, DEFAULT_PROFILES
+
+# Settings for the run; caches that would hide upstream latency are off by default
+BENCHMARK_ENV = {
+    "WHATSAPP_PHONE_NUMBER_ID": "100000000000000",
+    "WHATSAPP_BUSINESS_ACCOUNT_ID": "200000000000000",
+    "WHATSAPP_ACCESS_TOKEN": "benchmark-token",
+    "APP_ID": "benchmark-app",
+    "APP_SECRET": "benchmark-secret",
+    "WEBHOOK_VERIFY_TOKEN": "benchmark-verify",
+    "OPENAI_API_KEY": "sk-benchmark",
+    "ELEVENLABS_API_KEY": "benchmark-elevenlabs",
+    "ELEVENLABS_VOICE_ID": "benchmark-voice",
+    "ALLOWED_PHONE_NUMBERS": "",
+    "WHATSAPP_HTTP2": "false",
+    "TTS_CACHE_ENABLED": "false",
+    "TTS_PREWARM_PHRASES": "",
+    "WHATSAPP_MEDIA_CACHE_SIZE": "0",
+    "DEDUP_BACKEND": "memory",
+    "CONVERSATION_BACKEND": "memory",
+    "LOG_LEVEL": "WARNING",
+}
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of `values` in seconds"""
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p50": round(pick(0.50), 4),
+        "p95": round(pick(0.95), 4),
+        "p99": round(pick(0.99), 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def parse_profiles(latency: List[str], error_rate: List[str]) -> Dict[str, EndpointProfile]:
+    profiles = {name: EndpointProfile(p.latency, p.jitter, p.error_rate) for name, p in DEFAULT_PROFILES.items()}
+    for spec in latency:
+        name, value = spec.split("=", 1)
+        median, _, jitter = value.partition(":")
+        profile = profiles.setdefault(name, EndpointProfile())
+        profile.latency = float(median)
+        if jitter:
+            profile.jitter = float(jitter)
+    for spec in error_rate:
+        name, value = spec.split("=", 1)
+        profiles.setdefault(name, EndpointProfile()).error_rate = float(value)
+    return profiles
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(fake: FakeUpstreams, port: int) -> uvicorn.Server:
+    """Run the fake upstreams on a background thread"""
+    server = uvicorn.Server(uvicorn.Config(fake.app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    deadline = time.monotonic() + 10
+    while not server.started:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Fake upstream server did not start")
+        time.sleep(0.05)
+    return server
+
+
+def webhook_payload(message_id: str, from_number: str, message_type: str) -> Dict[str, Any]:
+    message: Dict[str, Any] = {
+        "from": from_number,
+        "id": message_id,
+        "timestamp": str(int(time.time())),
+        "type": message_type,
+    }
+    if message_type == "text":
+        message["text"] = {"body": "Wat doen jullie precies?"}
+    else:
+        message["audio"] = {"id": f"incoming.{message_id}", "mime_type": "audio/ogg; codecs=opus", "voice": True}
+    return {
+        "object": "whatsapp_business_account",
+        "entry": [{
+            "id": BENCHMARK_ENV["WHATSAPP_BUSINESS_ACCOUNT_ID"],
+            "changes": [{
+                "field": "messages",
+                "value": {
+                    "messaging_product": "whatsapp",
+                    "metadata": {"phone_number_id": BENCHMARK_ENV["WHATSAPP_PHONE_NUMBER_ID"]},
+                    "contacts": [{"wa_id": from_number, "profile": {"name": "Bench"}}],
+                    "messages": [message],
+                },
+            }],
+        }],
+    }
+
+
+def webhook_headers(body: bytes) -> Dict[str, str]:
+    """Request headers for a webhook POST, signed like Meta's (X-Hub-Signature-256)"""
+    signature = hmac.new(BENCHMARK_ENV["APP_SECRET"].encode(), body, hashlib.sha256).hexdigest()
+    return {"Content-Type": "application/json", "X-Hub-Signature-256": f"sha256={signature}"}
+
+
+async def drive(args: argparse.Namespace) -> Dict[str, Any]:
+    """Replay webhook traffic against app.main:app and collect traces"""
+    # Imported here so Settings picks up the benchmark environment
+    from app import main as app_main
+    from app.metrics import add_trace_listener
+
+    finished: Dict[str, Any] = {}
+    traces: List[Any] = []
+
+    def on_trace(trace):
+        traces.append(trace)
+        # Coalesced messages are finished by the reply that answers them
+        if trace.outcome == "coalesced":
+            return
+        for message_id in [trace.message_id] + trace.merged_ids:
+            finished[message_id] = trace
+
+    add_trace_listener(on_trace)
+
+    for handler in app_main.app.router.on_startup:
+        await handler()
+
+    submitted: Dict[str, float] = {}
+    responses: Dict[int, int] = {}
+    rng = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=app_main.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        async def post(message_id: str, body: bytes):
+            submitted[message_id] = time.perf_counter()
+            response = await client.post("/webhook", content=body, headers=webhook_headers(body))
+            responses[response.status_code] = responses.get(response.status_code, 0) + 1
+            if response.status_code != 200:
+                submitted.pop(message_id, None)
+
+        started = time.perf_counter()
+        posts = []
+        for i in range(args.messages):
+            # Open-loop arrivals at --rate messages/sec
+            delay = started + i / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            message_id = f"wamid.bench.{i}"
+            from_number = f"3161{rng.randrange(args.users):07d}"
+            message_type = "audio" if rng.random() < args.audio_ratio else "text"
+            body = json.dumps(webhook_payload(message_id, from_number, message_type)).encode()
+            posts.append(asyncio.create_task(post(message_id, body)))
+        await asyncio.gather(*posts)
+
+        deadline = time.perf_counter() + args.timeout
+        while any(message_id not in finished for message_id in submitted):
+            if time.perf_counter() > deadline:
+                break
+            await asyncio.sleep(0.1)
+
+    for handler in app_main.app.router.on_shutdown:
+        await handler()
+
+    answered = [m for m in submitted if m in finished]
+    end_to_end = [finished[m].finished - submitted[m] for m in answered]
+    # One trace per reply (a coalesced reply answers several messages)
+    completed = list({id(finished[m]): finished[m] for m in answered}.values())
+    # Stages of coalesced messages (download, transcription) are on their own traces
+    handled = [trace for trace in traces if trace.message_id in submitted]
+    stages: Dict[str, List[float]] = {}
+    for trace in handled:
+        for name, seconds in trace.stages:
+            stages.setdefault(f"{name}[{trace.message_type}]", []).append(seconds)
+
+    encode_profiles: Dict[str, int] = {}
+    voice_pipelines: Dict[str, int] = {}
+    for trace in handled:
+        profile = trace.tags.get("encode_profile")
+        if profile:
+            encode_profiles[profile] = encode_profiles.get(profile, 0) + 1
+        pipeline = trace.tags.get("voice_pipeline")
+        if pipeline:
+            voice_pipelines[pipeline] = voice_pipelines.get(pipeline, 0) + 1
+
+    elapsed = (max(t.finished for t in completed) - started) if completed else 0.0
+    return {
+        "messages": args.messages,
+        "accepted": len(submitted),
+        "completed": len(answered),
+        "replies": len(completed),
+        "failed": sum(1 for m in answered if finished[m].outcome != "ok"),
+        "http_responses": {str(code): count for code, count in sorted(responses.items())},
+        "throughput_msgs_per_sec": round(len(answered) / elapsed, 3) if elapsed else 0.0,
+        "end_to_end": percentiles(end_to_end),
+        "stages": {name: percentiles(values) for name, values in sorted(stages.items())},
+        "encode_profiles": encode_profiles,
+        "voice_pipelines": voice_pipelines,
+    }
+
+
+def print_report(results: Dict[str, Any], previous: Optional[Dict[str, Any]] = None):
+    def delta(path: List[str]) -> str:
+        if previous is None:
+            return ""
+        old, new = previous, results
+        for key in path:
+            old = old.get(key, {}) if isinstance(old, dict) else {}
+            new = new.get(key, {}) if isinstance(new, dict) else {}
+        if not isinstance(old, (int, float)) or not old:
+            return ""
+        return f" ({(new - old) / old * 100:+.1f}%)"
+
+    print(f"\nMessages: {results['completed']}/{results['accepted']} completed "
+          f"({results['failed']} failed, {results.get('replies', results['completed'])} replies), "
+          f"HTTP {results['http_responses']}")
+    print(f"Throughput: {results['throughput_msgs_per_sec']} msg/s{delta(['throughput_msgs_per_sec'])}")
+    print(f"\n{'stage':<36}{'count':>7}{'p50':>18}{'p95':>18}{'p99':>18}")
+    rows = [("end_to_end", results["end_to_end"], ["end_to_end"])]
+    rows += [(name, values, ["stages", name]) for name, values in results["stages"].items()]
+    for name, values, path in rows:
+        if not values.get("count"):
+            continue
+        cells = "".join(f"{values[q]:>9.3f}s{delta(path + [q]):<9}" for q in ("p50", "p95", "p99"))
+        print(f"{name:<36}{values['count']:>7}{cells}")
+
+    if results.get("encode_profiles"):
+        print(f"\nEncode profiles: {results['encode_profiles']}")
+    if results.get("voice_pipelines"):
+        print(f"Voice pipelines: {results['voice_pipelines']}")
+
+    print("\nUpstream requests:")
+    for endpoint, counts in results["upstreams"].items():
+        print(f"  {endpoint:<24}{counts['requests']:>7} requests {counts['errors']:>5} errors")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100, help="Webhook messages to send")
+    parser.add_argument("--rate", type=float, default=10.0, help="Arrival rate (messages/sec)")
+    parser.add_argument("--users", type=int, default=25, help="Distinct sender numbers")
+    parser.add_argument("--audio-ratio", type=float, default=0.5, help="Share of voice notes vs text")
+    parser.add_argument("--audio-seconds", type=float, default=4.0, help="Length of fake audio")
+    parser.add_argument("--latency", action="append", default=[], metavar="ENDPOINT=MEDIAN[:JITTER]")
+    parser.add_argument("--error-rate", action="append", default=[], metavar="ENDPOINT=P")
+    parser.add_argument("--set", action="append", default=[], metavar="SETTING=VALUE",
+                        help="Override a Settings field for this run")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Seconds to wait for replies")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write results JSON here")
+    parser.add_argument("--compare", help="Previous results JSON to compare against")
+    args = parser.parse_args(argv)
+
+    random.seed(args.seed)
+    fake = FakeUpstreams(parse_profiles(args.latency, args.error_rate), audio_seconds=args.audio_seconds)
+    for audio_format in ("mp3_44100_128", "ogg_opus"):
+        fake.fixture(audio_format)
+
+    port = free_port()
+    server = start_fake_server(fake, port)
+    base = f"http://127.0.0.1:{port}"
+
+    os.environ.update(BENCHMARK_ENV)
+    os.environ.update({
+        "WHATSAPP_API_BASE_URL": f"{base}/graph",
+        "OPENAI_BASE_URL": f"{base}/openai/v1",
+        "ELEVENLABS_BASE_URL": f"{base}/elevenlabs",
+        "REALTIME_API_URL": f"ws://127.0.0.1:{port}/openai/v1/realtime",
+    })
+    for override in args.set:
+        key, value = override.split("=", 1)
+        os.environ[key] = value
+
+    try:
+        results = asyncio.run(drive(args))
+    finally:
+        server.should_exit = True
+
+    results["upstreams"] = fake.stats()
+    results["config"] = {key: value for key, value in vars(args).items() if key not in ("output", "compare")}
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_report(results, previous)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,9 @@
+import os
+
+# app.config builds Settings() at import; give the required credentials dummy values
+for name in (
+    "WHATSAPP_PHONE_NUMBER_ID", "WHATSAPP_BUSINESS_ACCOUNT_ID", "WHATSAPP_ACCESS_TOKEN",
+    "APP_ID", "APP_SECRET", "WEBHOOK_VERIFY_TOKEN",
+    "OPENAI_API_KEY", "ELEVENLABS_API_KEY", "ELEVENLABS_VOICE_ID"
+):
+    os.environ.setdefault(name, "test")
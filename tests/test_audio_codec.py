@@ -0,0 +1,183 @@
+import asyncio
+import io
+import math
+import shutil
+import struct
+import subprocess
+import pytest
+from app import audio_codec as codec_module
+from app.audio_codec import ID3v2Stripper, id3v2_tag_size
+
+
+def id3_tag(payload: bytes) -> bytes:
+    size = len(payload)
+    synchsafe = bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+    return b"ID3\x04\x00\x00" + synchsafe + payload
+
+
+MP3_FRAMES = b"\xff\xfb\x90\x64" + b"\x00" * 60
+
+
+def test_id3v2_tag_size_reads_the_synchsafe_size():
+    assert id3v2_tag_size(id3_tag(b"x" * 300)) == 310
+    assert id3v2_tag_size(MP3_FRAMES) == 0
+    assert id3v2_tag_size(b"ID3") == 0
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 10, 64, 4096])
+def test_stripper_drops_the_tag_across_chunks(chunk_size):
+    data = id3_tag(b"TIT2" + b"x" * 200) + MP3_FRAMES
+    stripper = ID3v2Stripper()
+    out = b"".join(stripper.feed(data[i:i + chunk_size]) for i in range(0, len(data), chunk_size))
+    assert out + stripper.flush() == MP3_FRAMES
+
+
+def test_stripper_passes_untagged_audio_through():
+    stripper = ID3v2Stripper()
+    assert stripper.feed(MP3_FRAMES[:2]) == MP3_FRAMES[:2]
+    assert stripper.feed(MP3_FRAMES[2:]) == MP3_FRAMES[2:]
+
+
+def test_stripper_flushes_short_input():
+    stripper = ID3v2Stripper()
+    assert stripper.feed(b"ID") == b""
+    assert stripper.flush() == b"ID"
+
+
+def tone_pcm(seconds: float, rate: int) -> bytes:
+    samples = int(seconds * rate)
+    return b"".join(struct.pack("<h", int(8000 * math.sin(2 * math.pi * 440 * n / rate))) for n in range(samples))
+
+
+def ffmpeg_mp3(seconds: float = 1.0) -> bytes:
+    """
+    Test tone as ffmpeg's MP3 muxer writes it (ID3v2 tag first)
+
+    Uses the ffmpeg CLI when installed, else the same libavformat muxer through PyAV.
+    """
+    if shutil.which("ffmpeg"):
+        return subprocess.run([
+            "ffmpeg", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}",
+            "-ar", "44100", "-b:a", "128k", "-f", "mp3", "-loglevel", "error", "pipe:1"
+        ], capture_output=True, check=True).stdout
+
+    av = pytest.importorskip("av")
+    output = io.BytesIO()
+    with av.open(output, "w", format="mp3") as container:
+        stream = container.add_stream("libmp3lame", rate=44100)
+        stream.layout = "mono"
+        stream.bit_rate = 128000
+        frame = av.AudioFrame(format="s16", layout="mono", samples=int(seconds * 44100))
+        frame.sample_rate = 44100
+        frame.planes[0].update(tone_pcm(seconds, 44100))
+        resampler = av.AudioResampler(format=stream.codec_context.format.name, layout="mono", rate=44100)
+        for resampled in resampler.resample(frame):
+            for packet in stream.encode(resampled):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return output.getvalue()
+
+
+def test_pyav_encodes_ffmpeg_mp3_with_id3_tag():
+    pytest.importorskip("av")
+    mp3 = ffmpeg_mp3()
+    assert mp3.startswith(b"ID3")
+
+    codec = codec_module.PyAVCodec(workers=1)
+    ogg = codec.encode_sync(mp3, "mp3_44100_128")
+    assert ogg.startswith(b"OggS")
+
+    async def streamed():
+        encoder = codec.open_encoder("mp3_44100_128")
+        await encoder.start()
+        for i in range(0, len(mp3), 1000):
+            await encoder.write(mp3[i:i + 1000])
+        return await encoder.finish()
+
+    assert asyncio.run(streamed()).startswith(b"OggS")
+
+
+def test_pyav_abort_waits_for_the_running_feed():
+    pytest.importorskip("av")
+    mp3 = ffmpeg_mp3(2.0)
+    codec = codec_module.PyAVCodec(workers=2)
+
+    async def scenario():
+        encoder = codec.open_encoder("mp3_44100_128")
+        await encoder.start()
+        write = asyncio.ensure_future(encoder.write(mp3))
+        await asyncio.sleep(0)
+        await encoder.abort()
+        await asyncio.gather(write, return_exceptions=True)
+        return encoder
+
+    encoder = asyncio.run(scenario())
+    assert encoder._container is None
+    assert codec_module.encode_load.active == 0
+
+
+@pytest.fixture
+def cpu_load(monkeypatch):
+    """Stub the load average source: set cpu_load[0] to the load per core"""
+    monkeypatch.setattr(codec_module.settings, "OPUS_PROFILE", "auto")
+    monkeypatch.setattr(codec_module.settings, "OPUS_BALANCED_LOAD", 0.75)
+    monkeypatch.setattr(codec_module.settings, "OPUS_FAST_LOAD", 1.0)
+    monkeypatch.setattr(codec_module.os, "cpu_count", lambda: 4)
+    value = [0.0]
+    monkeypatch.setattr(codec_module.os, "getloadavg", lambda: (value[0] * 4, 0.0, 0.0))
+    return value
+
+
+@pytest.mark.parametrize("load, profile", [
+    (0.0, "quality"), (0.74, "quality"), (0.75, "balanced"), (0.99, "balanced"), (1.0, "fast"), (3.0, "fast")
+])
+def test_profile_follows_cpu_load_thresholds(cpu_load, load, profile):
+    cpu_load[0] = load
+    assert codec_module.EncodeLoad(capacity=4).select_profile() == profile
+
+
+@pytest.mark.parametrize("active, profile", [(2, "quality"), (3, "balanced"), (4, "fast")])
+def test_profile_follows_encodes_in_flight(cpu_load, active, profile):
+    load = codec_module.EncodeLoad(capacity=4)
+    for _ in range(active):
+        load.begin()
+    assert load.select_profile() == profile
+    load.end()
+    assert load.active == active - 1
+
+
+def test_busier_source_wins(cpu_load):
+    load = codec_module.EncodeLoad(capacity=4)
+    load.begin()
+    cpu_load[0] = 0.8
+    assert load.load() == pytest.approx(0.8)
+    assert load.select_profile() == "balanced"
+
+
+def test_missing_load_average_counts_encodes_only(cpu_load, monkeypatch):
+    def unavailable():
+        raise OSError("no load average")
+
+    monkeypatch.setattr(codec_module.os, "getloadavg", unavailable)
+    load = codec_module.EncodeLoad(capacity=2)
+    load.begin()
+    assert load.select_profile() == "quality"
+    load.begin()
+    assert load.select_profile() == "fast"
+
+
+def test_fixed_profile_ignores_load(cpu_load, monkeypatch):
+    monkeypatch.setattr(codec_module.settings, "OPUS_PROFILE", "balanced")
+    cpu_load[0] = 5.0
+    load = codec_module.EncodeLoad(capacity=4)
+    assert load.select_profile() == "balanced"
+    assert load.preferred_profile == "balanced"
+
+
+def test_resolve_counts_the_chosen_profile(cpu_load):
+    load = codec_module.EncodeLoad(capacity=4)
+    cpu_load[0] = 1.2
+    assert load.resolve(None) == "fast"
+    assert load.resolve("quality") == "quality"
+    assert load.stats()["profiles"] == {"fast": 1, "quality": 1}
@@ -0,0 +1,82 @@
+import asyncio
+from app.coalescer import MAX_FLUSH_ATTEMPTS, MessageCoalescer, PendingInput
+
+
+def test_burst_is_flushed_as_one_turn():
+    async def scenario():
+        coalescer = MessageCoalescer(window=0.05, max_wait=1.0)
+        turns = []
+
+        async def on_flush(turn):
+            turns.append(turn)
+
+        coalescer.set_flush_handler(on_flush)
+        for n in range(3):
+            coalescer.add("user", PendingInput(f"m{n}", f"part {n}", "text"))
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.15)
+        return turns
+
+    turns = asyncio.run(scenario())
+    assert len(turns) == 1
+    assert turns[0].message_ids == ["m0", "m1", "m2"]
+    assert turns[0].text == "part 0\npart 1\npart 2"
+
+
+def test_max_wait_caps_the_debounce():
+    async def scenario():
+        coalescer = MessageCoalescer(window=0.05, max_wait=0.1)
+        turns = []
+
+        async def on_flush(turn):
+            turns.append(turn.message_ids)
+
+        coalescer.set_flush_handler(on_flush)
+        for n in range(8):
+            coalescer.add("user", PendingInput(f"m{n}", "x", "text"))
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.15)
+        return turns
+
+    turns = asyncio.run(scenario())
+    assert len(turns) >= 2
+    assert [message_id for turn in turns for message_id in turn] == [f"m{n}" for n in range(8)]
+
+
+def test_turn_that_could_not_be_queued_is_retried():
+    async def scenario():
+        coalescer = MessageCoalescer(window=0.02, max_wait=1.0)
+        attempts = []
+
+        async def on_flush(turn):
+            attempts.append(turn.message_ids)
+            if len(attempts) == 1:
+                raise Exception("dispatcher full")
+
+        coalescer.set_flush_handler(on_flush)
+        coalescer.add("user", PendingInput("m1", "hi", "text"))
+        await asyncio.sleep(0.2)
+        return attempts, coalescer.stats()
+
+    attempts, stats = asyncio.run(scenario())
+    assert attempts == [["m1"], ["m1"]]
+    assert stats["turns"] == 1
+
+
+def test_retries_stop_after_max_attempts():
+    async def scenario():
+        coalescer = MessageCoalescer(window=0.01, max_wait=1.0)
+        attempts = []
+
+        async def on_flush(turn):
+            attempts.append(turn.message_ids)
+            raise Exception("dispatcher full")
+
+        coalescer.set_flush_handler(on_flush)
+        coalescer.add("user", PendingInput("m1", "hi", "text"))
+        await asyncio.sleep(0.2)
+        return attempts, coalescer.stats()
+
+    attempts, stats = asyncio.run(scenario())
+    assert len(attempts) == MAX_FLUSH_ATTEMPTS
+    assert stats["users_pending"] == 0
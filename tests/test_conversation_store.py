@@ -0,0 +1,186 @@
+import asyncio
+import json
+import pytest
+from app import conversation_store as store_module
+from app.conversation_store import InMemoryConversationStore, RedisConversationStore
+
+
+def turn(n):
+    return [{"role": "user", "content": f"question {n}"}, {"role": "assistant", "content": f"answer {n}"}]
+
+
+class FakePipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.commands = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args: self.commands.append((name, args))
+
+    async def execute(self):
+        self.redis.pipelines += 1
+        for name, args in self.commands:
+            await getattr(self.redis, name)(*args)
+
+
+class FakeRedis:
+    """The list commands RedisConversationStore uses"""
+
+    def __init__(self):
+        self.lists = {}
+        self.ttls = {}
+        self.reads = 0
+        self.pipelines = 0
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    async def lrange(self, key, start, end):
+        self.reads += 1
+        return list(self.lists.get(key, []))
+
+    async def rpush(self, key, *values):
+        self.lists.setdefault(key, []).extend(values)
+
+    async def ltrim(self, key, start, end):
+        self.lists[key] = self.lists.get(key, [])[start:][:None if end == -1 else end + 1]
+
+    async def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    async def delete(self, key):
+        self.lists.pop(key, None)
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(store_module, "get_redis", lambda: fake)
+    return fake
+
+
+def memory_store(max_messages=4, **kwargs):
+    options = {"ttl": 60, "max_users": 100, "max_bytes": 1_000_000, **kwargs}
+    return InMemoryConversationStore(max_messages=max_messages, **options)
+
+
+def redis_store(max_messages=4, cache_ttl=60.0):
+    return RedisConversationStore(ttl=60, max_messages=max_messages, cache_size=10, cache_ttl=cache_ttl)
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_append_keeps_the_newest_max_messages(redis, backend):
+    store = memory_store() if backend == "memory" else redis_store()
+
+    async def scenario():
+        for n in range(3):
+            await store.append("user", *turn(n))
+        return await store.get_messages("user")
+
+    assert asyncio.run(scenario()) == turn(1) + turn(2)
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_clear_removes_the_history(redis, backend):
+    store = memory_store() if backend == "memory" else redis_store()
+
+    async def scenario():
+        await store.append("user", *turn(0))
+        await store.append("other", *turn(1))
+        await store.clear("user")
+        return await store.get_messages("user"), await store.get_messages("other")
+
+    assert asyncio.run(scenario()) == ([], turn(1))
+
+
+def test_memory_history_expires_after_ttl():
+    store = memory_store(ttl=0)
+
+    async def scenario():
+        await store.append("user", *turn(0))
+        return await store.get_messages("user")
+
+    assert asyncio.run(scenario()) == []
+
+
+def test_memory_store_evicts_least_recent_users_past_max_users():
+    store = memory_store(max_users=2)
+
+    async def scenario():
+        for user in ("a", "b"):
+            await store.append(user, *turn(0))
+        await store.get_messages("a")
+        await store.append("c", *turn(0))
+        return [await store.get_messages(user) != [] for user in ("a", "b", "c")]
+
+    assert asyncio.run(scenario()) == [True, False, True]
+    assert store.stats()["evictions"] == 1
+
+
+def test_redis_append_is_one_pipeline_with_trim_and_ttl(redis):
+    store = redis_store(max_messages=3)
+
+    async def scenario():
+        await store.append("user", *turn(0))
+        await store.append("user", *turn(1))
+
+    asyncio.run(scenario())
+    stored = [json.loads(item) for item in redis.lists["conversation:user"]]
+    assert stored == (turn(0) + turn(1))[-3:]
+    assert redis.ttls["conversation:user"] == 60
+    assert redis.pipelines == 2
+
+
+def test_redis_cache_stays_coherent_after_append(redis):
+    store = redis_store()
+
+    async def scenario():
+        await store.append("user", *turn(0))
+        first = await store.get_messages("user")
+        await store.append("user", *turn(1))
+        second = await store.get_messages("user")
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == turn(0)
+    assert second == turn(0) + turn(1)
+    # Only the first read went to Redis; the append wrote through to the cache
+    assert redis.reads == 1
+    assert store.stats()["cache_hits"] == 1
+
+
+def test_redis_cache_picks_up_other_workers_writes_after_cache_ttl(redis):
+    worker_a, worker_b = redis_store(cache_ttl=0.05), redis_store(cache_ttl=0.05)
+
+    async def scenario():
+        await worker_a.append("user", *turn(0))
+        await worker_a.get_messages("user")
+        await worker_b.append("user", *turn(1))
+        cached = await worker_a.get_messages("user")
+        await asyncio.sleep(0.06)
+        # Appending to a stale entry must not make it look fresh again
+        await worker_a.append("user", *turn(2))
+        return cached, await worker_a.get_messages("user")
+
+    cached, refreshed = asyncio.run(scenario())
+    assert cached == turn(0)
+    assert refreshed == turn(1) + turn(2)
+
+
+def test_redis_replace_overwrites_history_and_cache(redis):
+    store = redis_store()
+
+    async def scenario():
+        await store.append("user", *turn(0))
+        await store.get_messages("user")
+        await store.replace("user", turn(5))
+        return await store.get_messages("user")
+
+    assert asyncio.run(scenario()) == turn(5)
+    assert [json.loads(item) for item in redis.lists["conversation:user"]] == turn(5)
@@ -0,0 +1,42 @@
+import asyncio
+from app.dedup import InMemoryDeduplicator
+
+
+def test_second_delivery_is_a_duplicate():
+    async def scenario():
+        dedup = InMemoryDeduplicator(ttl=60, max_entries=100)
+        return [await dedup.is_duplicate(message_id) for message_id in ("a", "b", "a")]
+
+    assert asyncio.run(scenario()) == [False, False, True]
+
+
+def test_forget_lets_a_redelivery_through():
+    async def scenario():
+        dedup = InMemoryDeduplicator(ttl=60, max_entries=100)
+        await dedup.is_duplicate("a")
+        await dedup.forget("a")
+        return await dedup.is_duplicate("a")
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_ids_expire_after_ttl():
+    async def scenario():
+        dedup = InMemoryDeduplicator(ttl=0, max_entries=100)
+        await dedup.is_duplicate("a")
+        return await dedup.is_duplicate("a")
+
+    assert asyncio.run(scenario()) is False
+
+
+def test_oldest_ids_are_evicted_past_max_entries():
+    async def scenario():
+        dedup = InMemoryDeduplicator(ttl=60, max_entries=2)
+        for message_id in ("a", "b", "c"):
+            await dedup.is_duplicate(message_id)
+        return await dedup.is_duplicate("a"), await dedup.is_duplicate("c"), dedup.stats()
+
+    first, last, stats = asyncio.run(scenario())
+    assert first is False
+    assert last is True
+    assert stats["tracked_ids"] == 2
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from app.dispatcher import DispatcherFull, MessageDispatcher
+
+
+def test_jobs_for_one_user_run_in_order():
+    async def scenario():
+        dispatcher = MessageDispatcher(workers=4, max_queue=16, submit_timeout=1.0)
+        await dispatcher.start()
+        done = []
+
+        def job(n, delay):
+            async def run():
+                await asyncio.sleep(delay)
+                done.append(n)
+            return run
+
+        # Earlier jobs are slower, so parallel execution would reorder them
+        for n, delay in enumerate((0.05, 0.03, 0.01, 0.0)):
+            await dispatcher.submit("user", job(n, delay))
+        while dispatcher.stats()["processed"] < 4:
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+        return done
+
+    assert asyncio.run(scenario()) == [0, 1, 2, 3]
+
+
+def test_different_users_run_in_parallel():
+    async def scenario():
+        dispatcher = MessageDispatcher(workers=2, max_queue=16, submit_timeout=1.0)
+        await dispatcher.start()
+        both_running = asyncio.Event()
+        running = set()
+
+        def job(key):
+            async def run():
+                running.add(key)
+                if len(running) == 2:
+                    both_running.set()
+                await asyncio.wait_for(both_running.wait(), 1.0)
+            return run
+
+        await dispatcher.submit("a", job("a"))
+        await dispatcher.submit("b", job("b"))
+        await asyncio.wait_for(both_running.wait(), 1.0)
+        while dispatcher.stats()["processed"] < 2:
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_job_does_not_block_the_user():
+    async def scenario():
+        dispatcher = MessageDispatcher(workers=1, max_queue=4, submit_timeout=1.0)
+        await dispatcher.start()
+        done = []
+
+        async def fail():
+            raise Exception("boom")
+
+        async def succeed():
+            done.append("ok")
+
+        await dispatcher.submit("user", fail)
+        await dispatcher.submit("user", succeed)
+        while not done:
+            await asyncio.sleep(0.01)
+        stats = dispatcher.stats()
+        await dispatcher.stop()
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["failed"] == 1
+    assert stats["processed"] == 1
+
+
+def test_submit_raises_when_queue_stays_full():
+    async def scenario():
+        # No workers started: queued jobs never leave the queue
+        dispatcher = MessageDispatcher(workers=1, max_queue=1, submit_timeout=0.05)
+        await dispatcher.submit("user", lambda: asyncio.sleep(0))
+        with pytest.raises(DispatcherFull):
+            await dispatcher.submit("other", lambda: asyncio.sleep(0))
+        return dispatcher.stats()
+
+    assert asyncio.run(scenario())["rejected"] == 1
@@ -0,0 +1,41 @@
+from app.history import message_tokens, split_history, summary_message
+
+
+def turn(n):
+    return [
+        {"role": "user", "content": f"question {n} " * 5},
+        {"role": "assistant", "content": f"answer {n} " * 5}
+    ]
+
+
+def test_everything_fits():
+    history = turn(1) + turn(2)
+    summary, kept, dropped = split_history(history, budget=10_000, max_messages=30)
+    assert summary is None
+    assert kept == history
+    assert dropped == []
+
+
+def test_oldest_turns_are_dropped_past_the_budget():
+    history = turn(1) + turn(2) + turn(3)
+    budget = sum(message_tokens(message) for message in history[-2:])
+    summary, kept, dropped = split_history(history, budget=budget, max_messages=30)
+    assert kept == history[-2:]
+    assert dropped == history[:-2]
+
+
+def test_summary_counts_against_the_budget():
+    summary = summary_message("The user asked about pricing.")
+    history = [summary] + turn(1) + turn(2)
+    budget = message_tokens(summary) + sum(message_tokens(message) for message in history[-2:])
+    found, kept, dropped = split_history(history, budget=budget, max_messages=30)
+    assert found == summary
+    assert kept == history[-2:]
+    assert dropped == history[1:3]
+
+
+def test_message_cap_leaves_room_for_the_next_turn():
+    history = turn(1) + turn(2) + turn(3)
+    _, kept, dropped = split_history(history, budget=10_000, max_messages=5)
+    assert len(kept) == 2
+    assert dropped == history[:4]
@@ -0,0 +1,173 @@
+import asyncio
+import json
+import pytest
+from app import realtime_pool as pool_module
+from app.realtime_pool import RealtimeSessionPool
+
+CONFIG = {"modalities": ["audio", "text"], "voice": "alloy"}
+HISTORY = [{"role": "user", "content": "Hoi"}, {"role": "assistant", "content": "Hallo!"}]
+
+
+class FakeWebSocket:
+    """Realtime API connection that confirms session.update (or answers with an error)"""
+
+    def __init__(self, reply="session.updated"):
+        self.reply = reply
+        self.sent = []
+        self.open = True
+
+    async def send(self, data):
+        self.sent.append(json.loads(data))
+
+    def __aiter__(self):
+        return self._events()
+
+    async def _events(self):
+        yield json.dumps({"type": self.reply, "error": {"message": "bad session"}})
+
+    async def close(self):
+        self.open = False
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Every websockets.connect() call, in order"""
+    opened = []
+
+    async def connect(url, extra_headers=None):
+        opened.append(FakeWebSocket())
+        return opened[-1]
+
+    monkeypatch.setattr(pool_module.websockets, "connect", connect)
+    return opened
+
+
+def make_pool(max_sessions=10):
+    return RealtimeSessionPool(max_sessions=max_sessions, idle_timeout=300, max_age=3600)
+
+
+async def one_turn(pool, user, history, config=CONFIG):
+    """Check a session out, answer one voice note, return it"""
+    async with pool.session(user, history, config) as session:
+        session.record_turn({"role": "user", "content": "vraag"}, {"role": "assistant", "content": "antwoord"})
+        return session
+
+
+def test_new_session_is_configured_with_the_history(connections):
+    session = asyncio.run(one_turn(make_pool(), "user", HISTORY))
+
+    sent = connections[0].sent
+    assert sent[0] == {"type": "session.update", "session": CONFIG}
+    assert [event["item"]["role"] for event in sent[1:]] == ["user", "assistant"]
+    assert sent[2]["item"]["content"][0]["type"] == "text"
+    assert session.pooled and not session.in_use
+
+
+def test_session_is_reused_while_the_history_matches(connections):
+    pool = make_pool()
+
+    async def scenario():
+        first = await one_turn(pool, "user", HISTORY)
+        second = await one_turn(pool, "user", first.history)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first is second
+    assert len(connections) == 1
+    assert (pool.stats()["created"], pool.stats()["reused"]) == (1, 1)
+
+
+def test_session_is_rebuilt_when_the_history_moved_on(connections):
+    pool = make_pool()
+
+    async def scenario():
+        first = await one_turn(pool, "user", HISTORY)
+        # A text message was answered on the cascade in between
+        moved_on = first.history + [{"role": "user", "content": "tekst"}, {"role": "assistant", "content": "ok"}]
+        return await one_turn(pool, "user", moved_on)
+
+    session = asyncio.run(scenario())
+    assert len(connections) == 2
+    assert not connections[0].open
+    assert session.ws is connections[1]
+
+
+def test_session_is_rebuilt_on_config_mismatch(connections):
+    pool = make_pool()
+
+    async def scenario():
+        first = await one_turn(pool, "user", HISTORY)
+        return await one_turn(pool, "user", first.history, {**CONFIG, "voice": "verse"})
+
+    session = asyncio.run(scenario())
+    assert len(connections) == 2
+    assert not connections[0].open
+    assert session.config["voice"] == "verse"
+
+
+def test_closed_connection_is_not_reused(connections):
+    pool = make_pool()
+
+    async def scenario():
+        first = await one_turn(pool, "user", HISTORY)
+        connections[0].open = False
+        return await one_turn(pool, "user", first.history)
+
+    asyncio.run(scenario())
+    assert len(connections) == 2
+
+
+def test_session_is_discarded_after_an_error(connections):
+    pool = make_pool()
+
+    async def scenario():
+        with pytest.raises(Exception, match="boom"):
+            async with pool.session("user", HISTORY, CONFIG):
+                raise Exception("boom")
+        stats = pool.stats()
+        await one_turn(pool, "user", HISTORY)
+        return stats
+
+    stats = asyncio.run(scenario())
+    assert stats["sessions"] == 0
+    assert not connections[0].open
+    assert len(connections) == 2
+
+
+def test_setup_error_closes_the_connection(monkeypatch):
+    failing = FakeWebSocket(reply="error")
+
+    async def connect(url, extra_headers=None):
+        return failing
+
+    monkeypatch.setattr(pool_module.websockets, "connect", connect)
+    pool = make_pool()
+    with pytest.raises(Exception, match="Realtime API error"):
+        asyncio.run(one_turn(pool, "user", HISTORY))
+    assert not failing.open
+    assert pool.stats()["sessions"] == 0
+
+
+def test_full_pool_closes_the_least_recent_idle_session(connections):
+    pool = make_pool(max_sessions=2)
+
+    async def scenario():
+        for user in ("a", "b", "c"):
+            await one_turn(pool, user, HISTORY)
+
+    asyncio.run(scenario())
+    assert [ws.open for ws in connections] == [False, True, True]
+    assert pool.stats()["sessions"] == 2
+
+
+def test_extra_session_is_closed_after_its_turn_when_all_are_busy(connections):
+    pool = make_pool(max_sessions=1)
+
+    async def scenario():
+        async with pool.session("a", HISTORY, CONFIG):
+            extra = await one_turn(pool, "b", HISTORY)
+        return extra
+
+    extra = asyncio.run(scenario())
+    assert not extra.pooled
+    assert [ws.open for ws in connections] == [True, False]
@@ -0,0 +1,45 @@
+import time
+import pytest
+from app.reply_guard import ReplyDeadlineExceeded, ReplyGuard, ReplySuperseded
+
+
+def test_newer_message_supersedes_the_reply():
+    guard = ReplyGuard(deadline=60)
+    generation = guard.bump("user")
+    with guard.scope("user", generation, time.monotonic()):
+        guard.check("get_ai_response")
+        guard.bump("user")
+        with pytest.raises(ReplySuperseded):
+            guard.check("elevenlabs")
+    assert guard.stats()["superseded"] == 1
+
+
+def test_reply_past_its_deadline_is_stopped():
+    guard = ReplyGuard(deadline=5)
+    generation = guard.bump("user")
+    with guard.scope("user", generation, time.monotonic() - 10):
+        with pytest.raises(ReplyDeadlineExceeded):
+            guard.check("upload_audio")
+
+
+def test_check_outside_a_scope_is_a_no_op():
+    guard = ReplyGuard(deadline=0)
+    guard.bump("user")
+    guard.check("elevenlabs")
+
+
+def test_supersede_can_be_disabled():
+    guard = ReplyGuard(deadline=60, supersede=False)
+    generation = guard.bump("user")
+    with guard.scope("user", generation, time.monotonic()):
+        guard.bump("user")
+        guard.check("elevenlabs")
+
+
+def test_idle_users_are_forgotten():
+    guard = ReplyGuard(deadline=0.01)
+    guard.bump("old")
+    time.sleep(0.02)
+    guard.bump("new")
+    assert guard.stats()["users"] == 1
+    assert guard.current("old") == 0
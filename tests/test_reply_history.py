@@ -0,0 +1,140 @@
+import asyncio
+import time
+from types import SimpleNamespace
+import pytest
+from app import ai_agent, main
+from app.coalescer import MessageCoalescer, PendingInput, PendingTurn
+from app.config import settings
+from app.conversation_store import InMemoryConversationStore
+from app.reply_guard import ReplyGuard, ReplySuperseded
+
+REPLY = "Nou kijk, dat kunnen we zeker voor je bouwen. Wat voor systemen gebruik je nu?"
+
+
+class FakeStream:
+    """Streamed completion: REPLY word by word"""
+
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self):
+        for word in REPLY.split(" "):
+            await asyncio.sleep(0)
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=word + " "))])
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeCompletions:
+    """chat.completions stand-in answering REPLY, whole or as a stream of deltas"""
+
+    def __init__(self):
+        self.streams = []
+
+    async def create(self, stream=False, **kwargs):
+        if not stream:
+            return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=REPLY))])
+        self.streams.append(FakeStream())
+        return self.streams[-1]
+
+
+@pytest.fixture
+def bot(monkeypatch):
+    """Reply flow of app.main with OpenAI, TTS and WhatsApp faked out"""
+    state = SimpleNamespace(
+        store=InMemoryConversationStore(ttl=60, max_messages=20, max_users=10, max_bytes=1_000_000),
+        guard=ReplyGuard(deadline=60),
+        coalescer=MessageCoalescer(window=0, max_wait=1.0),
+        supersede_at=None,
+        sent=[]
+    )
+
+    def tts_stage(stage_name):
+        # A newer message arrives while this stage runs
+        if state.supersede_at == stage_name:
+            state.guard.bump("user")
+
+    async def text_to_speech(text):
+        tts_stage("elevenlabs")
+        return b"ogg"
+
+    async def sentences_to_speech(sentences):
+        try:
+            async for _ in sentences:
+                tts_stage("elevenlabs")
+                state.guard.check("elevenlabs")
+        finally:
+            await sentences.aclose()
+        return b"ogg"
+
+    async def send_audio_message(to, audio_bytes):
+        state.sent.append(to)
+
+    monkeypatch.setattr(ai_agent, "client", SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions())))
+    monkeypatch.setattr(ai_agent, "conversation_store", state.store)
+    monkeypatch.setattr(main, "reply_guard", state.guard)
+    monkeypatch.setattr(main, "message_coalescer", state.coalescer)
+    monkeypatch.setattr(main, "convert_text_to_speech_with_cleanup", text_to_speech)
+    monkeypatch.setattr(main, "convert_sentences_to_speech", sentences_to_speech)
+    monkeypatch.setattr(main.whatsapp_client, "send_audio_message", send_audio_message)
+    return state
+
+
+def answer(bot, text="Kunnen jullie met ons CRM integreren?"):
+    async def scenario():
+        generation = bot.guard.bump("user")
+        turn = PendingTurn("user", [PendingInput("m1", text, "text")])
+        with bot.guard.scope("user", generation, time.monotonic()):
+            await main.answer_turn(turn)
+
+    asyncio.run(scenario())
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_turn_is_stored_once_the_reply_is_sent(bot, monkeypatch, streaming):
+    monkeypatch.setattr(settings, "STREAMING_REPLIES", streaming)
+    answer(bot)
+
+    history = asyncio.run(bot.store.get_messages("user"))
+    assert bot.sent == ["user"]
+    assert [m["role"] for m in history] == ["user", "assistant"]
+    assert history[0]["content"] == "Kunnen jullie met ons CRM integreren?"
+    assert history[1]["content"].split() == REPLY.split()
+
+
+@pytest.mark.parametrize("streaming", [False, True])
+def test_superseded_reply_leaves_history_alone_and_restores_the_turn(bot, monkeypatch, streaming):
+    monkeypatch.setattr(settings, "STREAMING_REPLIES", streaming)
+    bot.supersede_at = "elevenlabs"
+    with pytest.raises(ReplySuperseded):
+        answer(bot)
+
+    assert bot.sent == []
+    assert asyncio.run(bot.store.get_messages("user")) == []
+    restored = bot.coalescer.take("user")
+    assert restored is not None and restored.message_ids == ["m1"]
+
+
+def test_error_reply_is_not_stored(bot, monkeypatch):
+    async def failing_create(**kwargs):
+        raise Exception("upstream down")
+
+    monkeypatch.setattr(settings, "STREAMING_REPLIES", False)
+    monkeypatch.setattr(ai_agent.client.chat.completions, "create", failing_create)
+    answer(bot)
+
+    assert bot.sent == ["user"]
+    assert asyncio.run(bot.store.get_messages("user")) == []
+
+
+def test_closing_the_sentence_stream_closes_the_completion(bot):
+    async def scenario():
+        sentences = ai_agent.stream_ai_response("user", "Hoi", remember=False)
+        first = await sentences.__anext__()
+        await sentences.aclose()
+        await asyncio.sleep(0.01)
+        return first
+
+    assert asyncio.run(scenario())
+    assert ai_agent.client.chat.completions.streams[0].closed
@@ -0,0 +1,64 @@
+import asyncio
+from app.status_aggregator import DeliveryStatusAggregator
+
+
+def make_aggregator(max_tracked=100):
+    return DeliveryStatusAggregator(max_tracked=max_tracked, flush_interval=60, window=100, use_redis=False)
+
+
+def test_delivery_and_read_latencies():
+    aggregator = make_aggregator()
+    aggregator.record("m1", "sent", 100)
+    aggregator.record("m1", "delivered", 103)
+    aggregator.record("m1", "read", 110)
+    asyncio.run(aggregator.flush())
+
+    stats = aggregator.stats()
+    assert stats["statuses"] == {"sent": 1, "delivered": 1, "read": 1}
+    assert stats["latency_seconds"]["delivered"]["p50"] == 3.0
+    assert stats["latency_seconds"]["read"]["p50"] == 10.0
+
+
+def test_redelivered_statuses_are_ignored():
+    aggregator = make_aggregator()
+    for _ in range(2):
+        aggregator.record("m1", "sent", 100)
+        aggregator.record("m1", "delivered", 101)
+    asyncio.run(aggregator.flush())
+
+    stats = aggregator.stats()
+    assert stats["statuses"] == {"sent": 1, "delivered": 1}
+    assert stats["duplicates"] == 2
+    assert stats["latency_seconds"]["delivered"]["count"] == 1
+
+
+def test_statuses_before_sent_are_reconciled_when_sent_arrives():
+    aggregator = make_aggregator()
+    aggregator.record("m1", "read", 112)
+    aggregator.record("m1", "delivered", 104)
+    assert aggregator.stats()["awaiting_sent"] == 1
+    assert aggregator.percentile("delivered", 0.95) == 0.0
+
+    aggregator.record("m1", "sent", 100)
+    asyncio.run(aggregator.flush())
+    stats = aggregator.stats()
+    assert stats["latency_seconds"]["delivered"]["p50"] == 4.0
+    assert stats["latency_seconds"]["read"]["p50"] == 12.0
+    assert (stats["unmatched"], stats["awaiting_sent"]) == (0, 0)
+
+
+def test_status_whose_sent_never_arrives_is_counted_as_unmatched():
+    aggregator = make_aggregator(max_tracked=2)
+    aggregator.record("m1", "delivered", 101)
+    assert aggregator.stats()["unmatched"] == 0
+    aggregator.record("m2", "sent", 102)
+    aggregator.record("m3", "sent", 103)
+    assert aggregator.stats()["unmatched"] == 1
+    assert aggregator.percentile("delivered", 0.95) == 0.0
+
+
+def test_tracked_messages_are_bounded():
+    aggregator = make_aggregator(max_tracked=2)
+    for n in range(5):
+        aggregator.record(f"m{n}", "sent", n)
+    assert aggregator.stats()["tracked_messages"] == 2
@@ -0,0 +1,85 @@
+import asyncio
+import os
+from app.tts_cache import TTSCache, make_cache_key
+
+
+def make_cache(path, memory_max_bytes=1000, disk_max_bytes=1000, max_text_chars=20):
+    return TTSCache(memory_max_bytes, str(path), disk_max_bytes, max_text_chars)
+
+
+async def put_and_flush(cache, key, data):
+    cache.put_nowait(key, data)
+    await asyncio.gather(*cache._writes)
+
+
+def test_cache_key_covers_every_part():
+    key = make_cache_key(text="Hoi", voice_id="v1", profile="quality")
+    assert key == make_cache_key(profile="quality", voice_id="v1", text="Hoi")
+    assert key != make_cache_key(text="Hoi", voice_id="v2", profile="quality")
+
+
+def test_short_texts_are_admitted_long_ones_on_their_second_render(tmp_path):
+    cache = make_cache(tmp_path / "tts")
+    assert cache.admit("short", 20)
+    assert not cache.admit("long", 21)
+    assert cache.admit("long", 21)
+    assert not cache.admit("long", 21)
+    assert cache.stats()["skipped"] == 2
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = TTSCache(memory_max_bytes=10, disk_dir="", disk_max_bytes=0)
+
+    async def scenario():
+        cache.put_nowait("a", b"aaaa")
+        cache.put_nowait("b", b"bbbb")
+        await cache.get("a")
+        cache.put_nowait("c", b"cccc")
+        cache.put_nowait("huge", b"x" * 11)
+        return [await cache.get(key) for key in ("a", "b", "c", "huge")]
+
+    assert asyncio.run(scenario()) == [b"aaaa", None, b"cccc", None]
+    assert cache.stats()["memory_bytes"] == 8
+
+
+def test_disk_tier_round_trips_across_instances(tmp_path):
+    directory = tmp_path / "tts"
+
+    async def scenario():
+        writer = make_cache(directory)
+        await put_and_flush(writer, "key", b"OggS voice")
+        reader = make_cache(directory)
+        await reader.start()
+        first = await reader.get("key")
+        second = await reader.get("key")
+        return reader, first, second
+
+    reader, first, second = asyncio.run(scenario())
+    assert first == second == b"OggS voice"
+    stats = reader.stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["disk_bytes"]) == (1, 1, 10)
+
+
+def test_disk_tier_evicts_least_recently_used_files(tmp_path):
+    directory = tmp_path / "tts"
+    cache = make_cache(directory, memory_max_bytes=0, disk_max_bytes=10)
+
+    async def scenario():
+        await put_and_flush(cache, "a", b"aaaa")
+        await put_and_flush(cache, "b", b"bbbb")
+        await cache.get("a")
+        await put_and_flush(cache, "c", b"cccc")
+        return [await cache.get(key) for key in ("a", "b", "c")]
+
+    assert asyncio.run(scenario()) == [b"aaaa", None, b"cccc"]
+    assert sorted(os.listdir(directory)) == ["a.ogg", "c.ogg"]
+    assert cache.stats()["disk_bytes"] == 8
+
+
+def test_directory_is_created_on_first_use_not_at_construction(tmp_path):
+    directory = tmp_path / "tts"
+    cache = make_cache(directory)
+    assert not directory.exists()
+
+    asyncio.run(cache.get("missing"))
+    assert directory.is_dir()
@@ -0,0 +1,84 @@
+import asyncio
+import time
+import pytest
+from app import tts_converter
+from app.reply_guard import ReplyGuard, ReplySuperseded
+
+
+class FakeEncoder:
+    def __init__(self):
+        self.written = []
+        self.aborted = False
+
+    async def start(self):
+        pass
+
+    async def write(self, chunk):
+        self.written.append(chunk)
+
+    async def finish(self):
+        return b"OggS" + b"".join(self.written)
+
+    async def abort(self):
+        self.aborted = True
+
+
+@pytest.fixture
+def tts(monkeypatch):
+    """convert_sentences_to_speech with one TTS slot, ElevenLabs and the encoder faked out"""
+    encoders = []
+
+    def open_encoder(output_format, tempo, profile=None):
+        encoders.append(FakeEncoder())
+        return encoders[-1]
+
+    monkeypatch.setattr(tts_converter, "_elevenlabs_chunks", lambda text: iter([b"a", b"b"]))
+    monkeypatch.setattr(tts_converter.audio_codec, "open_encoder", open_encoder)
+    monkeypatch.setattr(tts_converter, "reply_guard", ReplyGuard(deadline=60))
+    return encoders
+
+
+def test_slot_is_free_while_the_reply_waits_for_the_next_sentence(tts, monkeypatch):
+    free_between = []
+
+    async def sentences():
+        yield "Eerste zin van het antwoord."
+        await asyncio.sleep(0.05)
+        free_between.append(not tts_converter._tts_semaphore.locked())
+        yield "Tweede zin van het antwoord."
+
+    async def scenario():
+        monkeypatch.setattr(tts_converter, "_tts_semaphore", asyncio.Semaphore(1))
+        ogg = await tts_converter.convert_sentences_to_speech(sentences())
+        return ogg, tts_converter._tts_semaphore.locked()
+
+    ogg, locked_after = asyncio.run(scenario())
+    assert ogg == b"OggSabab"
+    assert free_between == [True]
+    assert not locked_after
+
+
+def test_superseded_reply_frees_its_slots_and_closes_the_sentences(tts, monkeypatch):
+    guard = tts_converter.reply_guard
+    closed = []
+
+    async def sentences():
+        try:
+            yield "Eerste zin van het antwoord."
+            guard.bump("user")
+            yield "Tweede zin van het antwoord."
+            yield "Derde zin van het antwoord."
+        finally:
+            closed.append(True)
+
+    async def scenario():
+        monkeypatch.setattr(tts_converter, "_tts_semaphore", asyncio.Semaphore(1))
+        with guard.scope("user", guard.bump("user"), time.monotonic()):
+            with pytest.raises(ReplySuperseded):
+                await tts_converter.convert_sentences_to_speech(sentences())
+        await asyncio.sleep(0.01)
+        return tts_converter._tts_semaphore.locked()
+
+    assert not asyncio.run(scenario())
+    assert closed == [True]
+    assert tts[0].aborted
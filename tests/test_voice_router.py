@@ -0,0 +1,90 @@
+import pytest
+from app import voice_router as router_module
+from app.voice_router import CASCADE, REALTIME, VoicePipelineRouter
+
+
+def make_router(mode="auto", min_samples=2, max_error_rate=0.2, explore_rate=0.0):
+    return VoicePipelineRouter(mode=mode, window=10, min_samples=min_samples,
+                               max_error_rate=max_error_rate, explore_rate=explore_rate)
+
+
+def warm_up(router, cascade_seconds=2.0, realtime_seconds=1.0):
+    """Route and record min_samples successful voice notes on each pipeline"""
+    for _ in range(2 * router.min_samples):
+        pipeline = router.choose()
+        router.record(pipeline, cascade_seconds if pipeline == CASCADE else realtime_seconds, ok=True)
+
+
+def test_warmup_routes_min_samples_to_each_pipeline():
+    router = make_router(min_samples=3)
+    assert [router.choose() for _ in range(6)] == [CASCADE] * 3 + [REALTIME] * 3
+    routed = {pipeline: stats["routed"] for pipeline, stats in router.stats()["pipelines"].items()}
+    assert routed == {CASCADE: 3, REALTIME: 3}
+
+
+@pytest.mark.parametrize("cascade_seconds, realtime_seconds, expected", [
+    (2.0, 1.0, REALTIME),
+    (1.0, 2.0, CASCADE)
+])
+def test_faster_healthy_pipeline_wins(cascade_seconds, realtime_seconds, expected):
+    router = make_router()
+    warm_up(router, cascade_seconds, realtime_seconds)
+    assert router.choose() == expected
+
+
+def test_unhealthy_pipeline_is_avoided_even_if_faster():
+    router = make_router()
+    warm_up(router, cascade_seconds=2.0, realtime_seconds=1.0)
+    for _ in range(3):
+        router.record(REALTIME, 0.5, ok=False)
+    assert router.error_rate(REALTIME) > 0.2
+    assert router.choose() == CASCADE
+
+
+def test_least_failing_pipeline_is_used_when_both_are_unhealthy():
+    router = make_router()
+    warm_up(router)
+    for _ in range(4):
+        router.record(CASCADE, 1.0, ok=False)
+    for _ in range(2):
+        router.record(REALTIME, 1.0, ok=False)
+    assert router.choose() == REALTIME
+
+
+def test_median_ignores_failed_results():
+    router = make_router()
+    for seconds in (1.0, 3.0, 2.0):
+        router.record(CASCADE, seconds, ok=True)
+    router.record(CASCADE, 0.1, ok=False)
+    assert router.median_latency(CASCADE) == 2.0
+    assert router.median_latency(REALTIME) == float("inf")
+
+
+def test_explore_sends_a_share_to_the_other_pipeline(monkeypatch):
+    router = make_router(explore_rate=0.1)
+    monkeypatch.setattr(router_module.random, "random", lambda: 0.5)
+    warm_up(router, cascade_seconds=2.0, realtime_seconds=1.0)
+    assert router.choose() == REALTIME
+    monkeypatch.setattr(router_module.random, "random", lambda: 0.05)
+    assert router.choose() == CASCADE
+
+
+@pytest.mark.parametrize("mode", [CASCADE, REALTIME])
+def test_configured_pipeline_overrides_measurements(mode):
+    router = make_router(mode=mode)
+    other = REALTIME if mode == CASCADE else CASCADE
+    for _ in range(5):
+        router.record(mode, 10.0, ok=False)
+        router.record(other, 0.1, ok=True)
+    assert {router.choose() for _ in range(5)} == {mode}
+    assert router.fallback(mode) is None
+
+
+def test_unknown_mode_falls_back_to_cascade():
+    assert make_router(mode="fastest").choose() == CASCADE
+
+
+def test_fallback_in_auto_mode_is_the_other_pipeline():
+    router = make_router()
+    assert router.fallback(REALTIME) == CASCADE
+    assert router.fallback(CASCADE) == REALTIME
@@ -0,0 +1,120 @@
+import os
+import pytest
+from app.status_aggregator import DeliveryStatusAggregator
+from app.webhook_filter import AllowList, WebhookFilter, normalize_phone, parse_phone_numbers
+from app.webhook_ingest import InvalidWebhook
+
+
+def payload(messages=(), statuses=()):
+    value = {"messaging_product": "whatsapp"}
+    if messages:
+        value["messages"] = list(messages)
+    if statuses:
+        value["statuses"] = list(statuses)
+    return {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": value}]}]}
+
+
+def text(message_id, sender):
+    return {"id": message_id, "from": sender, "type": "text", "timestamp": "1", "text": {"body": "hi"}}
+
+
+def make_filter(numbers="", path=""):
+    statuses = DeliveryStatusAggregator(max_tracked=100, flush_interval=60, window=100, use_redis=False)
+    return WebhookFilter(AllowList(numbers, path, check_interval=0), statuses)
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("+91 82260-53534", "918226053534"),
+    ("0091 8226053534", "918226053534"),
+    ("918226053534", "918226053534"),
+    ("", "")
+])
+def test_normalize_phone(raw, expected):
+    assert normalize_phone(raw) == expected
+
+
+def test_parse_phone_numbers_skips_comments_and_blanks():
+    raw = "+91 82260 53534, 31612345678\n# team\n\n0044 7700 900123  # office\n"
+    assert parse_phone_numbers(raw) == {"918226053534", "31612345678", "447700900123"}
+
+
+def test_empty_allow_list_allows_everyone():
+    assert AllowList("", "", check_interval=0).allowed("31600000000")
+
+
+def test_allow_list_matches_any_format():
+    allow_list = AllowList("+91 82260 53534", "", check_interval=0)
+    assert allow_list.allowed("918226053534")
+    assert not allow_list.allowed("31600000000")
+
+
+def test_allow_list_file_changes_are_picked_up(tmp_path):
+    path = tmp_path / "allowed.txt"
+    path.write_text("31600000001\n")
+    allow_list = AllowList("", str(path), check_interval=0)
+    assert allow_list.allowed("31600000001")
+    assert not allow_list.allowed("31600000002")
+
+    path.write_text("31600000002\n")
+    stat = path.stat()
+    os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+    assert allow_list.allowed("31600000002")
+    assert not allow_list.allowed("31600000001")
+
+
+def test_select_drops_unauthorized_senders():
+    webhook_filter = make_filter("31600000001")
+    messages = webhook_filter.select(payload([text("a", "31600000001"), text("b", "31600000002")]))
+    assert [message.id for message in messages] == ["a"]
+    assert webhook_filter.counts["accepted"] == 1
+    assert webhook_filter.counts["unauthorized"] == 0
+    assert webhook_filter.messages == {"accepted": 1, "unauthorized": 1}
+
+
+@pytest.mark.parametrize("messages, reason", [
+    ([], "status_only"),
+    ([text("b", "31600000002")], "unauthorized"),
+    ([text("a", "31600000001"), text("b", "31600000002")], "accepted")
+])
+def test_each_payload_is_counted_under_one_reason(messages, reason):
+    webhook_filter = make_filter("31600000001")
+    status = {"id": "wamid.out", "status": "delivered", "timestamp": "10"}
+    webhook_filter.select(payload(messages, statuses=[status]))
+    counted = {name: count for name, count in webhook_filter.counts.items() if count}
+    assert counted == {reason: 1}
+
+
+def test_status_only_payload_is_counted_and_recorded():
+    webhook_filter = make_filter()
+    status = {"id": "wamid.out", "status": "sent", "timestamp": "10"}
+    assert webhook_filter.select(payload(statuses=[status])) == []
+    assert webhook_filter.counts["status_only"] == 1
+    assert webhook_filter.statuses.stats()["tracked_messages"] == 1
+
+
+def test_failed_status_errors_reach_failure_listeners():
+    webhook_filter = make_filter()
+    failures = []
+    webhook_filter.statuses.add_failure_listener(lambda message_id, errors: failures.append((message_id, errors)))
+    error = {"code": 131053, "title": "Media upload error"}
+    failed = {"id": "wamid.out", "status": "failed", "timestamp": "10", "errors": [error, "junk"]}
+    webhook_filter.select(payload(statuses=[failed, failed]))
+    assert failures == [("wamid.out", [error])]
+
+
+def test_unknown_object_is_dropped():
+    webhook_filter = make_filter()
+    assert webhook_filter.select({"object": "page", "entry": []}) == []
+    assert webhook_filter.counts["unknown_object"] == 1
+
+
+@pytest.mark.parametrize("body", [
+    {"object": "whatsapp_business_account", "entry": "x"},
+    {"object": "whatsapp_business_account", "entry": [{"changes": [1]}]},
+    {"object": "whatsapp_business_account", "entry": [{"changes": [{"value": []}]}]},
+    payload([{"id": "a", "from": 316, "type": "text"}]),
+    payload([{"id": "a", "from": "316", "type": "text", "text": "not an object"}])
+])
+def test_malformed_payloads_raise_invalid_webhook(body):
+    with pytest.raises(InvalidWebhook):
+        make_filter().select(body)
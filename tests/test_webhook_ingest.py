@@ -0,0 +1,54 @@
+import hashlib
+import hmac
+import pytest
+from app.webhook_ingest import InboundMessage, InvalidWebhook, parse_webhook, verify_signature
+
+SECRET = "app-secret"
+BODY = b'{"object":"whatsapp_business_account","entry":[]}'
+
+
+def sign(raw: bytes, secret: str = SECRET) -> str:
+    return "sha256=" + hmac.new(secret.encode(), raw, hashlib.sha256).hexdigest()
+
+
+def test_valid_signature_is_accepted():
+    assert verify_signature(BODY, sign(BODY), SECRET)
+
+
+@pytest.mark.parametrize("header", [
+    None,
+    "",
+    hashlib.sha256(BODY).hexdigest(),  # no sha256= prefix
+    sign(BODY, "other-secret"),
+    sign(BODY + b" "),  # signed different bytes
+])
+def test_invalid_signatures_are_rejected(header):
+    assert not verify_signature(BODY, header, SECRET)
+
+
+def test_parse_webhook_returns_the_object():
+    assert parse_webhook(BODY) == {"object": "whatsapp_business_account", "entry": []}
+
+
+@pytest.mark.parametrize("raw", [b"not json", b"[1, 2]", b'"text"'])
+def test_parse_webhook_rejects_non_objects(raw):
+    with pytest.raises(InvalidWebhook):
+        parse_webhook(raw)
+
+
+def test_text_message_from_payload():
+    message = InboundMessage.from_payload({
+        "id": "wamid.1", "from": "918226053534", "type": "text",
+        "timestamp": "1700000000", "text": {"body": "Hallo"}
+    })
+    assert message == InboundMessage("wamid.1", "918226053534", "text", 1700000000, text="Hallo")
+
+
+def test_audio_message_from_payload():
+    message = InboundMessage.from_payload({
+        "id": "wamid.2", "from": "918226053534", "type": "audio",
+        "timestamp": "bad", "audio": {"id": "media-1", "mime_type": "audio/ogg"}
+    })
+    assert message.media_id == "media-1"
+    assert message.timestamp == 0
+    assert message.text == ""
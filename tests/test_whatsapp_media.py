@@ -0,0 +1,114 @@
+import asyncio
+import httpx
+import pytest
+from app import whatsapp
+from app.config import settings
+from app.status_aggregator import DeliveryStatusAggregator
+from app.whatsapp import WhatsAppClient
+
+AUDIO = b"OggS voice note"
+
+
+def graph_error(code, message="error"):
+    request = httpx.Request("POST", "https://graph.facebook.com/messages")
+    response = httpx.Response(400, json={"error": {"code": code, "message": message}}, request=request)
+    return httpx.HTTPStatusError(message, request=request, response=response)
+
+
+@pytest.fixture
+def client(monkeypatch):
+    """WhatsAppClient recording uploads and sends instead of calling Graph"""
+    monkeypatch.setattr(settings, "WHATSAPP_MEDIA_CACHE_SIZE", 10)
+    client = WhatsAppClient()
+    client.uploads = []
+    client.sends = []
+    client.send_errors = []
+
+    async def upload_media(audio_bytes, filename="voice_message.ogg"):
+        client.uploads.append(audio_bytes)
+        return f"media-{len(client.uploads)}"
+
+    async def send_audio_by_id(to, media_id):
+        client.sends.append(media_id)
+        if client.send_errors:
+            raise client.send_errors.pop(0)
+        return {"messages": [{"id": f"wamid.{len(client.sends)}"}]}
+
+    monkeypatch.setattr(client, "upload_media", upload_media)
+    monkeypatch.setattr(client, "_send_audio_by_id", send_audio_by_id)
+    return client
+
+
+def send(client, audio=AUDIO):
+    return asyncio.run(client.send_audio_message("31600000000", audio))
+
+
+def test_identical_audio_reuses_the_media_id(client):
+    send(client)
+    send(client)
+    send(client, b"OggS other note")
+
+    assert client.uploads == [AUDIO, b"OggS other note"]
+    assert client.sends == ["media-1", "media-1", "media-2"]
+    assert client.media_cache_stats()["hits"] == 1
+
+
+def test_rejected_media_id_is_evicted_and_uploaded_again(client):
+    send(client)
+    client.send_errors.append(graph_error(131053, "Media upload error"))
+    send(client)
+    send(client)
+
+    assert client.sends == ["media-1", "media-1", "media-2", "media-2"]
+    assert len(client.uploads) == 2
+    assert client.media_cache_stats()["rejected"] == 1
+
+
+def test_other_send_errors_are_not_retried(client):
+    send(client)
+    client.send_errors.append(graph_error(131026, "Message undeliverable"))
+    with pytest.raises(httpx.HTTPStatusError):
+        send(client)
+
+    assert len(client.uploads) == 1
+    assert client.media_cache_stats()["entries"] == 1
+
+
+def test_media_id_expires_after_the_ttl(client, monkeypatch):
+    now = [1_000_000.0]
+    monkeypatch.setattr(whatsapp.time, "time", lambda: now[0])
+    send(client)
+    now[0] += settings.WHATSAPP_MEDIA_CACHE_TTL - 1
+    send(client)
+    now[0] += 2
+    send(client)
+
+    assert client.sends == ["media-1", "media-1", "media-2"]
+
+
+def test_failed_status_with_a_media_error_evicts_the_media_id(client):
+    statuses = DeliveryStatusAggregator(max_tracked=100, flush_interval=60, window=10, use_redis=False)
+    statuses.add_failure_listener(client.on_message_failed)
+    send(client)
+    send(client)
+
+    # Recipient problems don't make the media ID stale
+    statuses.record("wamid.1", "failed", 100, [{"code": 131026, "title": "Message undeliverable"}])
+    send(client)
+    assert client.sends[-1] == "media-1"
+
+    statuses.record("wamid.2", "failed", 100, [{"code": 131052, "title": "Media download error"}])
+    send(client)
+    assert client.sends[-1] == "media-2"
+    assert client.media_cache_stats()["failed"] == 1
+
+
+def test_failed_status_for_a_replaced_media_id_keeps_the_new_one(client):
+    send(client)
+    client.send_errors.append(graph_error(131053))
+    send(client)
+
+    # wamid.1 went out with media-1, which was already replaced by media-2
+    client.on_message_failed("wamid.1", [{"code": 131053}])
+    send(client)
+    assert client.sends[-1] == "media-2"